@@ -0,0 +1,183 @@
+"""
+Контроль допуска генераций: token bucket на клиента, общий лимит одновременных квестов
+и справедливая очередь, в которой маленькие интерактивные квесты не ждут за большими
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, List, Optional
+
+
+class AdmissionRejected(Exception):
+    """Запрос не принят; retry_after — через сколько секунд имеет смысл повторить"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost: float) -> float:
+        """Списывает cost и возвращает 0 или, если токенов мало, сколько секунд ждать"""
+        now = time.monotonic()
+        self._refill(now)
+        if cost <= self.tokens:
+            self.tokens -= cost
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token bucket на каждого клиента; бакеты неактивных клиентов вытесняются"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def check(self, client: str, cost: float) -> None:
+        if self.rate <= 0:
+            return
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(client)
+        # Квест дороже всего бакета разрешён, но опустошает его целиком
+        wait = bucket.take(min(cost, self.burst))
+        if wait > 0:
+            raise AdmissionRejected(f"rate limit for {client}", wait)
+
+
+class Ticket:
+    """Место в очереди допуска. release() обязателен — и после генерации, и при отмене"""
+
+    def __init__(self, queue: "FairQueue", client: str, cost: float, tag: float, seq: int):
+        self._queue = queue
+        self.client = client
+        self.cost = cost
+        self.tag = tag
+        self.seq = seq
+        self.admitted = False
+        self.released = False
+        self._changed = asyncio.Event()
+
+    def __lt__(self, other: "Ticket") -> bool:
+        return (self.tag, self.seq) < (other.tag, other.seq)
+
+    def position(self) -> int:
+        """Номер в очереди с 1; 0 — уже допущен"""
+        if self.admitted:
+            return 0
+        return 1 + sum(1 for other in self._queue._heap if other is not self and other < self and not other.released)
+
+    async def wait(self) -> AsyncIterator[int]:
+        """Отдаёт позицию в очереди при каждом её изменении и завершается, когда квест допущен"""
+        last = None
+        while not self.admitted:
+            position = self.position()
+            if position != last:
+                last = position
+                yield position
+            self._changed.clear()
+            await self._changed.wait()
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        self._queue._release(self)
+
+
+class FairQueue:
+    """
+    Не больше `capacity` квестов генерируются одновременно, остальные ждут.
+    Порядок — взвешенная справедливая очередь: метка квеста = max(виртуальное время,
+    метка предыдущего квеста клиента) + стоимость. Меньшая метка допускается раньше,
+    поэтому дешёвые квесты обгоняют дорогие, а один клиент не вытесняет остальных.
+    """
+
+    def __init__(self, capacity: int, max_waiting: int = 100):
+        self.capacity = max(1, capacity)
+        self.max_waiting = max_waiting
+        self.active = 0
+        self._heap: List[Ticket] = []
+        self._vtime = 0.0
+        self._last_tag: Dict[str, float] = {}
+        self._seq = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for ticket in self._heap if not ticket.released)
+
+    @property
+    def full(self) -> bool:
+        return self.waiting >= self.max_waiting
+
+    def enter(self, client: str, cost: float, force: bool = False) -> Ticket:
+        """Ставит квест в очередь. force — фоновые задачи, которым нельзя отказать"""
+        if not force and self.full:
+            raise AdmissionRejected(f"admission queue is full ({self.waiting} waiting)", 5.0)
+        tag = max(self._vtime, self._last_tag.get(client, 0.0)) + cost
+        self._last_tag[client] = tag
+        ticket = Ticket(self, client, cost, tag, next(self._seq))
+        heapq.heappush(self._heap, ticket)
+        # Дешёвый квест встаёт перед уже ждущими — их позиции сдвигаются
+        self._dispatch(moved=True)
+        return ticket
+
+    def _release(self, ticket: Ticket) -> None:
+        if ticket.admitted:
+            self.active -= 1
+        # Ушедший из очереди тоже сдвигает позиции остальных
+        self._dispatch(moved=not ticket.admitted)
+
+    def _dispatch(self, moved: bool = False) -> None:
+        while self._heap and (self._heap[0].released or self.active < self.capacity):
+            ticket = heapq.heappop(self._heap)
+            if ticket.released:
+                continue
+            ticket.admitted = True
+            self.active += 1
+            self._vtime = max(self._vtime, ticket.tag - ticket.cost)
+            moved = True
+            ticket._changed.set()
+        if moved:
+            for ticket in self._heap:
+                ticket._changed.set()
+            self._prune()
+
+    def _prune(self) -> None:
+        # Клиенты, чья последняя метка позади виртуального времени, ничем не отличаются от новых
+        if len(self._last_tag) > 4 * (len(self._heap) + self.active + 16):
+            self._last_tag = {c: t for c, t in self._last_tag.items() if t > self._vtime}
+
+    def stats(self) -> Dict[str, float]:
+        return {"active": self.active, "waiting": self.waiting, "capacity": self.capacity}
+
+
+# Билет допуска текущего запроса: задача генерации наследует его при создании
+current_ticket: ContextVar[Optional[Ticket]] = ContextVar("current_ticket", default=None)
+
+
+def retry_headers(error: AdmissionRejected) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(error.retry_after)))}
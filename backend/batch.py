@@ -0,0 +1,391 @@
+"""
+Пакетная генерация квестов: очередь с приоритетами, ограниченный пул воркеров
+и SQLite-журнал прогресса, чтобы после перезапуска не повторять готовые квесты
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import log_context
+
+logger = logging.getLogger(__name__)
+
+# Статусы задания и отдельных квестов в нём
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+COMPLETED = "completed"
+
+
+class BatchQueueFull(Exception):
+    """Очередь заполнена — новый пакет сейчас не принимается"""
+
+
+class BatchStore:
+    """SQLite-журнал заданий. Все вызовы синхронные, BatchManager выносит их в поток"""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS batch_jobs (
+                id TEXT PRIMARY KEY,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS batch_items (
+                job_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                request TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                PRIMARY KEY (job_id, idx)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def create_job(self, job_id: str, priority: int, requests: List[Dict[str, Any]]) -> None:
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO batch_jobs (id, priority, status, total, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, priority, PENDING, len(requests), time.time()),
+            )
+            self._conn.executemany(
+                "INSERT INTO batch_items (job_id, idx, request, status) VALUES (?, ?, ?, ?)",
+                [(job_id, i, json.dumps(r, ensure_ascii=False), PENDING) for i, r in enumerate(requests)],
+            )
+
+    def update_item(self, job_id: str, idx: int, status: str,
+                    result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        with self._conn:
+            self._conn.execute(
+                "UPDATE batch_items SET status = ?, result = ?, error = ? WHERE job_id = ? AND idx = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, job_id, idx),
+            )
+
+    def set_job_status(self, job_id: str, status: str) -> None:
+        with self._conn:
+            self._conn.execute("UPDATE batch_jobs SET status = ? WHERE id = ?", (status, job_id))
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT id, priority, status, total, created_at FROM batch_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "priority", "status", "total", "created_at"), row))
+
+    def get_items(self, job_id: str, with_results: bool = True) -> List[Dict[str, Any]]:
+        rows = self._conn.execute(
+            "SELECT idx, status, result, error FROM batch_items WHERE job_id = ? ORDER BY idx", (job_id,)
+        ).fetchall()
+        items = []
+        for idx, status, result, error in rows:
+            item: Dict[str, Any] = {"index": idx, "status": status}
+            if error:
+                item["error"] = error
+            if with_results and result is not None:
+                item["quest"] = json.loads(result)
+            items.append(item)
+        return items
+
+    def unfinished(self) -> List[Tuple[str, int, int, Dict[str, Any]]]:
+        """Незавершённые квесты всех заданий: (job_id, priority, idx, request)"""
+        rows = self._conn.execute(
+            "SELECT i.job_id, j.priority, i.idx, i.request FROM batch_items i "
+            "JOIN batch_jobs j ON j.id = i.job_id "
+            "WHERE i.status IN (?, ?) ORDER BY j.created_at, i.idx",
+            (PENDING, RUNNING),
+        ).fetchall()
+        return [(job_id, priority, idx, json.loads(request)) for job_id, priority, idx, request in rows]
+
+    def counts(self, job_id: str) -> Dict[str, int]:
+        rows = self._conn.execute(
+            "SELECT status, COUNT(*) FROM batch_items WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+@dataclass
+class _JobState:
+    total: int
+    done: int = 0
+    failed: int = 0
+    subscribers: List["asyncio.Queue[Optional[Dict[str, Any]]]"] = field(default_factory=list)
+    queued: Set[int] = field(default_factory=set)  # индексы в очереди; повторная запись пропускается
+    running: Set["asyncio.Task[Dict[str, Any]]"] = field(default_factory=set)
+    lost: bool = False  # аренду забрал другой воркер: результаты здесь не пишутся
+
+    @property
+    def finished(self) -> bool:
+        return self.done + self.failed >= self.total
+
+
+class BatchManager:
+    """
+    Принимает пакеты запросов и выполняет их пулом из `workers` воркеров.
+    Меньшее значение priority обрабатывается раньше. Если в очереди уже больше
+    `max_pending` квестов, новый пакет отклоняется (BatchQueueFull).
+
+    С общим состоянием (shared_state) задание выполняет воркер, принявший его, под арендой;
+    задания упавшего воркера забирает тот, кто первым возьмёт их истёкшую аренду.
+    """
+
+    def __init__(
+        self,
+        store: BatchStore,
+        runner: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        *,
+        workers: int = 2,
+        max_pending: int = 1000,
+        shared: Any = None,
+        worker_id: str = "",
+        lease_ttl: float = 30.0,
+        poll_interval: float = 1.0,
+    ):
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.max_pending = max_pending
+        self.shared = shared
+        self.worker_id = worker_id
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.closing = False
+        self._queue: "asyncio.PriorityQueue[Tuple[int, int, str, int, Dict[str, Any]]]" = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._jobs: Dict[str, _JobState] = {}
+        self._tasks: List["asyncio.Task[None]"] = []
+        self._lock = asyncio.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def _db(self, func: Callable[..., Any], *args: Any) -> Any:
+        async with self._lock:
+            return await asyncio.to_thread(func, *args)
+
+    async def _claim(self, job_id: str) -> bool:
+        """Берёт или продлевает аренду задания; False — его выполняет другой живой воркер"""
+        if self.shared is None:
+            return True
+        return await self.shared.acquire(f"batch:{job_id}", self.worker_id, self.lease_ttl)
+
+    async def _release(self, job_id: str) -> None:
+        if self.shared is not None:
+            await self.shared.release(f"batch:{job_id}", self.worker_id)
+
+    async def _recover(self) -> None:
+        """
+        Ставит в очередь незавершённые задания без живого владельца: после перезапуска — все,
+        при нескольких воркерах — брошенные упавшим или остановленным процессом
+        """
+        recovered = await self._db(self.store.unfinished)
+        claimed, skipped, queued = set(), set(), 0
+        for job_id, priority, idx, request in recovered:
+            if job_id in skipped or (job_id in self._jobs and job_id not in claimed):
+                continue
+            if job_id not in claimed:
+                if not await self._claim(job_id):
+                    skipped.add(job_id)
+                    continue
+                claimed.add(job_id)
+                job = await self._db(self.store.get_job, job_id)
+                counts = await self._db(self.store.counts, job_id)
+                self._jobs[job_id] = _JobState(
+                    total=job["total"], done=counts.get(DONE, 0), failed=counts.get(FAILED, 0)
+                )
+            self._jobs[job_id].queued.add(idx)
+            self._queue.put_nowait((priority, next(self._seq), job_id, idx, request))
+            queued += 1
+        if queued:
+            logger.info(f"Восстановлено {queued} незавершённых квестов из {len(claimed)} пакетов")
+
+    async def _maintain(self) -> None:
+        """Продлевает аренды своих заданий и подбирает брошенные другими воркерами"""
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                for job_id in list(self._jobs):
+                    if not await self._claim(job_id):
+                        self._abandon(job_id)
+                if self.shared.distributed:
+                    await self._recover()
+            except Exception as e:
+                logger.error(f"Batch lease maintenance failed: {e}")
+
+    def _abandon(self, job_id: str) -> None:
+        """
+        Аренду задания забрал другой воркер: идущие квесты задания отменяются, оставшиеся
+        в очереди пропускаются, подписчики отключаются и переподключаются к новому владельцу
+        """
+        state = self._jobs.pop(job_id, None)
+        if state is None:
+            return
+        logger.warning(f"Lost lease for batch {job_id}, stopping its local processing")
+        state.lost = True
+        for task in state.running:
+            task.cancel()
+        for subscriber in state.subscribers:
+            subscriber.put_nowait(None)
+
+    async def start(self) -> None:
+        """Восстанавливает незавершённые задания из журнала и запускает воркеров"""
+        await self._recover()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.shared is not None:
+            self._tasks.append(asyncio.create_task(self._maintain()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def drain(self) -> None:
+        """
+        Остановка воркера: воркеры останавливаются, аренды заданий отпускаются — их сразу
+        подберёт другой процесс, а потоки заданий заканчиваются, чтобы клиент переподключился
+        """
+        self.closing = True
+        await self.stop()
+        for job_id, state in self._jobs.items():
+            for subscriber in state.subscribers:
+                subscriber.put_nowait(None)
+            await self._release(job_id)
+
+    async def submit(self, requests: List[Dict[str, Any]], priority: int = 0) -> str:
+        if self.pending + len(requests) > self.max_pending:
+            raise BatchQueueFull(f"queue has {self.pending} pending quests, limit {self.max_pending}")
+
+        job_id = uuid.uuid4().hex
+        await self._claim(job_id)
+        await self._db(self.store.create_job, job_id, priority, requests)
+        self._jobs[job_id] = _JobState(total=len(requests), queued=set(range(len(requests))))
+        for idx, request in enumerate(requests):
+            self._queue.put_nowait((priority, next(self._seq), job_id, idx, request))
+        return job_id
+
+    async def status(self, job_id: str, with_results: bool = False) -> Optional[Dict[str, Any]]:
+        job = await self._db(self.store.get_job, job_id)
+        if job is None:
+            return None
+        items = await self._db(self.store.get_items, job_id, with_results)
+        job["done"] = sum(1 for item in items if item["status"] == DONE)
+        job["failed"] = sum(1 for item in items if item["status"] == FAILED)
+        job["items"] = items
+        return job
+
+    async def watch(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        События по квестам задания: сначала уже готовые, затем новые до завершения пакета.
+        Задание другого воркера читается из журнала раз в poll_interval
+        """
+        queue: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+        state = self._jobs.get(job_id)
+        if state is not None:
+            state.subscribers.append(queue)
+        seen = set()
+        try:
+            for item in await self._db(self.store.get_items, job_id, True):
+                if item["status"] in (DONE, FAILED):
+                    seen.add(item["index"])
+                    yield item
+            if state is None:
+                if self.shared is not None and self.shared.distributed:
+                    async for item in self._watch_remote(job_id, seen):
+                        yield item
+                return
+            while not state.finished or not queue.empty():
+                item = await queue.get()
+                if item is None:
+                    return
+                # Элемент мог завершиться между подпиской и чтением журнала
+                if item["index"] not in seen:
+                    seen.add(item["index"])
+                    yield item
+        finally:
+            if state is not None and queue in state.subscribers:
+                state.subscribers.remove(queue)
+
+    async def _watch_remote(self, job_id: str, seen: Set[int]) -> AsyncIterator[Dict[str, Any]]:
+        while not self.closing:
+            job = await self._db(self.store.get_job, job_id)
+            for item in await self._db(self.store.get_items, job_id, True):
+                if item["status"] in (DONE, FAILED) and item["index"] not in seen:
+                    seen.add(item["index"])
+                    yield item
+            if job is None or job["status"] == COMPLETED:
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    async def _worker(self) -> None:
+        while True:
+            priority, _, job_id, idx, request = await self._queue.get()
+            try:
+                state = self._jobs.get(job_id)
+                if state is None or idx not in state.queued:
+                    # Задание снято (аренда потеряна, воркер останавливается) или элемент
+                    # уже поставлен в очередь повторно при восстановлении
+                    logger.info(f"Skipping batch {job_id} item {idx}: not owned by this worker")
+                    continue
+                state.queued.discard(idx)
+                event = await self._run_item(state, job_id, idx, request)
+            finally:
+                self._queue.task_done()
+            if event is None:
+                continue
+
+            for subscriber in state.subscribers:
+                subscriber.put_nowait(event)
+            if state.finished:
+                await self._db(self.store.set_job_status, job_id, COMPLETED)
+                self._jobs.pop(job_id, None)
+                await self._release(job_id)
+
+    async def _run_item(self, state: _JobState, job_id: str, idx: int, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Выполняет квест задания и пишет результат; None — аренда потеряна, квест за новым владельцем"""
+        log_context.begin(batch_id=job_id, item=str(idx))
+        try:
+            await self._db(self.store.update_item, job_id, idx, RUNNING)
+            await self._db(self.store.set_job_status, job_id, RUNNING)
+            # Отдельной задачей, чтобы _abandon мог отменить квест, не останавливая воркер
+            task = asyncio.create_task(self.runner(request))
+            state.running.add(task)
+            try:
+                await asyncio.wait({task})
+            finally:
+                state.running.discard(task)
+                task.cancel()
+            if state.lost:
+                return None
+            quest = task.result()
+            await self._db(self.store.update_item, job_id, idx, DONE, quest)
+            state.done += 1
+            return {"index": idx, "status": DONE, "quest": quest}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if state.lost:
+                return None
+            logger.error(f"Batch {job_id} item {idx} failed: {e}")
+            await self._db(self.store.update_item, job_id, idx, FAILED, None, str(e))
+            state.failed += 1
+            return {"index": idx, "status": FAILED, "error": str(e)}
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк извлечения JSON из ответа модели: прежний regex-разбор против extract_json.
+
+    python benchmarks/bench_json_extract.py
+
+Входные данные строятся из реального ответа модели (frontend/src/data/quest.txt):
+с пояснениями и markdown-блоком, оборванные на середине, с лишними скобками в тексте,
+а также увеличенные до десятков килобайт.
+"""
+
+import json
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from json_stream import extract_json  # noqa: E402
+
+SAMPLE = Path(__file__).resolve().parents[2] / "frontend" / "src" / "data" / "quest.txt"
+
+
+def legacy_parse(text: str):
+    """Прежняя реализация safe_json_parse (без fallback-а)"""
+    cleaned_text = re.sub(r'```(?:json)?\s*([\s\S]*?)\s*```', r'\1', text.strip())
+    json_match = re.search(r'(\[.*\]|\{.*\})', cleaned_text, re.DOTALL)
+    if json_match:
+        return json.loads(json_match.group(1))
+    return json.loads(cleaned_text)
+
+
+def build_cases(raw: str):
+    data = json.loads(raw)
+    body = json.dumps(data, ensure_ascii=False, indent=2)
+    big = json.dumps(data * 5, ensure_ascii=False, indent=2)
+    prose = "Вот квест [в формате JSON]. Обратите внимание на {сцены}:\n"
+    return {
+        "clean": body,
+        "fenced+prose": f"{prose}```json\n{body}\n```\nЕсли нужно [больше сцен], скажите.",
+        "truncated 50%": body[: len(body) // 2],
+        "truncated 90%": f"```json\n{body[: len(body) * 9 // 10]}",
+        "stray brackets": f"{body}\n\nПримечание: выборы [1] и [2] ведут к {{финалу}}.",
+        "big x5": f"```json\n{big}\n```",
+        "big x5 truncated": big[: len(big) * 3 // 4],
+    }
+
+
+def run(func, text):
+    try:
+        result = func(text)
+        return f"ok ({len(result)} el)"
+    except ValueError:
+        return "fallback"
+
+
+def main() -> None:
+    cases = build_cases(SAMPLE.read_text(encoding="utf-8"))
+    print(f"{'case':18s} {'size':>7s} {'legacy, us':>11s} {'extract, us':>12s}  legacy result / extract result")
+    for name, text in cases.items():
+        number = 200
+        legacy = timeit.timeit(lambda: run(legacy_parse, text), number=number) / number * 1e6
+        new = timeit.timeit(lambda: run(extract_json, text), number=number) / number * 1e6
+        print(f"{name:18s} {len(text):7d} {legacy:11.1f} {new:12.1f}  {run(legacy_parse, text)} / {run(extract_json, text)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Цена логов на один квест: обработка ответов модели (safe_json_parse, validate_and_fix_data,
+fix_scene_references) и итоговые события этапов при разных настройках логов.
+
+    python benchmarks/bench_logging.py --scenes 10 100 500
+
+Ответы синтетические, как в bench_pipeline.py: ~15% невалидных объектов, битые ссылки сцен,
+один нераспарсиваемый ответ на квест. Записи пишутся в поток, который только считает байты,
+поэтому в замер входит форматирование, но не диск. Строка off — логи отключены совсем,
+overhead — разница с ней; lines и bytes — сколько квест отдаёт сборщику логов.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+for name in ("BATCH_DB_PATH", "QUEST_DB_PATH"):
+    os.environ.setdefault(name, ":memory:")
+os.environ["CACHE_DB_PATH"] = ""
+
+import log_context  # noqa: E402
+import main  # noqa: E402
+from bench_pipeline import make_items, make_scenes, measure  # noqa: E402
+
+CHARACTER_FIELDS = ["id", "name", "role", "description"]
+SCENE_FIELDS = ["id", "title", "description", "location_id", "choices"]
+
+
+class CountingStream(io.TextIOBase):
+    """Поток-приёмник: считает строки и байты, ничего не хранит"""
+
+    def __init__(self) -> None:
+        self.lines = 0
+        self.bytes = 0
+
+    def write(self, text: str) -> int:
+        self.lines += text.count("\n")
+        self.bytes += len(text.encode())
+        return len(text)
+
+
+def make_quest(rng: random.Random, scene_count: int) -> Dict[str, str]:
+    """Ответы модели по этапам одного квеста"""
+    return {
+        "characters": json.dumps(make_items(rng, 6), ensure_ascii=False),
+        "locations": json.dumps(make_items(rng, 12), ensure_ascii=False),
+        "items": "Извините, я не могу выполнить этот запрос.",
+        "scenes": json.dumps(make_scenes(rng, scene_count), ensure_ascii=False),
+    }
+
+
+def process_quest(responses: Dict[str, str]) -> None:
+    """Обработка ответов одного квеста так, как её делают этапы в main.py"""
+    main.generation_stats.new_usage()
+    log_context.begin(quest_id=log_context.new_id())
+    for stage in ("characters", "locations", "items"):
+        started = main.time.perf_counter()
+        data = main.safe_json_parse(responses[stage], [])
+        result = main.validate_and_fix_data(data, CHARACTER_FIELDS, stage)
+        main.stage_summary(stage, "miss", started, result)
+    started = main.time.perf_counter()
+    scenes = main.validate_and_fix_data(main.safe_json_parse(responses["scenes"], []), SCENE_FIELDS, "scene")
+    scenes = main.fix_scene_references(scenes)
+    main.stage_summary("scenes", "miss", started, scenes)
+    log_context.event(main.logger, logging.INFO, "quest", mode="staged", seconds=0.0, **main.generation_stats.current_usage.get())
+
+
+CONFIGS: List[Tuple[str, str, str, float]] = [
+    # имя, уровень, формат, доля квестов с подробностями
+    ("off", "", "text", 0.0),
+    ("warning/text", "WARNING", "text", 0.0),
+    ("info/text", "INFO", "text", 0.0),
+    ("info/json", "INFO", "json", 0.0),
+    ("info/text sampled 1%", "INFO", "text", 0.01),
+    ("info/json sampled 100%", "INFO", "json", 1.0),
+    ("debug/text", "DEBUG", "text", 0.0),
+]
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenes", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--quests", type=int, default=20, help="разных квестов в замере")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-time", type=float, default=0.2, help="секунд на один замер")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for scene_count in args.scenes:
+        quests = [make_quest(rng, scene_count) for _ in range(args.quests)]
+
+        def run_all() -> None:
+            for responses in quests:
+                process_quest(responses)
+
+        # Настройки чередуются по кругу, лучший из --rounds замеров: фон машины
+        # влияет на все строки одинаково, а разница в десятки микросекунд видна
+        best: Dict[str, float] = {}
+        volume: Dict[str, Tuple[float, float]] = {}
+        for _ in range(args.rounds):
+            for name, level, fmt, rate in CONFIGS:
+                stream = CountingStream()
+                log_context.configure(level or "CRITICAL", fmt, rate, stream=stream)
+                logging.disable(logging.CRITICAL if not level else logging.NOTSET)
+                run_all()
+                volume[name] = (stream.lines / len(quests), stream.bytes / len(quests))
+                per_quest = measure(run_all, args.min_time) / len(quests)
+                best[name] = min(per_quest, best.get(name, per_quest))
+
+        print(f"\n{scene_count} scenes per quest")
+        print(f"{'logging':24s} {'us/quest':>10s} {'overhead':>10s} {'lines':>7s} {'bytes':>8s}")
+        for name, *_ in CONFIGS:
+            lines, size = volume[name]
+            print(f"{name:24s} {best[name]:10.1f} {best[name] - best['off']:+10.1f} {lines:7.1f} {size:8.0f}")
+        logging.disable(logging.NOTSET)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарки обработки ответа модели: safe_json_parse, validate_and_fix_data, fix_scene_references.
+
+    python benchmarks/bench_pipeline.py --save baseline.json     # запомнить результаты
+    python benchmarks/bench_pipeline.py --compare baseline.json  # сравнить, код 1 при регрессии
+
+Данные синтетические и детерминированные (--seed): ответы с markdown-блоком и обрывом,
+списки объектов с невалидными элементами, графы сцен с битыми ссылками и недостижимыми сценами.
+Регрессия — замедление больше --tolerance (по умолчанию 25%) относительно сохранённого прогона.
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Импорт main открывает SQLite-хранилища: бенчмарку файлы на диске не нужны
+for name in ("BATCH_DB_PATH", "QUEST_DB_PATH"):
+    os.environ.setdefault(name, ":memory:")
+os.environ["CACHE_DB_PATH"] = ""
+
+import main  # noqa: E402
+
+
+def make_scenes(rng: random.Random, count: int) -> List[Dict[str, Any]]:
+    """Граф от модели: ~10% битых ссылок, петли, сцены без выборов в середине"""
+    scenes = []
+    for i in range(1, count + 1):
+        choices = []
+        for k in range(rng.randint(0, 3) if i < count else 0):
+            roll = rng.random()
+            if roll < 0.1:
+                target = f"scene_{count + rng.randint(1, 50)}"
+            elif roll < 0.15:
+                target = f"scene_{i}"
+            else:
+                target = f"scene_{min(count, i + rng.randint(1, 3))}"
+            choices.append({"id": f"choice_{i}_{k + 1}", "text": "Выбор", "next_scene_id": target, "consequence": None})
+        scenes.append({
+            "id": f"scene_{i}", "title": f"Сцена {i}", "description": "Описание",
+            "location_id": "location_1", "characters": [], "items": [], "choices": choices,
+            "is_ending": False,
+        })
+    return scenes
+
+
+def make_items(rng: random.Random, count: int) -> List[Any]:
+    """Персонажи с ~15% невалидных элементов: пустые поля, нет полей, не объекты"""
+    data: List[Any] = []
+    for i in range(1, count + 1):
+        item: Any = {"id": f"character_{i}", "name": f"Имя {i}", "role": "роль", "description": "описание"}
+        roll = rng.random()
+        if roll < 0.05:
+            item["name"] = ""
+        elif roll < 0.1:
+            del item["role"]
+        elif roll < 0.15:
+            item = f"character_{i}"
+        data.append(item)
+    return data
+
+
+def make_responses(scenes: List[Dict[str, Any]]) -> Dict[str, str]:
+    body = json.dumps(scenes, ensure_ascii=False, indent=2)
+    return {
+        "clean": body,
+        "fenced+prose": f"Вот сцены [JSON]:\n```json\n{body}\n```\nЕсли нужно {{больше}}, скажите.",
+        "truncated": body[: len(body) * 3 // 4],
+        "garbage": "Извините, я не могу выполнить этот запрос." * 20,
+    }
+
+
+def measure(func: Callable[[], Any], min_time: float) -> float:
+    """Микросекунды на вызов: число повторов подбирается под min_time, берётся лучший из 5 замеров"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e6
+
+
+def run_benchmarks(seed: int, min_time: float) -> Dict[str, float]:
+    rng = random.Random(seed)
+    results: Dict[str, float] = {}
+    fields = ["id", "name", "role", "description"]
+    scene_fields = ["id", "title", "description", "location_id", "choices"]
+
+    for size in (10, 100, 1000):
+        scenes = make_scenes(rng, size)
+        for name, text in make_responses(scenes).items():
+            results[f"safe_json_parse/{name}/{size}"] = measure(lambda: main.safe_json_parse(text, []), min_time)
+
+        data = make_items(rng, size)
+        results[f"validate_and_fix_data/characters/{size}"] = measure(
+            lambda: main.validate_and_fix_data(data, fields, "character"), min_time)
+        results[f"validate_and_fix_data/scenes/{size}"] = measure(
+            lambda: main.validate_and_fix_data(scenes, scene_fields, "scene"), min_time)
+
+        # Ремонт меняет сцены на месте, поэтому каждый вызов получает свою копию (её время вычитается)
+        copy_cost = measure(lambda: copy.deepcopy(scenes), min_time)
+        results[f"fix_scene_references/{size}"] = max(
+            0.0, measure(lambda: main.fix_scene_references(copy.deepcopy(scenes)), min_time) - copy_cost)
+    return results
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-time", type=float, default=0.2, help="секунд на один замер")
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="сравнить с сохранёнными результатами")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    # Предупреждения о невалидных объектах — часть нагрузки, но не вывода
+    main.logger.disabled = True
+    main.logging.getLogger("scene_graph").disabled = True
+
+    results = run_benchmarks(args.seed, args.min_time)
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else {}
+
+    regressions = 0
+    print(f"{'benchmark':44s} {'us/call':>11s}" + (f" {'baseline':>11s} {'change':>8s}" if baseline else ""))
+    for name, value in results.items():
+        line = f"{name:44s} {value:11.1f}"
+        if name in baseline and baseline[name] > 0:
+            change = value / baseline[name] - 1
+            flag = "  REGRESSION" if change > args.tolerance else ""
+            regressions += bool(flag)
+            line += f" {baseline[name]:11.1f} {change:+8.1%}{flag}"
+        print(line)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+    if regressions:
+        print(f"{regressions} regression(s) over {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
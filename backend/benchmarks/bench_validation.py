@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Проверка объектов этапа: схемы pydantic пакетом (TypeAdapter) против прежнего цикла по полям.
+
+    python benchmarks/bench_validation.py --sizes 1000 5000
+
+Для каждого набора сравниваются три способа:
+- fields   — прежний цикл по списку обязательных полей (validate_required_fields):
+             поля есть и непусты, типы не проверяются;
+- per_item — те же схемы, но model_validate по одному объекту (у сцен — и по одному
+             выбору) в Python-цикле;
+- batch    — validate_and_fix_data: весь список одним вызовом TypeAdapter.
+Наборы: персонажи без ошибок и с ~15% невалидных, сцены от модели, сцены с ~15% битых
+выборов (сцена остаётся, отбрасывается только выбор) и все сущности большого
+импортированного квеста (персонажи, локации, предметы и N сцен).
+"""
+
+import argparse
+import os
+import random
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Импорт main открывает SQLite-хранилища: бенчмарку файлы на диске не нужны
+for name in ("BATCH_DB_PATH", "QUEST_DB_PATH"):
+    os.environ.setdefault(name, ":memory:")
+os.environ["CACHE_DB_PATH"] = ""
+
+import main  # noqa: E402
+import schemas  # noqa: E402
+from bench_pipeline import make_items, make_scenes, measure  # noqa: E402
+from bench_wire import make_quest  # noqa: E402
+from pydantic import ValidationError  # noqa: E402
+
+# (data_type, объекты) — один вызов проверки
+Payload = List[Tuple[str, List[Any]]]
+
+
+def clean_characters(count: int) -> List[Dict[str, Any]]:
+    return [{
+        "id": f"character_{i}", "name": f"Имя {i}", "role": "роль", "description": "описание",
+        "motivation": "мотивация", "is_ally": True, "is_enemy": False,
+    } for i in range(1, count + 1)]
+
+
+def scenes_with_bad_choices(rng: random.Random, count: int) -> List[Dict[str, Any]]:
+    """Сцены от модели, у ~15% выборов нет next_scene_id или text, или выбор — не объект"""
+    scenes = make_scenes(rng, count)
+    for scene in scenes:
+        for k, choice in enumerate(scene["choices"]):
+            roll = rng.random()
+            if roll < 0.05:
+                del choice["next_scene_id"]
+            elif roll < 0.1:
+                del choice["text"]
+            elif roll < 0.15:
+                scene["choices"][k] = choice["next_scene_id"]
+    return scenes
+
+
+def imported_quest(rng: random.Random, scene_count: int) -> Payload:
+    quest = make_quest(rng, scene_count)
+    return [("character", quest["characters"]), ("location", quest["locations"]),
+            ("item", quest["items"]), ("scene", quest["scenes"])]
+
+
+def fields_loop(payload: Payload) -> int:
+    return sum(len(main.validate_required_fields(data, sorted(schemas.REQUIRED[kind]), kind, [])) for kind, data in payload)
+
+
+def valid_choice(choice: Any) -> bool:
+    try:
+        schemas.Choice.model_validate(choice)
+        return True
+    except ValidationError:
+        return False
+
+
+def per_item(payload: Payload) -> int:
+    valid = 0
+    for kind, data in payload:
+        model = schemas.MODELS[kind]
+        for item in data:
+            try:
+                if kind == "scene" and isinstance(item, dict) and isinstance(item.get("choices"), list):
+                    item = {**item, "choices": [choice for choice in item["choices"] if valid_choice(choice)]}
+                model.model_validate(item).model_dump()
+                valid += 1
+            except ValidationError:
+                pass
+    return valid
+
+
+def batch(payload: Payload) -> int:
+    return sum(len(main.validate_and_fix_data(data, sorted(schemas.REQUIRED[kind]), kind)) for kind, data in payload)
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-time", type=float, default=0.2, help="секунд на один замер")
+    args = parser.parse_args()
+
+    # Предупреждения о невалидных объектах — часть нагрузки, но не вывода
+    main.logger.disabled = True
+
+    rng = random.Random(args.seed)
+    methods: List[Tuple[str, Callable[[Payload], int]]] = [("fields", fields_loop), ("per_item", per_item), ("batch", batch)]
+    print(f"{'payload':28s} {'objects':>8s} " + " ".join(f"{name + ' ms':>12s}" for name, _ in methods)
+          + f" {'batch/per_item':>15s} {'batch/fields':>13s}")
+    for size in args.sizes:
+        payloads: Dict[str, Payload] = {
+            "characters/clean": [("character", clean_characters(size))],
+            "characters/15%-invalid": [("character", make_items(rng, size))],
+            "scenes/model": [("scene", make_scenes(rng, size))],
+            "scenes/15%-bad-choices": [("scene", scenes_with_bad_choices(rng, size))],
+            "imported_quest": imported_quest(rng, size),
+        }
+        for name, payload in payloads.items():
+            objects = sum(len(data) for _, data in payload)
+            valid = {method: func(payload) for method, func in methods}
+            if valid["per_item"] != valid["batch"]:
+                raise SystemExit(f"{name}: per_item kept {valid['per_item']}, batch kept {valid['batch']}")
+            times = {method: measure(lambda func=func: func(payload), args.min_time) / 1000 for method, func in methods}
+            print(f"{name:28s} {objects:8d} " + " ".join(f"{times[method]:12.2f}" for method, _ in methods)
+                  + f" {times['batch'] / times['per_item']:15.2f} {times['batch'] / times['fields']:13.2f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Стоимость выдачи квеста клиенту: CPU на сериализацию и байты в сети.
+
+    python benchmarks/bench_wire.py --scenes 100 200 500
+
+Для синтетического квеста с заданным числом сцен собирается та же последовательность событий,
+что отдаёт /api/generate-quest-stream, и кодируется каждым транспортом (SSE, NDJSON,
+MessagePack) с каждым сжатием (нет, gzip, brotli) — по событию, со сбросом сжатия после
+каждого, как в живом потоке. Отдельно меряется ответ целиком (/api/quests/{id}).
+Сериализатор — orjson, если установлен; строка json_stdlib — прежний json.dumps для сравнения.
+"""
+
+import argparse
+import json
+import random
+import sys
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import wire  # noqa: E402
+
+DESCRIPTIONS = [
+    "Герой стоит на развилке, впереди слышны шаги и далёкий звон колокола.",
+    "Туман сгущается над болотом, и в нём мелькают огни блуждающих душ.",
+    "Старый мост скрипит под ногами, внизу ревёт горная река.",
+    "В зале пахнет воском и пылью, на троне сидит неподвижная фигура.",
+    "Караван остановился у колодца, торговцы спорят о цене воды.",
+]
+
+
+def make_quest(rng: random.Random, scene_count: int) -> Dict[str, Any]:
+    characters = [{
+        "id": f"character_{i}", "name": f"Персонаж {i}", "role": rng.choice(("союзник", "враг", "торговец")),
+        "description": "Странник с тёмным прошлым, знающий тайные тропы через северные перевалы.",
+        "motivation": "Найти утраченный артефакт", "is_ally": True, "is_enemy": False,
+    } for i in range(1, 6)]
+    locations = [{
+        "id": f"location_{i}", "name": f"Локация {i}",
+        "description": "Заброшенное место, где ветер шепчет старые легенды о павших королях.",
+    } for i in range(1, 13)]
+    items = [{
+        "id": f"item_{i}", "name": f"Предмет {i}", "description": "Потёртый амулет с рунами.",
+        "is_key": i == 1, "effect": "Открывает запертые двери",
+    } for i in range(1, 5)]
+    scenes = []
+    for i in range(1, scene_count + 1):
+        targets = sorted({min(scene_count, i + rng.randint(1, 4)) for _ in range(rng.randint(1, 3))}) if i < scene_count else []
+        scenes.append({
+            "id": f"scene_{i}", "title": f"Сцена {i}",
+            "description": " ".join(rng.choice(DESCRIPTIONS) for _ in range(3)),
+            "location_id": f"location_{rng.randint(1, 12)}",
+            "characters": [f"character_{rng.randint(1, 5)}"], "items": [],
+            "choices": [{
+                "id": f"choice_{i}_{k + 1}", "text": "Пойти по следу", "next_scene_id": f"scene_{t}",
+                "consequence": "Путь становится опаснее",
+            } for k, t in enumerate(targets)],
+            "is_ending": not targets,
+        })
+    return {
+        "title": "Квест: Fantasy", "description": "Древнее зло пробуждается. " * 10,
+        "characters": characters, "locations": locations, "items": items, "scenes": scenes,
+    }
+
+
+def quest_events(quest: Dict[str, Any]) -> List[Tuple[Dict[str, Any], str]]:
+    """События потока в том порядке и виде, как их отдаёт quest_events в main.py"""
+    events: List[Dict[str, Any]] = [
+        {"type": "status", "content": "Начинаем генерацию квеста..."},
+        {"type": "title", "content": quest["title"]},
+        {"type": "status", "content": "Создаём описание сюжета, персонажей, локации и предметы..."},
+    ]
+    for part in ("description", "characters", "locations", "items"):
+        events.append({"type": part, "content": quest[part]})
+    scenes = quest["scenes"]
+    events.append({"type": "scene_graph", "content": {"scenes": len(scenes), "endings": 1, "unreachable": 0}})
+    events.extend({"type": "scene", "content": scene, "scene_number": i + 1, "total_scenes": len(scenes)}
+                  for i, scene in enumerate(scenes))
+    events.append({"type": "complete", "content": "Квест успешно создан!", "mode": "staged",
+                   "usage": {"prompt_tokens": 5000, "completion_tokens": 40000, "model_calls": 30}})
+    return [(event, f"0123456789abcdef0123456789abcdef:{seq}") for seq, event in enumerate(events, 1)]
+
+
+def stdlib_sse(events: List[Tuple[Dict[str, Any], str]]) -> bytes:
+    """Прежний формат потока: json.dumps с ensure_ascii=False и пробелами после разделителей"""
+    return b"".join(f"id: {eid}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode() for event, eid in events)
+
+
+def encode_stream(events: List[Tuple[Dict[str, Any], str]], fmt: str, encoding: Optional[str]) -> bytes:
+    encoder = wire.StreamEncoder(fmt, encoding)
+    return b"".join(encoder.encode(event, eid) for event, eid in events) + encoder.finish()
+
+
+def measure(func: Callable[[], Any], min_time: float) -> float:
+    """Микросекунды на вызов, лучший из 5 замеров"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenes", type=int, nargs="+", default=[100, 200, 500])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-time", type=float, default=0.2, help="секунд на один замер")
+    args = parser.parse_args()
+
+    print(f"serializer: {'orjson' if wire.orjson is not None else 'json'}; "
+          f"formats: {', '.join(wire.available_formats())}; encodings: {', '.join(wire.available_encodings())}")
+    rng = random.Random(args.seed)
+    for scene_count in args.scenes:
+        quest = make_quest(rng, scene_count)
+        events = quest_events(quest)
+        print(f"\n{scene_count} scenes, {len(events)} events")
+        print(f"{'stream':26s} {'ms/quest':>9s} {'bytes':>10s} {'ratio':>7s}")
+        baseline = len(stdlib_sse(events))
+        rows: List[Tuple[str, Callable[[], bytes]]] = [("json_stdlib/sse", lambda: stdlib_sse(events))]
+        for fmt in wire.available_formats():
+            for encoding in [None] + wire.available_encodings():
+                rows.append((f"{fmt}/{encoding or 'identity'}",
+                             lambda fmt=fmt, encoding=encoding: encode_stream(events, fmt, encoding)))
+        for name, func in rows:
+            size = len(func())
+            print(f"{name:26s} {measure(func, args.min_time) / 1000:9.2f} {size:10d} {size / baseline:7.2f}")
+
+        record = {"id": "0123456789abcdef", "status": "completed", "quest": quest}
+        print(f"{'full quest':26s} {'ms/quest':>9s} {'bytes':>10s} {'ratio':>7s}")
+        plain = json.dumps(record, ensure_ascii=False).encode()
+        bodies: List[Tuple[str, Callable[[], bytes]]] = [
+            ("json_stdlib/identity", lambda: json.dumps(record, ensure_ascii=False).encode()),
+            ("json/identity", lambda: wire.encode_body(record)),
+        ]
+        if "msgpack" in wire.available_formats():
+            bodies.append(("msgpack/identity", lambda: wire.encode_body(record, wire.MSGPACK)))
+        for encoding in wire.available_encodings():
+            bodies.append((f"json/{encoding}", lambda encoding=encoding: wire.compress_body(wire.encode_body(record), encoding)))
+        for name, func in bodies:
+            size = len(func())
+            print(f"{name:26s} {measure(func, args.min_time) / 1000:9.2f} {size:10d} {size / len(plain):7.2f}")
+
+
+if __name__ == "__main__":
+    main()
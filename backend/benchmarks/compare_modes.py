@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Сравнение режимов генерации staged и one_shot на запущенном сервере.
+
+    python benchmarks/compare_modes.py --url http://localhost:8000 --runs 5
+
+Каждый квест запрашивается с уникальным variation_seed, чтобы не попадать в кэш.
+Токены и fallback-ы берутся из события complete, итог по серверу — из /api/health.
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import httpx
+
+REQUEST = {
+    "setting": "fantasy",
+    "starting_point": "Древний лес",
+    "quest_style": "adventure",
+    "scene_count": 5,
+    "character_count": 3,
+}
+
+
+def run_quest(client: httpx.Client, url: str, mode: str, seed: int) -> dict:
+    body = {**REQUEST, "generation_mode": mode, "variation_seed": seed}
+    started = time.perf_counter()
+    complete = None
+    with client.stream("POST", f"{url}/api/generate-quest-stream", json=body) as response:
+        for line in response.iter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[6:])
+            if event["type"] == "complete":
+                complete = event
+            elif event["type"] == "error":
+                raise RuntimeError(event["content"])
+    latency = time.perf_counter() - started
+    usage = (complete or {}).get("usage", {})
+    return {"latency": latency, **usage}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    seed = int(time.time())
+    with httpx.Client(timeout=None) as client:
+        for mode in ("staged", "one_shot"):
+            runs = []
+            for _ in range(args.runs):
+                seed += 1
+                runs.append(run_quest(client, args.url, mode, seed))
+            tokens = [r.get("prompt_tokens", 0) + r.get("eval_tokens", 0) for r in runs]
+            print(
+                f"{mode:9s} latency median {statistics.median(r['latency'] for r in runs):7.2f}s  "
+                f"tokens avg {statistics.mean(tokens):8.1f}  "
+                f"model calls avg {statistics.mean(r.get('model_calls', 0) for r in runs):4.1f}  "
+                f"fallback rate {sum(1 for r in runs if r.get('fallbacks')) / len(runs):.2f}"
+            )
+
+        health = client.get(f"{args.url}/api/health").json()
+        print(json.dumps(health.get("generation_modes", {}), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
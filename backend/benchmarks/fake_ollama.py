@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Локальный фейковый сервер Ollama для нагрузочных тестов без GPU.
+
+    python benchmarks/fake_ollama.py --port 11435 --token-rate 150 --latency 0.3 \\
+        --failure-rate 0.02 --malformed-rate 0.1
+    OLLAMA_URL=http://localhost:11435 uvicorn main:app --port 8000
+
+Отвечает на /api/tags, /api/ps и /api/generate (обычный и потоковый режимы, прогрев без prompt).
+Содержимое ответа подбирается по промпту: персонажи, локации, предметы, сцены, окна больших
+квестов, корректирующие запросы и one-shot со схемой. Задержка до первого токена — логнормальная
+с медианой --latency, дальше токены идут со скоростью --token-rate. С вероятностью --failure-rate
+запрос завершается ошибкой 500, с вероятностью --malformed-rate JSON в ответе портится
+(обрыв, пояснения вокруг, пустые обязательные поля).
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+from typing import Any, AsyncIterator, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Fake Ollama")
+settings = argparse.Namespace(
+    model="gemma3:4b", token_rate=150.0, latency=0.3, latency_sigma=0.5,
+    failure_rate=0.0, malformed_rate=0.0, seed=None,
+)
+rng = random.Random()
+stats = {"requests": 0, "failures": 0, "malformed": 0, "tokens": 0}
+
+# Токен ~ 4 символа: этого достаточно, чтобы объём ответа влиял на время генерации
+CHARS_PER_TOKEN = 4
+
+
+def characters(ids: List[str]) -> List[Dict[str, Any]]:
+    return [{
+        "id": cid, "name": f"Персонаж {cid.split('_')[-1]}", "role": "союзник",
+        "description": "Странник с тёмным прошлым, знающий тайные тропы.",
+        "motivation": "Найти утраченный артефакт", "is_ally": True, "is_enemy": False,
+    } for cid in ids]
+
+
+def locations(ids: List[str]) -> List[Dict[str, Any]]:
+    return [{
+        "id": lid, "name": f"Локация {lid.split('_')[-1]}",
+        "description": "Заброшенное место, где ветер шепчет старые легенды.",
+    } for lid in ids]
+
+
+def items(ids: List[str]) -> List[Dict[str, Any]]:
+    return [{
+        "id": iid, "name": f"Предмет {iid.split('_')[-1]}", "description": "Потёртый амулет с рунами.",
+        "is_key": k == 0, "effect": "Открывает запертые двери",
+    } for k, iid in enumerate(ids)]
+
+
+def scene(scene_id: str, location_id: str, targets: List[str]) -> Dict[str, Any]:
+    return {
+        "id": scene_id, "title": f"Сцена {scene_id.split('_')[-1]}",
+        "description": "Герой стоит на развилке, впереди слышны шаги и далёкий звон колокола.",
+        "location_id": location_id, "characters": ["character_1"], "items": [],
+        "choices": [{
+            "id": f"choice_{scene_id}_{k + 1}", "text": "Идти дальше",
+            "next_scene_id": target, "consequence": "История продолжается",
+        } for k, target in enumerate(targets)],
+        "is_ending": not targets,
+    }
+
+
+def scene_chain(count: int) -> List[Dict[str, Any]]:
+    return [
+        scene(f"scene_{i}", "location_1", [f"scene_{i + 1}"] if i < count else [])
+        for i in range(1, count + 1)
+    ]
+
+
+def numbered(prefix: str, count: int) -> List[str]:
+    return [f"{prefix}_{i + 1}" for i in range(count)]
+
+
+def count_in(prompt: str, word: str, default: int) -> int:
+    match = re.search(rf"(\d+)\s+{word}", prompt)
+    return int(match.group(1)) if match else default
+
+
+def respond(prompt: str, schema: Any) -> Any:
+    """Правдоподобный ответ модели: объект/массив для JSON-этапов, строка для описания"""
+    if schema is not None:
+        scenes = count_in(prompt, "сцен", 3)
+        return {
+            "description": "Древнее зло пробуждается, и только вы можете его остановить.",
+            "characters": characters(numbered("character", count_in(prompt, "персонажей", 3))),
+            "locations": locations(numbered("location", count_in(prompt, "локаций", 3))),
+            "items": items(numbered("item", 3)),
+            "scenes": scene_chain(scenes),
+        }
+    if "В предыдущем ответе" in prompt:
+        ids = re.search(r"с id: ([^\n.]*)", prompt).group(1).split(", ")
+        kind = re.search(r"\((\w+)\)", prompt).group(1)
+        builders = {"character": characters, "location": locations, "item": items}
+        if kind in builders:
+            return builders[kind](ids)
+        return [scene(sid, "location_1", []) for sid in ids]
+    if prompt.startswith("Перепиши"):
+        # Перегенерация одного узла: тот же id, переходы — на сохраняемые выходы
+        node = json.loads(re.search(r"^\{.*\}$", prompt, re.M).group(0))
+        if "choices" in node:
+            exits = re.search(r"переходы на ([\w, ]+);", prompt)
+            targets = exits.group(1).split(", ") if exits and exits.group(1).startswith("scene_") else []
+            return [{**scene(node["id"], node.get("location_id", "location_1"), targets), "title": "Новая версия"}]
+        return [{**node, "description": "Новая версия: " + str(node.get("description", ""))}]
+    window = re.findall(r"- (scene_\d+) \(локация (\w+)\): (?:выборы ведут в ([\w, ]+)|КОНЦОВКА)", prompt)
+    if window:
+        return [scene(sid, lid, targets.split(", ") if targets else []) for sid, lid, targets in window]
+    if "персонажей" in prompt:
+        return characters(numbered("character", count_in(prompt, "персонажей", 3)))
+    if "локаций" in prompt:
+        return locations(numbered("location", count_in(prompt, "локаций", 3)))
+    if "предметов" in prompt:
+        return items(numbered("item", 4))
+    if "сцен" in prompt:
+        return scene_chain(count_in(prompt, "сцен", 3))
+    return "Туман над долиной скрывает древнюю тайну. Герою предстоит сделать выбор, от которого зависит судьба королевства."
+
+
+def corrupt(data: Any) -> str:
+    """Портит ответ одним из типичных для модели способов"""
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    mode = rng.choice(("truncate", "prose", "empty_field"))
+    if mode == "truncate":
+        return text[: int(len(text) * rng.uniform(0.3, 0.9))]
+    if mode == "prose":
+        return f"Конечно! Вот результат:\n```json\n{text}\n```\nНадеюсь, это поможет [если нужно больше]."
+    if isinstance(data, list) and data:
+        victim = rng.choice(data)
+        key = next((k for k in ("name", "title", "description") if k in victim), None)
+        if key:
+            victim[key] = ""
+    return json.dumps(data, ensure_ascii=False)
+
+
+def first_token_delay() -> float:
+    if settings.latency <= 0:
+        return 0.0
+    return rng.lognormvariate(math.log(settings.latency), settings.latency_sigma)
+
+
+def tokenize(text: str) -> List[str]:
+    return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)] or [""]
+
+
+def final_fields(prompt: str, tokens: int, started: float, eval_seconds: float) -> Dict[str, Any]:
+    return {
+        "model": settings.model, "done": True,
+        "prompt_eval_count": len(prompt) // CHARS_PER_TOKEN,
+        "eval_count": tokens,
+        "eval_duration": int(eval_seconds * 1e9),
+        "total_duration": int((asyncio.get_running_loop().time() - started) * 1e9),
+        "load_duration": 0,
+    }
+
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": [{"name": settings.model}]}
+
+
+@app.get("/api/ps")
+async def ps():
+    return {"models": [{"name": settings.model}]}
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    body = await request.json()
+    prompt = body.get("prompt")
+    if prompt is None:
+        return {"model": settings.model, "done": True, "load_duration": 0}
+
+    stats["requests"] += 1
+    if rng.random() < settings.failure_rate:
+        stats["failures"] += 1
+        await asyncio.sleep(first_token_delay())
+        return JSONResponse({"error": "fake failure"}, status_code=500)
+
+    data = respond(prompt, body.get("format"))
+    if rng.random() < settings.malformed_rate:
+        stats["malformed"] += 1
+        text = corrupt(data)
+    else:
+        text = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    tokens = tokenize(text)
+    stats["tokens"] += len(tokens)
+    started = asyncio.get_running_loop().time()
+    eval_seconds = len(tokens) / settings.token_rate if settings.token_rate > 0 else 0.0
+
+    if not body.get("stream", True):
+        await asyncio.sleep(first_token_delay() + eval_seconds)
+        return {"response": text, **final_fields(prompt, len(tokens), started, eval_seconds)}
+
+    async def stream() -> AsyncIterator[bytes]:
+        await asyncio.sleep(first_token_delay())
+        # Токены пачками по ~20 мс, чтобы не мерить накладные расходы asyncio.sleep
+        batch = max(1, int(settings.token_rate * 0.02))
+        for i in range(0, len(tokens), batch):
+            chunk = "".join(tokens[i:i + batch])
+            yield (json.dumps({"model": settings.model, "response": chunk, "done": False}, ensure_ascii=False) + "\n").encode()
+            if settings.token_rate > 0:
+                await asyncio.sleep(batch / settings.token_rate)
+        yield (json.dumps({"response": "", **final_fields(prompt, len(tokens), started, eval_seconds)}) + "\n").encode()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--model", default=settings.model)
+    parser.add_argument("--token-rate", type=float, default=settings.token_rate, help="токенов в секунду на запрос")
+    parser.add_argument("--latency", type=float, default=settings.latency, help="медиана задержки до первого токена, сек")
+    parser.add_argument("--latency-sigma", type=float, default=settings.latency_sigma, help="разброс логнормальной задержки")
+    parser.add_argument("--failure-rate", type=float, default=settings.failure_rate)
+    parser.add_argument("--malformed-rate", type=float, default=settings.malformed_rate)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    vars(settings).update(vars(args))
+    rng.seed(args.seed)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
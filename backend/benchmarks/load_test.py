@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный SSE-клиент для /api/generate-quest-stream.
+
+    python benchmarks/fake_ollama.py --port 11435 &
+    OLLAMA_URL=http://localhost:11435 uvicorn main:app --port 8000 &
+    python benchmarks/load_test.py --url http://localhost:8000 --concurrency 20 --requests 200
+
+Печатает p50/p95/p99 времени до первого события и до конца квеста, долю квестов с
+fallback-ами, ошибки и пропускную способность (квестов в секунду). По умолчанию у каждого
+запроса свой variation_seed, чтобы не мерить кэш и объединение запросов; --same-request
+отправляет одинаковые запросы.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+REQUEST = {
+    "setting": "fantasy",
+    "starting_point": "Древний лес",
+    "quest_style": "adventure",
+    "scene_count": 5,
+    "character_count": 3,
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+async def run_quest(client: httpx.AsyncClient, url: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    first_event: Optional[float] = None
+    complete: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    try:
+        async with client.stream("POST", f"{url}/api/generate-quest-stream", json=body) as response:
+            if response.status_code != 200:
+                return {"error": f"HTTP {response.status_code}"}
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                if first_event is None:
+                    first_event = time.perf_counter() - started
+                event = json.loads(line[6:])
+                if event["type"] == "complete":
+                    complete = event
+                elif event["type"] == "error":
+                    error = event["content"]
+    except httpx.HTTPError as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    if complete is None:
+        return {"error": error or "stream ended without complete"}
+    return {
+        "ttfe": first_event,
+        "latency": time.perf_counter() - started,
+        "usage": complete.get("usage") or {},
+    }
+
+
+async def run_load(args: argparse.Namespace) -> None:
+    body = {**REQUEST, "scene_count": args.scenes, "generation_mode": args.mode}
+    seed = int(time.time() * 1000)
+    queue: "asyncio.Queue[int]" = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+    results: List[Dict[str, Any]] = []
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        while not queue.empty():
+            i = queue.get_nowait()
+            request = body if args.same_request else {**body, "variation_seed": seed + i}
+            results.append(await run_quest(client, args.url, request))
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if "error" not in r]
+    errors = [r["error"] for r in results if "error" in r]
+    ttfe = [r["ttfe"] for r in ok]
+    latency = [r["latency"] for r in ok]
+    with_fallback = sum(1 for r in ok if r["usage"].get("fallbacks"))
+
+    print(f"requests {len(results)}  ok {len(ok)}  errors {len(errors)}  "
+          f"concurrency {args.concurrency}  elapsed {elapsed:.2f}s  throughput {len(ok) / elapsed:.2f} quests/s")
+    for name, values in (("time to first event", ttfe), ("quest latency", latency)):
+        print(f"{name:20s} p50 {percentile(values, 0.5):7.3f}s  p95 {percentile(values, 0.95):7.3f}s  "
+              f"p99 {percentile(values, 0.99):7.3f}s  max {max(values, default=float('nan')):7.3f}s")
+    if ok:
+        calls = sum(r["usage"].get("model_calls", 0) for r in ok) / len(ok)
+        repairs = sum(r["usage"].get("repairs", 0) for r in ok) / len(ok)
+        print(f"fallback rate {with_fallback / len(ok):.3f}  model calls/quest {calls:.2f}  repairs/quest {repairs:.2f}")
+    for error in sorted(set(errors))[:5]:
+        print(f"  error x{errors.count(error)}: {error}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--scenes", type=int, default=5)
+    parser.add_argument("--mode", choices=("staged", "one_shot"), default="staged")
+    parser.add_argument("--same-request", action="store_true", help="одинаковые запросы (кэш и объединение)")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    asyncio.run(run_load(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Кэш результатов этапов генерации: LRU в памяти с TTL и необязательный SQLite-уровень на диске
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def make_key(*parts: Any) -> str:
+    """Стабильный хэш от JSON-сериализуемых частей ключа"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryLRU:
+    """LRU-словарь с ограничением размера и временем жизни записей"""
+
+    def __init__(self, max_entries: int = 512, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        stored_at, value = entry
+        if self.ttl > 0 and time.monotonic() - stored_at > self.ttl:
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteTier:
+    """Дисковый уровень кэша. Значения хранятся как JSON, устаревшие записи удаляются при чтении"""
+
+    def __init__(self, path: str, ttl: float = 86400.0):
+        self.path = path
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stage_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = asyncio.Lock()
+
+    def _get(self, key: str) -> Any:
+        row = self._conn.execute(
+            "SELECT value, created_at FROM stage_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return _MISSING
+        value, created_at = row
+        if self.ttl > 0 and time.time() - created_at > self.ttl:
+            self._conn.execute("DELETE FROM stage_cache WHERE key = ?", (key,))
+            self._conn.commit()
+            return _MISSING
+        return json.loads(value)
+
+    def _set(self, key: str, value: Any) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO stage_cache (key, value, created_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time()),
+        )
+        self._conn.commit()
+
+    async def get(self, key: str) -> Any:
+        async with self._lock:
+            return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: Any) -> None:
+        async with self._lock:
+            await asyncio.to_thread(self._set, key, value)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class GenerationCache:
+    """Двухуровневый кэш (память -> диск) со счётчиками попаданий"""
+
+    def __init__(self, memory: MemoryLRU, disk: Optional[SQLiteTier] = None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Any:
+        """Возвращает значение или None при промахе"""
+        # Копии, чтобы правки результата в конвейере не портили кэш
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return copy.deepcopy(value)
+
+        if self.disk is not None:
+            try:
+                value = await self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Disk cache read failed: {e}")
+                value = _MISSING
+            if value is not _MISSING:
+                self.hits += 1
+                self.disk_hits += 1
+                self.memory.set(key, copy.deepcopy(value))
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, copy.deepcopy(value))
+        if self.disk is not None:
+            try:
+                await self.disk.set(key, value)
+            except sqlite3.Error as e:
+                logger.warning(f"Disk cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_enabled": self.disk is not None,
+        }
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
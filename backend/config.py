@@ -0,0 +1,129 @@
+"""
+Настройки бэкенда SCreate. Значения читаются из переменных окружения (и файла .env)
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+# Ollama
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434").rstrip("/")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:4b")
+# Несколько серверов через запятую; по умолчанию — только OLLAMA_URL
+OLLAMA_URLS = [url.strip().rstrip("/") for url in os.getenv("OLLAMA_URLS", OLLAMA_URL).split(",") if url.strip()]
+
+# Таймауты запросов к Ollama (секунды)
+OLLAMA_CONNECT_TIMEOUT = _env_float("OLLAMA_CONNECT_TIMEOUT", 5.0)
+OLLAMA_GENERATE_TIMEOUT = _env_float("OLLAMA_GENERATE_TIMEOUT", 120.0)
+# Загрузка модели в память при прогреве может занимать минуты на больших моделях
+OLLAMA_PRELOAD_TIMEOUT = _env_float("OLLAMA_PRELOAD_TIMEOUT", 300.0)
+
+# Пул соединений и ограничение одновременных генераций (на каждый сервер)
+OLLAMA_MAX_CONNECTIONS = _env_int("OLLAMA_MAX_CONNECTIONS", 16)
+OLLAMA_MAX_CONCURRENCY = _env_int("OLLAMA_MAX_CONCURRENCY", 4)
+
+# Сколько модель остаётся в памяти Ollama после запроса (формат Ollama: "30m", "1h", "-1" — всегда)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Проверки здоровья и размыкатель цепи для пула серверов
+OLLAMA_HEALTH_INTERVAL = _env_float("OLLAMA_HEALTH_INTERVAL", 15.0)
+OLLAMA_HEALTH_TIMEOUT = _env_float("OLLAMA_HEALTH_TIMEOUT", 5.0)
+CIRCUIT_FAILURE_THRESHOLD = _env_int("CIRCUIT_FAILURE_THRESHOLD", 3)
+CIRCUIT_RESET_TIMEOUT = _env_float("CIRCUIT_RESET_TIMEOUT", 30.0)
+
+# Пауза между SSE-событиями (для анимации в UI), 0 — без задержек
+SSE_PACING_DELAY = _env_float("SSE_PACING_DELAY", 0.0)
+
+# Кэш результатов этапов генерации
+CACHE_MAX_ENTRIES = _env_int("CACHE_MAX_ENTRIES", 512)
+CACHE_TTL = _env_float("CACHE_TTL", 3600.0)
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "")  # пусто — дисковый уровень выключен
+CACHE_DISK_TTL = _env_float("CACHE_DISK_TTL", 7 * 86400.0)
+
+# Пакетная генерация
+BATCH_DB_PATH = os.getenv("BATCH_DB_PATH", "batch_jobs.db")
+BATCH_WORKERS = _env_int("BATCH_WORKERS", 2)  # квестов одновременно; каждый делает до 4 параллельных вызовов
+BATCH_MAX_PENDING = _env_int("BATCH_MAX_PENDING", 1000)
+
+# Хранилище сгенерированных квестов и событий их потоков (для переподключения)
+QUEST_DB_PATH = os.getenv("QUEST_DB_PATH", "quests.db")
+# Событий в буфере одного SSE-клиента; медленный клиент при переполнении догоняет по журналу
+QUEST_SUBSCRIBER_BUFFER = _env_int("QUEST_SUBSCRIBER_BUFFER", 256)
+
+# Импорт квестов старого формата: квестов в одной транзакции записи
+IMPORT_BATCH_SIZE = _env_int("IMPORT_BATCH_SIZE", 200)
+
+# Шаблоны промптов (prompts/*.txt) и бюджет токенов: num_ctx выбирается ступенями от
+# OLLAMA_NUM_CTX_MIN до OLLAMA_CONTEXT_LIMIT (окно модели), num_predict — ожидаемый ответ с запасом
+PROMPTS_DIR = os.getenv("PROMPTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts"))
+OLLAMA_CONTEXT_LIMIT = _env_int("OLLAMA_CONTEXT_LIMIT", 32768)
+OLLAMA_NUM_CTX_MIN = _env_int("OLLAMA_NUM_CTX_MIN", 4096)
+OUTPUT_TOKEN_RESERVE = _env_float("OUTPUT_TOKEN_RESERVE", 1.3)
+# Токенов на сводку персонажей, локаций или предметов в промпте сцен
+PROMPT_SUMMARY_TOKENS = _env_int("PROMPT_SUMMARY_TOKENS", 400)
+
+# Большие квесты: выше порога сцены пишутся окнами параллельно по скелету графа
+LARGE_QUEST_THRESHOLD = _env_int("LARGE_QUEST_THRESHOLD", 10)
+LARGE_QUEST_WINDOW = _env_int("LARGE_QUEST_WINDOW", 8)
+MAX_LOCATIONS = _env_int("MAX_LOCATIONS", 12)
+
+# Точечный ремонт ответа модели: число корректирующих запросов на этап и базовая пауза (сек),
+# пауза удваивается с каждой попыткой
+REPAIR_MAX_ATTEMPTS = _env_int("REPAIR_MAX_ATTEMPTS", 2)
+REPAIR_BACKOFF = _env_float("REPAIR_BACKOFF", 0.5)
+
+# Контроль допуска: token bucket на клиента (единицы стоимости квеста в секунду и запас),
+# общий лимит одновременных квестов и длина очереди ожидания
+RATE_LIMIT_RATE = _env_float("RATE_LIMIT_RATE", 1.0)  # 0 — без ограничения
+RATE_LIMIT_BURST = _env_float("RATE_LIMIT_BURST", 300.0)
+ADMISSION_MAX_ACTIVE = _env_int("ADMISSION_MAX_ACTIVE", len(OLLAMA_URLS) * OLLAMA_MAX_CONCURRENCY)
+ADMISSION_MAX_WAITING = _env_int("ADMISSION_MAX_WAITING", 100)
+ADMISSION_MAX_COST = _env_float("ADMISSION_MAX_COST", 500.0)  # дороже — отказ (400)
+
+# Разрешённые источники CORS через запятую
+CORS_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "*").split(",") if origin.strip()]
+
+# Сжатие ответов: разрешённые алгоритмы через запятую (br, gzip), пусто — без сжатия.
+# Ответы целиком меньше порога (байт) не сжимаются; потоки сжимаются всегда
+WIRE_COMPRESSION = [name.strip() for name in os.getenv("WIRE_COMPRESSION", "br,gzip").split(",") if name.strip()]
+WIRE_MIN_COMPRESS_SIZE = _env_int("WIRE_MIN_COMPRESS_SIZE", 1024)
+
+# Логи: уровень, формат (text или json — одна JSON-строка на запись для сборщика логов)
+# и доля квестов (0..1), для которых подробности по объектам и сценам пишутся без DEBUG
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_DETAIL_SAMPLE_RATE = _env_float("LOG_DETAIL_SAMPLE_RATE", 0.0)
+
+# Несколько воркеров (serve.py): общее состояние — memory (один процесс) или
+# sqlite:///путь.db (процессы одной машины). Аренда квеста или пакета живёт LEASE_TTL секунд
+# без продления; воркер другого владельца читает журнал квеста раз в SHARED_POLL_INTERVAL.
+# При остановке идущим квестам даётся DRAIN_TIMEOUT секунд, затем потоки закрываются
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "memory")
+LEASE_TTL = _env_float("LEASE_TTL", 30.0)
+SHARED_POLL_INTERVAL = _env_float("SHARED_POLL_INTERVAL", 0.5)
+DRAIN_TIMEOUT = _env_float("DRAIN_TIMEOUT", 30.0)
+
+# Упреждающая генерация: в простое Ollama пулы заполняются результатами этапов для пресетов
+# с наибольшим спросом (промахи кэша с затуханием за PREGEN_HALF_LIFE секунд). Всего
+# PREGEN_POOL_SIZE результатов (0 — выключено), не больше PREGEN_PER_PRESET на пресет,
+# пресеты со спросом ниже PREGEN_MIN_DEMAND не заполняются, результаты живут PREGEN_TTL секунд.
+# При нескольких воркерах пулы у каждого свои
+PREGEN_POOL_SIZE = _env_int("PREGEN_POOL_SIZE", 0)
+PREGEN_PER_PRESET = _env_int("PREGEN_PER_PRESET", 3)
+PREGEN_MIN_DEMAND = _env_float("PREGEN_MIN_DEMAND", 2.0)
+PREGEN_HALF_LIFE = _env_float("PREGEN_HALF_LIFE", 1800.0)
+PREGEN_TTL = _env_float("PREGEN_TTL", 6 * 3600.0)
+PREGEN_INTERVAL = _env_float("PREGEN_INTERVAL", 1.0)
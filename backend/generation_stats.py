@@ -0,0 +1,63 @@
+"""
+Учёт токенов, задержки и fallback-ов по режимам генерации (staged / one_shot)
+"""
+
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+# Счётчики текущего квеста. Задачи этапов копируют контекст при создании,
+# поэтому все они пишут в один и тот же словарь
+current_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("current_usage", default=None)
+
+
+def new_usage() -> Dict[str, int]:
+    usage = {"prompt_tokens": 0, "eval_tokens": 0, "model_calls": 0, "fallbacks": 0, "repairs": 0, "coalesced": 0}
+    current_usage.set(usage)
+    return usage
+
+
+def track(key: str, value: int = 1) -> None:
+    usage = current_usage.get()
+    if usage is not None:
+        usage[key] = usage.get(key, 0) + value
+
+
+def track_ollama_response(data: Dict[str, Any]) -> None:
+    """Берёт счётчики токенов из финального ответа Ollama"""
+    track("model_calls")
+    track("prompt_tokens", data.get("prompt_eval_count", 0) or 0)
+    track("eval_tokens", data.get("eval_count", 0) or 0)
+
+
+class ModeStats:
+    """Накопленная статистика по режимам для сравнения staged и one_shot"""
+
+    def __init__(self) -> None:
+        self._modes: Dict[str, Dict[str, float]] = {}
+
+    def record(self, mode: str, latency: float, usage: Dict[str, int]) -> None:
+        stats = self._modes.setdefault(mode, {
+            "quests": 0, "latency_total": 0.0, "prompt_tokens": 0,
+            "eval_tokens": 0, "model_calls": 0, "fallbacks": 0, "repairs": 0, "quests_with_fallback": 0,
+        })
+        stats["quests"] += 1
+        stats["latency_total"] += latency
+        for key in ("prompt_tokens", "eval_tokens", "model_calls", "fallbacks", "repairs"):
+            stats[key] += usage.get(key, 0)
+        if usage.get("fallbacks"):
+            stats["quests_with_fallback"] += 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for mode, stats in self._modes.items():
+            quests = stats["quests"] or 1
+            result[mode] = {
+                "quests": stats["quests"],
+                "avg_latency": round(stats["latency_total"] / quests, 3),
+                "avg_prompt_tokens": round(stats["prompt_tokens"] / quests, 1),
+                "avg_eval_tokens": round(stats["eval_tokens"] / quests, 1),
+                "avg_model_calls": round(stats["model_calls"] / quests, 2),
+                "avg_repairs": round(stats["repairs"] / quests, 2),
+                "fallback_rate": round(stats["quests_with_fallback"] / quests, 3),
+            }
+        return result
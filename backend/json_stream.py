@@ -0,0 +1,194 @@
+"""
+Инкрементальный разбор JSON-массива из потока токенов модели
+"""
+
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+
+class IncrementalArrayParser:
+    """
+    Получает текст кусками (feed) и возвращает элементы верхнеуровневого JSON-массива,
+    как только закрывается очередной объект/массив. Текст до первой '[' (пояснения,
+    markdown-ограждение) пропускается. Каждый символ просматривается один раз, куски
+    незакрытого элемента копятся списком и склеиваются один раз, когда он закрывается, —
+    время линейно и для длинных элементов.
+    """
+
+    def __init__(self) -> None:
+        self._parts: List[str] = []  # куски текущего элемента, начиная с его открывающей скобки
+        self._started = False   # встретили открывающую '[' верхнего уровня
+        self._finished = False  # встретили закрывающую ']'
+        self._depth = 0         # вложенность внутри текущего элемента
+        self._in_string = False
+        self._escape = False
+        self.count = 0
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def feed(self, chunk: str) -> List[Any]:
+        if self._finished or not chunk:
+            return []
+
+        items: List[Any] = []
+        # Начало текущего элемента в этом куске; 0 — элемент начался в прошлых кусках
+        start = 0 if self._depth else -1
+        i = 0
+
+        while i < len(chunk):
+            ch = chunk[i]
+
+            if not self._started:
+                if ch == "[":
+                    self._started = True
+                i += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                i += 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0:
+                    start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:
+                    if ch == "]":
+                        self._finished = True
+                        break
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._parts.append(chunk[start:i + 1])
+                        try:
+                            items.append(json.loads("".join(self._parts)))
+                            self.count += 1
+                        except json.JSONDecodeError:
+                            pass
+                        # Разобранную часть больше не храним
+                        self._parts = []
+                        start = -1
+            i += 1
+
+        if self._depth:
+            self._parts.append(chunk[start:])
+        return items
+
+
+# Строка JSON целиком (развёрнутый цикл, без катастрофического бэктрекинга),
+# одиночная кавычка незакрытой строки или скобка
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|"|[{}\[\]]', re.S)
+_OPEN = re.compile(r"[{\[]")
+
+
+def _match_end(text: str, start: int) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    Индекс закрывающей скобки для значения, начинающегося в start (-1, если текст оборван),
+    и границы уже закрывшихся элементов верхнего уровня, если это массив
+    """
+    depth = 0
+    elem_start = -1
+    elements: List[Tuple[int, int]] = []
+    for match in _TOKEN.finditer(text, start):
+        ch = text[match.start()]
+        if ch == '"':
+            if match.end() - match.start() == 1:
+                # Строка не закрыта до конца текста
+                break
+            continue
+        if ch == "{" or ch == "[":
+            depth += 1
+            if depth == 2:
+                elem_start = match.start()
+        else:
+            depth -= 1
+            if depth == 0:
+                return match.start(), elements
+            if depth == 1 and elem_start != -1:
+                elements.append((elem_start, match.end()))
+                elem_start = -1
+    return -1, elements
+
+
+def _fenced_block(text: str) -> Optional[str]:
+    """Содержимое первого markdown-блока ```...``` (до конца текста, если блок не закрыт)"""
+    start = text.find("```")
+    if start == -1:
+        return None
+    newline = text.find("\n", start)
+    if newline == -1:
+        return None
+    end = text.find("```", newline)
+    return text[newline + 1:end if end != -1 else len(text)]
+
+
+def _salvage(text: str, elements: List[Tuple[int, int]]) -> List[Any]:
+    items = []
+    for start, end in elements:
+        try:
+            items.append(json.loads(text[start:end]))
+        except json.JSONDecodeError:
+            break
+    return items
+
+
+def _scan(text: str) -> Any:
+    i = 0
+    while True:
+        match = _OPEN.search(text, i)
+        if match is None:
+            break
+        i = match.start()
+
+        end, elements = _match_end(text, i)
+        if end == -1:
+            # Текст оборван: спасаем начальные элементы массива
+            if text[i] == "[":
+                items = _salvage(text, elements)
+                if items:
+                    return items
+            raise ValueError("truncated JSON value")
+
+        try:
+            return json.loads(text[i:end + 1])
+        except json.JSONDecodeError:
+            # Например, "[список]" в пояснении — продолжаем после кандидата
+            i = end + 1
+
+    raise ValueError("no JSON value found")
+
+
+def extract_json(text: str) -> Any:
+    """
+    Находит первое целое JSON-значение (объект или массив) в ответе модели за линейное время:
+    сначала внутри markdown-блока, затем во всём тексте; пояснения вокруг и кандидаты
+    с битым JSON пропускаются. Если ответ оборван внутри массива, возвращает уже
+    закрывшиеся элементы. Бросает ValueError, если ничего извлечь не удалось.
+    """
+    stripped = text.strip()
+    if stripped[:1] in ("{", "["):
+        # Быстрый путь: ответ — чистый JSON
+        try:
+            return json.loads(stripped)
+        except json.JSONDecodeError:
+            pass
+
+    fenced = _fenced_block(text)
+    if fenced is not None:
+        try:
+            return _scan(fenced)
+        except ValueError:
+            pass
+    return _scan(text)
@@ -0,0 +1,106 @@
+"""
+Генерация больших квестов по частям: скелет графа сцен строится кодом,
+тексты сцен модель пишет окнами параллельно, затем окна сшиваются по скелету
+"""
+
+import random
+from typing import Any, Dict, List, Tuple
+
+# Доля сцен с дополнительной развилкой в зависимости от сложности квеста
+BRANCHING = {"simple": 0.15, "medium": 0.3, "complex": 0.5}
+
+
+def build_skeleton(scene_count: int, location_ids: List[str], complexity: str = "medium", seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Скелет графа: основная линия scene_1 -> ... -> scene_N плюс развилки вперёд на 2-4 сцены,
+    которые потом сходятся обратно. Граф ацикличен, все сцены достижимы, последняя — концовка.
+    Развилки выбираются детерминированно от seed.
+    """
+    rng = random.Random(seed)
+    branching = BRANCHING.get(complexity, BRANCHING["medium"])
+    locations = location_ids or ["location_1"]
+
+    skeleton = []
+    for i in range(scene_count):
+        number = i + 1
+        is_last = number == scene_count
+        skeleton.append({
+            "id": f"scene_{number}",
+            "location_id": locations[i * len(locations) // scene_count],
+            "next": [] if is_last else [f"scene_{number + 1}"],
+            "is_ending": is_last,
+        })
+
+    for i in range(scene_count - 2):
+        if rng.random() < branching:
+            jump = min(scene_count - 1, i + rng.randint(2, 4))
+            target = skeleton[jump]["id"]
+            if target not in skeleton[i]["next"]:
+                skeleton[i]["next"].append(target)
+
+    return skeleton
+
+
+def windows(skeleton: List[Dict[str, Any]], size: int) -> List[List[Dict[str, Any]]]:
+    size = max(1, size)
+    return [skeleton[i:i + size] for i in range(0, len(skeleton), size)]
+
+
+def describe_window(window: List[Dict[str, Any]]) -> str:
+    """Компактное описание окна для промпта: сцена, локация, куда ведут выборы"""
+    lines = []
+    for scene in window:
+        if scene["is_ending"]:
+            links = "КОНЦОВКА, без выборов"
+        else:
+            links = "выборы ведут в " + ", ".join(scene["next"])
+        lines.append(f"- {scene['id']} (локация {scene['location_id']}): {links}")
+    return "\n".join(lines)
+
+
+def _references(value: Any) -> List[str]:
+    """Ссылки сцены на персонажей или предметы: только строковые id"""
+    if not isinstance(value, list):
+        return []
+    return [ref for ref in value if isinstance(ref, str) and ref]
+
+
+def stitch(skeleton: List[Dict[str, Any]], generated: Dict[str, Dict[str, Any]],
+           location_ids: List[str]) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Собирает сцены по скелету: тексты берутся из ответа модели, связи — из скелета.
+    Возвращает (сцены, число сцен-заглушек).
+    """
+    valid_locations = set(location_ids)
+    scenes = []
+    placeholders = 0
+    for position, node in enumerate(skeleton, start=1):
+        body = generated.get(node["id"])
+        if not isinstance(body, dict) or not body.get("title") or not body.get("description"):
+            body = {"title": f"Сцена {position}", "description": f"Описание сцены {position}"}
+            placeholders += 1
+
+        model_choices = [c for c in body.get("choices") or [] if isinstance(c, dict)]
+        by_target = {c.get("next_scene_id"): c for c in model_choices}
+        choices = []
+        for k, target in enumerate(node["next"]):
+            source = by_target.get(target) or (model_choices[k] if k < len(model_choices) else {})
+            choices.append({
+                "id": f"choice_{position}_{k + 1}",
+                "text": source.get("text") or "Продолжить",
+                "next_scene_id": target,
+                "consequence": source.get("consequence"),
+            })
+
+        location_id = body.get("location_id")
+        scenes.append({
+            "id": node["id"],
+            "title": body["title"],
+            "description": body["description"],
+            "location_id": location_id if location_id in valid_locations else node["location_id"],
+            "characters": _references(body.get("characters")),
+            "items": _references(body.get("items")),
+            "choices": choices,
+            "is_ending": node["is_ending"],
+        })
+    return scenes, placeholders
@@ -0,0 +1,430 @@
+"""
+Импорт квестов старого формата (scene_id / text / choices[].next_scene, как в
+frontend/src/data/quest.txt и app.py) в схему бэкенда: Scene, Choice, Location.
+
+Файлы читаются кусками: элементы верхнеуровневого JSON-массива разбираются по одному,
+в памяти одновременно — один квест и одна пачка готовых к записи. Поддерживаются:
+- массив сцен — один квест (перед ним может идти текстовая шапка, как в example-quest.txt:
+  СЕТТИНГ, ОТПРАВНАЯ ТОЧКА, КЛЮЧЕВЫЕ ЛОКАЦИИ, ВАЖНЫЕ ПЕРСОНАЖИ, ПРЕДМЕТЫ);
+- массив квестов — каждый элемент массив сцен или объект с полем "scenes";
+- .jsonl / .ndjson — квест на строку;
+- каталоги — рекурсивно.
+
+    python legacy_import.py archive/ frontend/src/data/quest.txt --db quests.db
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from scene_graph import repair_scene_graph
+
+logger = logging.getLogger(__name__)
+
+SUFFIXES = (".txt", ".json", ".jsonl", ".ndjson")
+LINE_SUFFIXES = (".jsonl", ".ndjson")
+CHUNK_SIZE = 64 * 1024
+# Текстовая шапка до массива сцен короткая; мегабайт без '[' — это не квест
+MAX_HEADER = 1024 * 1024
+# Один элемент массива (квест) больше этого — скорее битый файл, чем квест
+MAX_ELEMENT = 64 * 1024 * 1024
+TITLE_LENGTH = 60
+
+# Начало массива: '[' в начале строки (в шапке квадратные скобки встречаются внутри текста)
+_ARRAY_START = re.compile(r"^[ \t]*\[", re.M)
+_HEADER_LINE = re.compile(r"^([А-ЯЁA-Z][А-ЯЁA-Z ]+):\s*(.*)$")
+_LIST_ITEM = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s*(.+)$")
+
+SETTINGS = {
+    "фэнтези": "fantasy", "киберпанк": "cyberpunk", "постапокалипсис": "post-apocalyptic",
+    "научная фантастика": "sci-fi", "хоррор": "horror", "вестерн": "western",
+}
+QUEST_STYLES = {
+    "детектив": "detective", "выживание": "survival", "политика": "politics",
+    "приключение": "adventure", "романтика": "romance", "хоррор": "horror",
+}
+
+
+class LegacyFormatError(ValueError):
+    """Квест нельзя превратить в схему бэкенда: нет сцен или ни одна не разобралась"""
+
+
+@dataclass
+class LegacyQuest:
+    source: str
+    index: int
+    scenes: List[Any]
+    header: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None  # элемент не разобрался; квест попадёт в отчёт с этой ошибкой
+
+
+@dataclass
+class ImportReport:
+    files: int = 0
+    imported: int = 0
+    duplicates: int = 0
+    failed: int = 0
+    repaired_references: int = 0
+    errors: List[str] = field(default_factory=list)
+    max_errors: int = 100
+
+    def error(self, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(message)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "files": self.files, "imported": self.imported, "duplicates": self.duplicates,
+            "failed": self.failed, "repaired_references": self.repaired_references, "errors": self.errors,
+        }
+
+
+def iter_files(paths: Iterable[Path]) -> Iterator[Path]:
+    """Файлы архива по порядку; каталоги обходятся рекурсивно, скрытые файлы пропускаются"""
+    for path in paths:
+        if path.is_dir():
+            for child in sorted(path.rglob("*")):
+                if child.is_file() and child.suffix.lower() in SUFFIXES and not child.name.startswith("."):
+                    yield child
+        else:
+            yield path
+
+
+def parse_header(text: str) -> Dict[str, Any]:
+    """Текстовая шапка: «МЕТКА: значение» и списки под метками (локации, персонажи, предметы)"""
+    sections: Dict[str, List[str]] = {}
+    current: Optional[List[str]] = None
+    for line in text.splitlines():
+        match = _HEADER_LINE.match(line.strip())
+        if match:
+            current = sections.setdefault(match.group(1).strip(), [])
+            if match.group(2):
+                current.append(match.group(2).strip())
+        elif current is not None and line.strip():
+            current.append(line.strip())
+
+    def value(*labels: str) -> Optional[str]:
+        for label in labels:
+            if sections.get(label):
+                return " ".join(sections[label])
+        return None
+
+    def entries(label: str, prefix: str) -> List[Dict[str, str]]:
+        result = []
+        for line in sections.get(label, []):
+            match = _LIST_ITEM.match(line)
+            if not match:
+                continue
+            # «Название - описание»; без описания название повторяется
+            parts = re.split(r"\s+[-–—]\s+", match.group(1), maxsplit=1)
+            result.append({"id": f"{prefix}_{len(result) + 1}", "name": parts[0].strip(),
+                           "description": parts[-1].strip()})
+        return result
+
+    header: Dict[str, Any] = {}
+    setting = value("СЕТТИНГ")
+    if setting:
+        header["setting"] = SETTINGS.get(setting.lower(), "custom")
+        header["setting_label"] = setting
+    style = value("СТИЛЬ КВЕСТА")
+    if style:
+        header["quest_style"] = QUEST_STYLES.get(style.lower(), "custom")
+    starting_point = value("ОТПРАВНАЯ ТОЧКА")
+    if starting_point:
+        header["starting_point"] = starting_point
+    description = " ".join(part for part in (value("ОПИСАНИЕ МИРА"), value("ОСНОВНАЯ ИСТОРИЯ")) if part)
+    if description:
+        header["description"] = description
+    header["locations"] = entries("КЛЮЧЕВЫЕ ЛОКАЦИИ", "location")
+    header["characters"] = [{**c, "role": "персонаж"} for c in entries("ВАЖНЫЕ ПЕРСОНАЖИ", "character")]
+    header["items"] = entries("ПРЕДМЕТЫ", "item")
+    return header
+
+
+def _split_element(element: Any) -> Tuple[str, Any]:
+    """Элемент верхнеуровневого массива: сцена, квест (массив сцен или объект) или мусор"""
+    if isinstance(element, dict):
+        if "scenes" in element:
+            return "quest", element
+        if "scene_id" in element or "text" in element:
+            return "scene", element
+    if isinstance(element, list):
+        return "quest", {"scenes": element}
+    return "invalid", element
+
+
+def read_quests(stream: IO[str], source: str, chunk_size: int = CHUNK_SIZE) -> Iterator[LegacyQuest]:
+    """Квесты одного файла; файл читается кусками по chunk_size символов"""
+    if source.lower().endswith(LINE_SUFFIXES):
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                kind, quest = _split_element(json.loads(line))
+            except json.JSONDecodeError as e:
+                yield LegacyQuest(source, number, [], error=f"строка не разобралась: {e}")
+                continue
+            if kind != "quest":
+                yield LegacyQuest(source, number, [], error="строка не является квестом")
+                continue
+            yield LegacyQuest(source, number, quest.get("scenes") or [], dict(quest))
+        return
+
+    # Шапка — всё до массива сцен
+    prefix = ""
+    start = None
+    while start is None:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        prefix += chunk
+        match = _ARRAY_START.search(prefix)
+        if match:
+            start = match.end() - 1
+        elif len(prefix) > MAX_HEADER:
+            raise LegacyFormatError(f"{source}: JSON-массив не найден")
+    header = parse_header(prefix[:start] if start is not None else prefix)
+    if start is None:
+        # Только шапка (как example-quest.txt): мир описан, сцен нет
+        yield LegacyQuest(source, 0, [], header, error="только текстовое описание, сцен нет")
+        return
+
+    scenes: List[Any] = []
+    index = 0
+    for element in iter_array(stream, prefix[start + 1:], source, chunk_size):
+        kind, value = _split_element(element)
+        if kind == "quest":
+            index += 1
+            yield LegacyQuest(source, index, value.get("scenes") or [], {**header, **value})
+        else:
+            # Сцены одного квеста; мусор отсеется при конвертации с описанием ошибки
+            scenes.append(value)
+    if scenes or not index:
+        yield LegacyQuest(source, 0, scenes, header)
+
+
+def iter_array(stream: IO[str], buf: str, source: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Элементы JSON-массива, открывающая '[' которого уже прочитана; buf — текст после неё.
+    Каждый элемент разбирается json.raw_decode (на C), буфер дочитывается, только если
+    элемент не поместился, поэтому в памяти — текущий элемент и один кусок файла.
+    IncrementalArrayParser для потока токенов модели здесь в разы медленнее: он идёт по символам.
+    """
+    decoder = json.JSONDecoder()
+    pos = 0
+    eof = False
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        if pos < len(buf):
+            try:
+                element, pos = decoder.raw_decode(buf, pos)
+                yield element
+                continue
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise LegacyFormatError(f"{source}: элемент массива не разобрался: {e}")
+        elif eof:
+            raise LegacyFormatError(f"{source}: файл оборван, массив не закрыт")
+        if len(buf) - pos > MAX_ELEMENT:
+            raise LegacyFormatError(f"{source}: элемент массива больше {MAX_ELEMENT} символов")
+        # Недочитанный элемент: буфер растёт вдвое, чтобы повторные разборы стоили O(n)
+        chunk = stream.read(max(chunk_size, len(buf) - pos))
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def _scene_id(value: Any) -> str:
+    text = str(value).strip()
+    return text if text.startswith("scene_") else f"scene_{text}"
+
+
+def _title(text: str) -> str:
+    """Первое предложение сцены, обрезанное по слову"""
+    sentence = re.split(r"(?<=[.!?…])\s", text.strip(), maxsplit=1)[0]
+    if len(sentence) <= TITLE_LENGTH:
+        return sentence
+    return sentence[:TITLE_LENGTH].rsplit(" ", 1)[0].rstrip(",;:—-") + "…"
+
+
+def convert_scenes(raw_scenes: List[Any], location_id: str, errors: List[str]) -> List[Dict[str, Any]]:
+    """Сцены старого формата в схему Scene/Choice; невалидные пропускаются с описанием в errors"""
+    scenes = []
+    for i, raw in enumerate(raw_scenes):
+        if not isinstance(raw, dict):
+            errors.append(f"элемент {i + 1} не является объектом")
+            continue
+        if raw.get("scene_id") in (None, ""):
+            errors.append(f"у элемента {i + 1} нет поля 'scene_id'")
+            continue
+        scene_id = _scene_id(raw["scene_id"])
+        text = raw.get("text") or raw.get("description")
+        if not isinstance(text, str) or not text.strip():
+            errors.append(f"у {scene_id} пустое поле 'text'")
+            continue
+        choices = []
+        for k, choice in enumerate(raw.get("choices") or []):
+            if not isinstance(choice, dict) or not choice.get("text") or choice.get("next_scene") in (None, ""):
+                errors.append(f"у {scene_id} выбор {k + 1} без текста или next_scene")
+                continue
+            choices.append({
+                "id": f"choice_{scene_id.removeprefix('scene_')}_{len(choices) + 1}",
+                "text": str(choice["text"]),
+                "next_scene_id": _scene_id(choice["next_scene"]),
+                "consequence": choice.get("consequence"),
+            })
+        scenes.append({
+            "id": scene_id,
+            "title": raw.get("title") or _title(text),
+            "description": text.strip(),
+            "location_id": location_id,
+            "characters": [],
+            "items": [],
+            "choices": choices,
+            "is_ending": bool(raw.get("is_ending")) and not choices,
+        })
+    return scenes
+
+
+def convert_quest(legacy: LegacyQuest) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    """
+    Квест старого формата в (request_data, quest, метрики графа) для QuestStore.
+    Граф сцен ремонтируется так же, как у сгенерированных квестов.
+    """
+    if legacy.error:
+        raise LegacyFormatError(f"{legacy.source}#{legacy.index}: {legacy.error}")
+    header = legacy.header
+    errors: List[str] = []
+    locations = [dict(location) for location in header.get("locations") or []]
+    if not locations:
+        place = header.get("starting_point") or "Место действия"
+        locations = [{"id": "location_1", "name": place, "description": place}]
+    scenes = convert_scenes(legacy.scenes, locations[0]["id"], errors)
+    if not scenes:
+        reason = "; ".join(errors[:3]) or "нет сцен"
+        raise LegacyFormatError(f"{legacy.source}#{legacy.index}: {reason}")
+    scenes, graph = repair_scene_graph(scenes)
+
+    label = header.get("setting_label") or Path(legacy.source).stem
+    request_data = {
+        "setting": header.get("setting") or "custom",
+        "quest_style": header.get("quest_style") or "custom",
+        "starting_point": header.get("starting_point") or locations[0]["name"],
+        "source": f"legacy:{legacy.source}#{legacy.index}",
+    }
+    quest = {
+        "title": header.get("title") or f"Квест: {label}",
+        "description": header.get("description") or scenes[0]["description"],
+        "setting": request_data["setting"],
+        "quest_style": request_data["quest_style"],
+        "starting_point": request_data["starting_point"],
+        "characters": header.get("characters") or [],
+        "locations": locations,
+        "items": header.get("items") or [],
+        "scenes": scenes,
+        "scene_graph": graph,
+    }
+    graph["skipped"] = len(errors)
+    return request_data, quest, graph
+
+
+def quest_id(quest: Dict[str, Any]) -> str:
+    """Id по содержанию: повторный импорт того же архива не создаёт дубликатов"""
+    body = json.dumps({k: quest[k] for k in ("title", "description", "scenes")}, ensure_ascii=False, sort_keys=True)
+    return "legacy_" + hashlib.sha1(body.encode()).hexdigest()[:24]
+
+
+Insert = Callable[[List[Tuple[str, Dict[str, Any], Dict[str, Any]]]], int]
+
+
+def import_quests(
+    sources: Iterable[Tuple[str, IO[str]]],
+    insert: Insert,
+    batch_size: int = 200,
+    chunk_size: int = CHUNK_SIZE,
+    report: Optional[ImportReport] = None,
+) -> ImportReport:
+    """
+    Разбирает файлы, конвертирует квесты и передаёт их в insert пачками по batch_size.
+    insert возвращает число реально добавленных (остальные — дубликаты).
+    """
+    report = report or ImportReport()
+    batch: List[Tuple[str, Dict[str, Any], Dict[str, Any]]] = []
+
+    def flush() -> None:
+        if batch:
+            inserted = insert(batch)
+            report.imported += inserted
+            report.duplicates += len(batch) - inserted
+            batch.clear()
+
+    for name, stream in sources:
+        report.files += 1
+        try:
+            for legacy in read_quests(stream, name, chunk_size):
+                try:
+                    request_data, quest, graph = convert_quest(legacy)
+                except LegacyFormatError as e:
+                    report.error(str(e))
+                    continue
+                report.repaired_references += graph["fixed_references"]
+                batch.append((quest_id(quest), request_data, quest))
+                if len(batch) >= batch_size:
+                    flush()
+        except LegacyFormatError as e:
+            report.error(str(e))
+        except UnicodeDecodeError as e:
+            report.error(f"{name}: {e}")
+    flush()
+    return report
+
+
+def open_files(paths: Iterable[Path]) -> Iterator[Tuple[str, IO[str]]]:
+    for path in iter_files(paths):
+        with open(path, encoding="utf-8") as stream:
+            yield str(path), stream
+
+
+def main_cli() -> None:
+    from quest_store import QuestStore
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", type=Path, help="файлы или каталоги архива")
+    parser.add_argument("--db", default=None, help="SQLite-хранилище квестов (по умолчанию QUEST_DB_PATH)")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true", help="только проверить и посчитать")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.dry_run:
+        store = None
+    else:
+        import config
+        store = QuestStore(args.db or config.QUEST_DB_PATH)
+
+    started = time.perf_counter()
+    report = import_quests(
+        open_files(args.paths),
+        store.import_quests if store is not None else len,
+        batch_size=args.batch_size,
+    )
+    if store is not None:
+        store.close()
+    print(json.dumps({**report.as_dict(), "seconds": round(time.perf_counter() - started, 2)},
+                     ensure_ascii=False, indent=2))
+    sys.exit(1 if report.failed and not report.imported else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
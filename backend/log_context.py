@@ -0,0 +1,167 @@
+"""
+Структурные логи: id запроса и квеста в каждой записи, события «имя + поля» с ленивым
+форматированием, подробности по объектам и сценам только для выборки квестов, JSON-формат
+для сборщика логов
+"""
+
+import json
+import logging
+import re
+import sys
+import uuid
+import zlib
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, TextIO
+
+# Поля контекста (request_id, quest_id) и попал ли текущий запрос или квест в выборку подробностей
+_fields: ContextVar[Dict[str, str]] = ContextVar("log_fields", default={})
+_sampled: ContextVar[bool] = ContextVar("log_sampled", default=False)
+
+_sample_rate = 0.0
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s%(context)s: %(message)s"
+
+
+def configure(level: str = "INFO", fmt: str = "text", sample_rate: float = 0.0,
+              stream: Optional[TextIO] = None) -> None:
+    """
+    Настраивает корневой логгер. sample_rate — доля запросов и квестов, для которых
+    подробности пишутся даже на уровне INFO; при DEBUG они пишутся всегда
+    """
+    global _sample_rate
+    _sample_rate = min(1.0, max(0.0, sample_rate))
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.addFilter(ContextFilter())
+    handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+
+def _in_sample(key: str) -> bool:
+    # Решение по хэшу id, а не случайное: квест, продолженный после перезапуска или
+    # в другом процессе, остаётся в выборке или вне её
+    return _sample_rate > 0 and zlib.crc32(key.encode()) % 10000 < _sample_rate * 10000
+
+
+def begin(**fields: str) -> None:
+    """Добавляет поля к контексту логов текущей задачи и заново решает, попала ли она в выборку"""
+    _fields.set({**_fields.get(), **fields})
+    _sampled.set(_in_sample("/".join(fields.values())))
+
+
+def detail_enabled(logger: logging.Logger) -> bool:
+    """Писать ли подробности: квест в выборке или логгер на уровне DEBUG"""
+    return _sampled.get() or logger.isEnabledFor(logging.DEBUG)
+
+
+class _Fields:
+    """Поля события в виде k=v; строка собирается, только если запись действительно пишется"""
+
+    __slots__ = ("fields",)
+
+    def __init__(self, fields: Dict[str, Any]):
+        self.fields = fields
+
+    def __str__(self) -> str:
+        return " ".join(f"{key}={_short(value)}" for key, value in self.fields.items())
+
+
+def _short(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    if isinstance(value, dict):
+        return ",".join(f"{k}:{v}" for k, v in value.items()) or "-"
+    return str(value)
+
+
+def event(logger: logging.Logger, level: int, name: str, **fields: Any) -> None:
+    """Одно структурное событие: в тексте «name k=v ...», в JSON — отдельные поля"""
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s %s", name, _Fields(fields), extra={"event": name, "fields": fields})
+
+
+def detail(logger: logging.Logger, name: str, **fields: Any) -> None:
+    """
+    Подробность по отдельному объекту или сцене. Вне выборки и без DEBUG не стоит ничего,
+    кроме проверки; в выборке пишется на INFO, чтобы не включать DEBUG всему процессу
+    """
+    if _sampled.get():
+        event(logger, logging.INFO, name, sampled=True, **fields)
+    elif logger.isEnabledFor(logging.DEBUG):
+        event(logger, logging.DEBUG, name, **fields)
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет поля контекста в каждую запись, в том числе от сторонних библиотек"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        fields = _fields.get()
+        record.ctx = fields
+        record.context = "".join(f" {key}={value}" for key, value in fields.items()) if fields else ""
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, контекст, событие и его поля"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        data.update(getattr(record, "ctx", {}))
+        name = getattr(record, "event", None)
+        if name is not None:
+            data["event"] = name
+            data.update(record.fields)
+        else:
+            data["message"] = record.getMessage()
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class CorrelationMiddleware:
+    """
+    ASGI-middleware: request_id из заголовка X-Request-Id (или новый) попадает в контекст
+    логов запроса и в ответ. Задачи генерации, созданные запросом, наследуют контекст.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = _incoming_id(scope)
+        begin(request_id=request_id)
+        header = (b"x-request-id", request_id.encode())
+
+        async def send_with_id(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), header]
+            await send(message)
+
+        await self.app(scope, receive, send_with_id)
+
+
+def _incoming_id(scope: Dict[str, Any]) -> str:
+    for name, value in scope.get("headers", []):
+        if name == b"x-request-id":
+            candidate = value.decode("latin-1")
+            # Чужой id принимаем, только если он не сломает строку лога
+            if _REQUEST_ID.match(candidate):
+                return candidate
+            break
+    return new_id()
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
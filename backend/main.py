@@ -1,32 +1,110 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, Header, HTTPException, Query, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, ValidationError
-import json
-import re
+import io
+import random
 import asyncio
-import requests
-from typing import Optional, List, Dict, Any
-import logging
 import time
+from typing import Optional, List, Dict, Any, Callable, Tuple
+import logging
 
-logging.basicConfig(level=logging.INFO)
+import config
+from admission import AdmissionRejected, FairQueue, RateLimiter, Ticket, current_ticket, retry_headers
+from batch import BatchManager, BatchQueueFull, BatchStore
+from cache import GenerationCache, MemoryLRU, SQLiteTier, make_key
+from config import OLLAMA_MODEL
+import generation_stats
+from generation_stats import ModeStats
+from ollama_client import OllamaError
+from ollama_pool import OllamaPool
+from json_stream import IncrementalArrayParser, extract_json
+from legacy_import import import_quests
+from pipeline import PARTIAL, Stage, StageEvents, run_stages
+from prompt_templates import PromptLibrary, TokenBudget, scene_counts, summarize
+from quest_store import COMPLETED, RECONNECT_EVENT, QuestRuns, QuestStore, apply_event, format_event_id, new_quest, parse_event_id
+from scene_graph import graph_metrics, repair_scene_graph
+from schemas import QuestPayload
+from shared_state import WORKER_ID, open_state
+from singleflight import SingleFlight
+import wire
+import large_quest
+import log_context
+import metrics
+import node_regen
+import pregen
+import repair
+import schemas
+
+log_context.configure(config.LOG_LEVEL, config.LOG_FORMAT, config.LOG_DETAIL_SAMPLE_RATE)
 logger = logging.getLogger(__name__)
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
-OLLAMA_URL = "http://localhost:11434/api/generate"
-OLLAMA_MODEL = "gemma3:4b"
 model_loaded = False
+# Воркер останавливается: новые квесты не принимаются, идущие дорабатывают
+draining = False
+
+# Состояние, общее для воркеров: здоровье Ollama, аренды квестов и пакетов
+shared_state = open_state(config.SHARED_STATE_URL)
+
+def set_model_loaded(value: bool) -> None:
+    """Доступность модели меняется на лету по результатам проверок здоровья пула"""
+    global model_loaded
+    changed = value != model_loaded
+    model_loaded = value
+    metrics.MODEL_LOADED.set(1 if value else 0)
+    if not changed:
+        return
+    if value:
+        logger.info(f"✅ Ollama подключена: {OLLAMA_MODEL}")
+    else:
+        logger.warning("⚠️ Ollama недоступна, используется fallback режим")
+
+ollama = OllamaPool(
+    config.OLLAMA_URLS,
+    OLLAMA_MODEL,
+    failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=config.CIRCUIT_RESET_TIMEOUT,
+    health_interval=config.OLLAMA_HEALTH_INTERVAL,
+    probe_timeout=config.OLLAMA_HEALTH_TIMEOUT,
+    preload_timeout=config.OLLAMA_PRELOAD_TIMEOUT,
+    # Модель загружается с минимальным num_ctx бюджета, иначе первый же запрос её перезагрузит
+    preload_options={"num_ctx": config.OLLAMA_NUM_CTX_MIN},
+    on_availability=set_model_loaded,
+    shared=shared_state,
+    worker_id=WORKER_ID,
+    max_concurrency=config.OLLAMA_MAX_CONCURRENCY,
+    max_connections=config.OLLAMA_MAX_CONNECTIONS,
+    connect_timeout=config.OLLAMA_CONNECT_TIMEOUT,
+    default_timeout=config.OLLAMA_GENERATE_TIMEOUT,
+    keep_alive=config.OLLAMA_KEEP_ALIVE,
+)
+
+generation_cache = GenerationCache(
+    MemoryLRU(config.CACHE_MAX_ENTRIES, config.CACHE_TTL),
+    SQLiteTier(config.CACHE_DB_PATH, config.CACHE_DISK_TTL) if config.CACHE_DB_PATH else None,
+)
+
+# Упреждающая генерация популярных пресетов в простое Ollama (PREGEN_POOL_SIZE=0 — выключена)
+preset_pool = pregen.PresetPool(
+    config.PREGEN_POOL_SIZE,
+    per_preset=config.PREGEN_PER_PRESET,
+    min_demand=config.PREGEN_MIN_DEMAND,
+    half_life=config.PREGEN_HALF_LIFE,
+    ttl=config.PREGEN_TTL,
+)
 
 app = FastAPI(title="SCreate Quest Generator API", version="2.0.0")
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=config.CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-Id"],
 )
+# id запроса в логах и в ответе; задачи генерации наследуют его вместе с контекстом
+app.add_middleware(log_context.CorrelationMiddleware)
 
 class QuestRequest(BaseModel):
     setting: str
@@ -40,246 +118,276 @@ class QuestRequest(BaseModel):
     character_count: Optional[int] = 3
     main_goal: Optional[str] = None
     themes: Optional[str] = None
+    pacing: Optional[float] = None  # пауза между SSE-событиями для анимации UI, сек
+    stream_tokens: Optional[bool] = False  # пересылать токены модели как partial-события
+    variation_seed: Optional[int] = None  # новый seed — новая генерация вместо кэша
+    generation_mode: Optional[str] = "staged"  # "staged" — по этапам, "one_shot" — один вызов со схемой
 
-class Character(BaseModel):
-    id: str
-    name: str
-    role: str
-    description: str
-    motivation: Optional[str] = None
-    is_ally: Optional[bool] = None
-    is_enemy: Optional[bool] = None
-
-class Location(BaseModel):
-    id: str
-    name: str
-    description: str
-
-class Item(BaseModel):
-    id: str
-    name: str
-    description: str
-    is_key: Optional[bool] = None
-    effect: Optional[str] = None
+class BatchRequest(BaseModel):
+    requests: List[QuestRequest]
+    priority: Optional[int] = 0  # меньше — раньше
 
-class Choice(BaseModel):
+class RegenerateRequest(BaseModel):
+    kind: str  # scene, character, location или item
     id: str
-    text: str
-    next_scene_id: str
-    consequence: Optional[str] = None
+    instructions: Optional[str] = None  # пожелания автора к новой версии
 
-class Scene(BaseModel):
-    id: str
-    title: str
-    description: str
-    location_id: str
-    characters: Optional[List[str]] = None
-    items: Optional[List[str]] = None
-    choices: List[Choice]
-    is_ending: Optional[bool] = None
+def note_fallback(count: int = 1) -> None:
+    """Учитывает замену ответа модели заглушками — в usage квеста и в метриках"""
+    generation_stats.track("fallbacks", count)
+    metrics.PARSE_FALLBACKS.inc(count)
 
 def safe_json_parse(text: str, fallback_data: Any) -> Any:
 
     try:
-
-        cleaned_text = re.sub(r'```(?:json)?\s*([\s\S]*?)\s*```', r'\1', text.strip())
-
-        json_match = re.search(r'(\[.*\]|\{.*\})', cleaned_text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-            return json.loads(json_str)
-
-        return json.loads(cleaned_text)
+        return extract_json(text)
     
-    except (json.JSONDecodeError, AttributeError) as e:
-        logger.warning(f"JSON parsing failed: {e}. Using fallback data.")
+    except (ValueError, AttributeError) as e:
+        log_context.event(logger, logging.WARNING, "json_parse_failed", error=e, chars=len(text or ""))
+        note_fallback()
         return fallback_data
 
-def validate_and_fix_data(data: List[Dict], required_fields: List[str], data_type: str) -> List[Dict]:
-
+def validate_and_fix_data(data: List[Dict], required_fields: List[str], data_type: str, errors: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Оставляет валидные объекты; описания ошибок для корректирующего промпта пишутся в errors.
+    Персонажи, локации, предметы и сцены проверяются схемами из schemas.py одним вызовом
+    на список, с приведением типов; остальное — по списку обязательных полей.
+    В лог — одно итоговое событие на вызов, по объектам — только для квестов из выборки
+    """
+    if errors is None:
+        errors = []
+    
     if not isinstance(data, list):
-        logger.warning(f"Expected list for {data_type}, got {type(data)}")
+        log_context.event(logger, logging.WARNING, "validation_failed", type=data_type, got=type(data).__name__)
+        errors.append("ответ не является JSON-массивом")
         return []
     
+    adapter = schemas.adapter_for(data_type, required_fields)
+    if adapter is None:
+        return validate_required_fields(data, required_fields, data_type, errors)
+    
+    validated_data, failures, dropped = schemas.validate_batch(data_type, adapter, data)
+    rejected: Dict[str, int] = {}
+    for i, item_errors in failures.items():
+        reason, message = schemas.describe(i, data[i], item_errors)
+        errors.append(message)
+        rejected[reason] = rejected.get(reason, 0) + 1
+        log_context.detail(logger, "item_rejected", type=data_type, index=i, reason=reason, errors=len(item_errors))
+    
+    if rejected or dropped:
+        log_context.event(logger, logging.WARNING, "validation", type=data_type, total=len(data),
+                          valid=len(validated_data), rejected=rejected, dropped=dropped)
+    return validated_data
+
+def validate_required_fields(data: List[Any], required_fields: List[str], data_type: str, errors: List[str]) -> List[Dict]:
+    """Проверка по списку полей: поля есть и непусты, choices — массив. Типы не проверяются"""
     validated_data = []
+    rejected: Dict[str, int] = {}
     for i, item in enumerate(data):
         if not isinstance(item, dict):
-            logger.warning(f"Skipping invalid {data_type} item at index {i}")
-            continue
-        
-
-        valid_item = True
-        for field in required_fields:
-            if field not in item:
-                logger.warning(f"Missing required field '{field}' in {data_type} item")
-                valid_item = False
-                break
-            if field == 'choices':
-                if not isinstance(item[field], list):
-                    logger.warning(f"Field '{field}' must be a list in {data_type} item")
-                    valid_item = False
+            reason = "not_object"
+            errors.append(f"элемент {i + 1} не является объектом")
+        else:
+            reason = None
+            for field in required_fields:
+                if field not in item:
+                    reason = f"missing({field})"
+                    errors.append(f"у {item.get('id', f'элемента {i + 1}')} нет поля '{field}'")
+                    break
+                if field == 'choices':
+                    if not isinstance(item[field], list):
+                        reason = f"not_list({field})"
+                        errors.append(f"у {item.get('id', f'элемента {i + 1}')} поле '{field}' должно быть массивом")
+                        break
+                elif not item[field]:
+                    reason = f"empty({field})"
+                    errors.append(f"у {item.get('id', f'элемента {i + 1}')} пустое поле '{field}'")
                     break
-            elif not item[field]:
-                logger.warning(f"Missing required field '{field}' in {data_type} item")
-                valid_item = False
-                break
         
-        if valid_item:
+        if reason is None:
             validated_data.append(item)
+            continue
+        rejected[reason] = rejected.get(reason, 0) + 1
+        log_context.detail(logger, "item_rejected", type=data_type, index=i, reason=reason)
     
+    if rejected:
+        log_context.event(logger, logging.WARNING, "validation", type=data_type, total=len(data),
+                          valid=len(validated_data), rejected=rejected)
     return validated_data
 
 def fix_scene_references(scenes: List[Dict]) -> List[Dict]:
     """Исправляет ссылки между сценами, чтобы все next_scene_id указывали на существующие сцены"""
-    if not scenes:
-        return scenes
-    
-    # Получаем список всех ID сцен
-    scene_ids = {scene['id'] for scene in scenes}
-    logger.info(f"Available scene IDs: {scene_ids}")
-    
-    # Исправляем ссылки в choices
-    for scene in scenes:
-        logger.info(f"Processing scene: {scene['id']}")
-        if 'choices' in scene and isinstance(scene['choices'], list):
-            logger.info(f"Scene {scene['id']} has {len(scene['choices'])} choices")
-            for i, choice in enumerate(scene['choices']):
-                if isinstance(choice, dict) and 'next_scene_id' in choice:
-                    original_next_scene_id = choice['next_scene_id']
-                    logger.info(f"Choice {i+1} in scene {scene['id']} points to: {original_next_scene_id}")
-                    # Если ссылка указывает на несуществующую сцену
-                    if choice['next_scene_id'] not in scene_ids:
-                        logger.warning(f"Invalid scene reference found: {choice['next_scene_id']} in scene {scene['id']}")
-                        
-                        # Если это не последняя сцена, ссылаемся на следующую по порядку
-                        try:
-                            current_scene_num = int(scene['id'].split('_')[-1]) if '_' in scene['id'] else 1
-                            next_scene_id = f"scene_{current_scene_num + 1}"
-                            
-                            # Если следующая сцена существует, используем её
-                            if next_scene_id in scene_ids:
-                                choice['next_scene_id'] = next_scene_id
-                                logger.info(f"Fixed choice reference from {original_next_scene_id} to {next_scene_id}")
-                            else:
-                                # Попробуем найти любую доступную сцену
-                                available_scenes = [sid for sid in scene_ids if sid != scene['id']]
-                                if available_scenes:
-                                    choice['next_scene_id'] = available_scenes[0]
-                                    logger.info(f"Fixed choice reference from {original_next_scene_id} to {available_scenes[0]}")
-                                else:
-                                    # Иначе делаем сцену завершающей
-                                    scene['is_ending'] = True
-                                    scene['choices'] = []  # Убираем choices для завершающей сцены
-                                    logger.info(f"Made scene {scene['id']} an ending scene due to invalid reference")
-                                    break
-                        except (ValueError, IndexError) as e:
-                            logger.error(f"Error parsing scene ID {scene['id']}: {e}")
-                            # Делаем сцену завершающей в случае ошибки
-                            scene['is_ending'] = True
-                            scene['choices'] = []
-                            break
-                    else:
-                        logger.info(f"Valid scene reference: {original_next_scene_id} in scene {scene['id']}")
-    
-    # Логируем финальное состояние
-    logger.info("Final scene structure:")
-    for scene in scenes:
-        choices_info = []
-        if 'choices' in scene and scene['choices']:
-            for choice in scene['choices']:
-                if isinstance(choice, dict) and 'next_scene_id' in choice:
-                    choices_info.append(f"'{choice.get('text', 'No text')}' -> {choice['next_scene_id']}")
-        logger.info(f"Scene {scene['id']}: {len(choices_info)} choices - {choices_info}")
-    
-    return scenes
+    fixed_scenes, _ = repair_scene_graph(scenes)
+    return fixed_scenes
 
 async def check_ollama_connection() -> bool:
+    """Дешёвая проверка через /api/tags и /api/ps; загрузка модели идёт в фоне"""
+    return await ollama.refresh()
 
-    try:
-        response = requests.post(
-            OLLAMA_URL,
-            json={"model": OLLAMA_MODEL, "prompt": "Test", "stream": False},
-            timeout=30
-        )
-        return response.status_code == 200
-    except Exception as e:
-        logger.error(f"Ollama connection failed: {e}")
-        return False
+# Одинаковые промпты, отправленные одновременно (например, одинаковые пресеты), идут в Ollama один раз
+inflight_prompts = SingleFlight()
 
-async def generate_with_ai(prompt: str) -> str:
+async def generate_with_ai(prompt: str, timeout: Optional[float] = None, options: Optional[Dict[str, Any]] = None, response_format: Optional[Any] = None) -> str:
 
     global model_loaded
     
     if not model_loaded:
         return "Fallback response due to AI unavailability"
     
+    if pregen.speculative.get():
+        # Упреждающая генерация не делит вызов с живыми запросами: её отменяют, как только они появляются
+        return await _call_ollama(prompt, timeout, options, response_format)
+    key = make_key(OLLAMA_MODEL, prompt, options, response_format)
+    response, shared = await inflight_prompts.do(key, lambda: _call_ollama(prompt, timeout, options, response_format))
+    if shared:
+        generation_stats.track("coalesced")
+        metrics.COALESCED.labels("prompt").inc()
+    return response
+
+async def _call_ollama(prompt: str, timeout: Optional[float], options: Optional[Dict[str, Any]], response_format: Optional[Any]) -> str:
+    started = time.perf_counter()
     try:
-        response = requests.post(
-            OLLAMA_URL,
-            json={"model": OLLAMA_MODEL, "prompt": prompt, "stream": False},
-            timeout=120
-        )
-        
-        if response.status_code == 200:
-            return response.json().get("response", "")
-        else:
-            logger.error(f"AI generation failed with status {response.status_code}")
-            return "Fallback response"
+        extra = {"format": response_format} if response_format is not None else {}
+        data = await ollama.generate(prompt, timeout=timeout, options=options, **extra)
+        generation_stats.track_ollama_response(data)
+        metrics.observe_ollama_response(data)
+        return data.get("response", "")
     
-    except Exception as e:
+    except OllamaError as e:
         logger.error(f"AI generation error: {e}")
+        metrics.OLLAMA_ERRORS.inc()
         return "Fallback response"
+    
+    finally:
+        metrics.OLLAMA_REQUEST_DURATION.labels("generate").observe(time.perf_counter() - started)
 
-async def generate_quest_description(request: QuestRequest) -> str:
-    """Генерирует описание сюжета квеста"""
-    setting = request.setting if request.setting != 'custom' else request.custom_setting
-    quest_style = request.quest_style if request.quest_style != 'custom' else request.custom_quest_style
-    timestamp = int(time.time())
+# Получатель промежуточных данных этапа: {'delta': текст} или {'item': объект, 'index': n}
+PartialCallback = Callable[[Dict[str, Any]], None]
+
+async def generate_with_ai_stream(prompt: str, on_partial: PartialCallback, parse_items: bool = True, timeout: Optional[float] = None, options: Optional[Dict[str, Any]] = None) -> str:
+    """Потоковая генерация: чанки и закрывшиеся элементы JSON-массива уходят в on_partial"""
+    global model_loaded
     
-    prompt = f"""Создай краткое описание сюжета для квеста в сеттинге "{setting}" стиля "{quest_style}".
-    Отправная точка: {request.starting_point}
-    {f'Основная цель: {request.main_goal}' if request.main_goal else ''}
-    {f'Темы: {request.themes}' if request.themes else ''}
+    if not model_loaded:
+        return "Fallback response due to AI unavailability"
     
-    Описание должно быть:
-    - Кратким (2-3 предложения)
-    - Интригующим
-    - Задающим общий тон приключения
+    parser = IncrementalArrayParser() if parse_items else None
+    parts = []
+    started = time.perf_counter()
+    try:
+        async for chunk in ollama.generate_stream(prompt, timeout=timeout, options=options):
+            if chunk.get("done"):
+                generation_stats.track_ollama_response(chunk)
+                metrics.observe_ollama_response(chunk)
+            text = chunk.get("response", "")
+            if not text:
+                continue
+            parts.append(text)
+            on_partial({'delta': text})
+            if parser is not None:
+                for item in parser.feed(text):
+                    on_partial({'item': item, 'index': parser.count - 1})
+        return "".join(parts)
     
-    Timestamp: {timestamp}
-    Верни ТОЛЬКО текст описания, без дополнительного форматирования!"""
+    except OllamaError as e:
+        logger.error(f"AI generation error: {e}")
+        metrics.OLLAMA_ERRORS.inc()
+        return "Fallback response"
     
-    try:
-        response = await generate_with_ai(prompt)
-        return response.strip()
-    except Exception as e:
-        logger.error(f"Ошибка при генерации описания квеста: {e}")
-        return f"Увлекательное приключение в мире {setting}, где вас ждут неожиданные повороты сюжета и сложные выборы."
+    finally:
+        metrics.OLLAMA_REQUEST_DURATION.labels("stream").observe(time.perf_counter() - started)
 
-async def generate_characters(request: QuestRequest) -> List[Dict]:
+# Шаблоны промптов компилируются один раз при старте
+prompt_library = PromptLibrary(config.PROMPTS_DIR)
+token_budget = TokenBudget(config.OLLAMA_CONTEXT_LIMIT, config.OLLAMA_NUM_CTX_MIN, config.OUTPUT_TOKEN_RESERVE)
 
-    setting = request.setting if request.setting != 'custom' else request.custom_setting
-    timestamp = int(time.time())
-    
-    prompt = f"""Создай {request.character_count} персонажей для квеста в сеттинге "{setting}".
-    
-Верни ТОЛЬКО JSON массив в формате:
-    [{{
-        "id": "character_1",
-        "name": "Уникальное имя",
-        "role": "роль",
-        "description": "описание",
-        "motivation": "мотивация",
-        "is_ally": true,
-        "is_enemy": false
-    }}]
-    
-    Timestamp: {timestamp}
-    ТОЛЬКО JSON, никакого дополнительного текста!"""
+def output_counts(request: QuestRequest, data_type: str, count: int) -> Dict[str, int]:
+    """Сколько объектов каждого вида модель должна вернуть — основа для num_predict"""
+    if data_type == "scene":
+        return scene_counts(count, request.complexity)
+    return {data_type: count}
+
+def generation_options(request: QuestRequest, prompt: str, counts: Dict[str, int]) -> Dict[str, Any]:
+    """Параметры Ollama: num_predict и num_ctx по бюджету токенов, seed фиксирует вариант генерации"""
+    options: Dict[str, Any] = token_budget.options(prompt, counts)
+    if request.variation_seed is not None:
+        options["seed"] = request.variation_seed
+    return options
+
+def request_fields(request: QuestRequest) -> Dict[str, Any]:
+    """Общие подстановки шаблонов промптов"""
+    return {
+        "setting": request.setting if request.setting != 'custom' else request.custom_setting,
+        "quest_style": request.quest_style if request.quest_style != 'custom' else request.custom_quest_style,
+        "starting_point": request.starting_point,
+        "main_goal": request.main_goal,
+        "themes": request.themes,
+        "tone": request.tone,
+        "complexity": request.complexity,
+        "scene_count": request.scene_count,
+        "character_count": request.character_count,
+        "location_count": location_count(request),
+    }
+
+async def _generate(prompt: str, request: QuestRequest, on_partial: Optional[PartialCallback], counts: Dict[str, int], parse_items: bool = True) -> str:
+    options = generation_options(request, prompt, counts)
+    if on_partial is None:
+        return await generate_with_ai(prompt, options=options)
+    return await generate_with_ai_stream(prompt, on_partial, parse_items=parse_items, options=options)
+
+def parse_and_validate(text: str, required_fields: List[str], data_type: str) -> Tuple[List[Dict], List[str]]:
+    """Разбирает ответ модели без подстановки заглушек: (валидные объекты, ошибки)"""
+    try:
+        data = extract_json(text)
+    except ValueError:
+        return [], ["ответ не содержит JSON-массива"]
+    errors: List[str] = []
+    return validate_and_fix_data(data, required_fields, data_type, errors), errors
+
+async def generate_with_repair(prompt: str, request: QuestRequest, on_partial: Optional[PartialCallback], required_fields: List[str], data_type: str, expected: List[str], fallback: List[Dict], context: str = "", counts: Optional[Dict[str, int]] = None) -> List[Dict]:
+    """
+    Генерирует список объектов этапа. Валидные объекты сохраняются, невалидные и недостающие
+    перезапрашиваются коротким промптом с ошибками (до REPAIR_MAX_ATTEMPTS раз с экспоненциальной
+    паузой); заглушки из fallback закрывают только то, что так и не удалось получить.
+    counts — ожидаемый объём ответа, если он больше числа expected (предметов просим 3-5).
+    """
+    ai_response = await _generate(prompt, request, on_partial, counts or output_counts(request, data_type, len(expected)))
+    items, errors = parse_and_validate(ai_response, required_fields, data_type)
+    missing = repair.missing_ids(items, expected)
     
-    ai_response = await generate_with_ai(prompt)
+    attempt = 0
+    while missing and model_loaded and attempt < config.REPAIR_MAX_ATTEMPTS:
+        attempt += 1
+        await asyncio.sleep(repair.backoff_delay(attempt, config.REPAIR_BACKOFF))
+        if not errors:
+            errors = [f"получено {len(items)} объектов вместо {len(expected)}"]
+        logger.info("Repairing %s: %d missing, attempt %d", data_type, len(missing), attempt)
+        generation_stats.track("repairs")
+        metrics.REPAIR_ATTEMPTS.labels(data_type).inc()
+        prompt = repair.repair_prompt(data_type, missing, errors, required_fields, context)
+        response = await generate_with_ai(prompt, options=generation_options(request, prompt, output_counts(request, data_type, len(missing))))
+        fresh, errors = parse_and_validate(response, required_fields, data_type)
+        metrics.REPAIRED_ITEMS.labels(data_type).inc(repair.merge(items, fresh, missing))
     
-    fallback_characters = [{
+    items = repair.restore_order(items, expected)
+    if missing:
+        items, placeholders = repair.fill_from_fallback(items, missing, fallback)
+        if placeholders:
+            logger.warning("%s: %d of %d objects fell back to placeholders", data_type, placeholders, len(expected))
+            note_fallback(placeholders)
+    return items
+
+def location_count(request: QuestRequest) -> int:
+    """По локации на сцену, но не больше MAX_LOCATIONS — большие квесты переиспользуют локации"""
+    return max(1, min(request.scene_count, config.MAX_LOCATIONS))
+
+def quest_cost(request: QuestRequest) -> float:
+    """Оценка стоимости квеста в генерируемых объектах: описание, персонажи, локации, предметы и сцены (вдвое дороже)"""
+    return 1 + (request.character_count or 0) + location_count(request) + 3 + 2 * (request.scene_count or 0)
+
+def fallback_characters(request: QuestRequest) -> List[Dict]:
+
+    return [{
         "id": f"character_{i+1}",
         "name": f"Персонаж {i+1}",
         "role": "guide",
@@ -288,109 +396,28 @@ async def generate_characters(request: QuestRequest) -> List[Dict]:
         "is_ally": True,
         "is_enemy": False
     } for i in range(request.character_count)]
-    
-    characters = safe_json_parse(ai_response, fallback_characters)
-    return validate_and_fix_data(characters, ["id", "name", "role", "description"], "character")
 
-async def generate_locations(request: QuestRequest) -> List[Dict]:
+def fallback_locations(request: QuestRequest) -> List[Dict]:
 
-    setting = request.setting if request.setting != 'custom' else request.custom_setting
-    timestamp = int(time.time())
-    
-    prompt = f"""Создай {request.scene_count} локаций для квеста в сеттинге "{setting}".
-    Первая локация связана с "{request.starting_point}".
-    
-    Верни ТОЛЬКО JSON массив в формате:
-    [{{
-        "id": "location_1",
-        "name": "Название локации",
-        "description": "Описание локации"
-    }}]
-    
-    Timestamp: {timestamp}
-    ТОЛЬКО JSON, никакого дополнительного текста!"""
-    
-    ai_response = await generate_with_ai(prompt)
-    
-    fallback_locations = [{
+    return [{
         "id": f"location_{i+1}",
         "name": f"Локация {i+1}",
         "description": "Загадочное место"
-    } for i in range(request.scene_count)]
-    
-    locations = safe_json_parse(ai_response, fallback_locations)
-    return validate_and_fix_data(locations, ["id", "name", "description"], "location")
+    } for i in range(location_count(request))]
 
-async def generate_items(request: QuestRequest) -> List[Dict]:
+def fallback_items() -> List[Dict]:
 
-    setting = request.setting if request.setting != 'custom' else request.custom_setting
-    timestamp = int(time.time())
-    
-    prompt = f"""Создай 3-5 предметов для квеста в сеттинге "{setting}".
-    
-    Верни ТОЛЬКО JSON массив в формате:
-    [{{
-        "id": "item_1",
-        "name": "Название предмета",
-        "description": "Описание предмета",
-        "is_key": true,
-        "effect": "Эффект предмета"
-    }}]
-    
-    Timestamp: {timestamp}
-    ТОЛЬКО JSON, никакого дополнительного текста!"""
-    
-    ai_response = await generate_with_ai(prompt)
-    
-    fallback_items = [{
+    return [{
         "id": f"item_{i+1}",
         "name": f"Предмет {i+1}",
         "description": "Загадочный артефакт",
         "is_key": i == 0,
         "effect": "Неизвестный эффект"
     } for i in range(3)]
-    
-    items = safe_json_parse(ai_response, fallback_items)
-    return validate_and_fix_data(items, ["id", "name", "description"], "item")
-
-async def generate_scenes(request: QuestRequest, characters: List[Dict], locations: List[Dict], items: List[Dict]) -> List[Dict]:
-
-    setting = request.setting if request.setting != 'custom' else request.custom_setting
-    quest_style = request.quest_style if request.quest_style != 'custom' else request.custom_quest_style
-    timestamp = int(time.time())
-    
-    char_names = [char['name'] for char in characters[:3]]
-    loc_names = [loc['name'] for loc in locations[:3]]
-    item_names = [item['name'] for item in items[:3]]
-    
-    prompt = f"""Создай {request.scene_count} сцен для квеста в сеттинге "{setting}" стиля "{quest_style}".
-    Персонажи: {char_names}
-    Локации: {loc_names}
-    Предметы: {item_names}
-    
-    Верни ТОЛЬКО JSON массив в формате:
-    [{{
-        "id": "scene_1",
-        "title": "Название сцены",
-        "description": "Описание сцены",
-        "location_id": "location_1",
-        "characters": ["character_1"],
-        "items": ["item_1"],
-        "choices": [{{
-            "id": "choice_1_1",
-            "text": "Текст выбора",
-            "next_scene_id": "scene_2",
-            "consequence": "Последствие"
-        }}],
-        "is_ending": false
-    }}]
-    
-    Timestamp: {timestamp}
-    ТОЛЬКО JSON, никакого дополнительного текста!"""
-    
-    ai_response = await generate_with_ai(prompt)
-    
-    fallback_scenes = []
+
+def fallback_scenes(request: QuestRequest, characters: List[Dict], locations: List[Dict]) -> List[Dict]:
+
+    scenes = []
     for i in range(request.scene_count):
         scene = {
             "id": f"scene_{i+1}",
@@ -413,97 +440,795 @@ async def generate_scenes(request: QuestRequest, characters: List[Dict], locatio
         else:
             scene["choices"] = []  # Последняя сцена без выборов
             
-        fallback_scenes.append(scene)
+        scenes.append(scene)
+    
+    return scenes
+
+async def generate_quest_description(request: QuestRequest, on_partial: Optional[PartialCallback] = None) -> str:
+    """Генерирует описание сюжета квеста"""
+    fields = request_fields(request)
+    setting = fields["setting"]
+    prompt = prompt_library.render("description", **fields)
+    
+    try:
+        response = await _generate(prompt, request, on_partial, {"description": 1}, parse_items=False)
+        return response.strip()
+    except Exception as e:
+        logger.error(f"Ошибка при генерации описания квеста: {e}")
+        return f"Увлекательное приключение в мире {setting}, где вас ждут неожиданные повороты сюжета и сложные выборы."
+
+async def generate_characters(request: QuestRequest, on_partial: Optional[PartialCallback] = None) -> List[Dict]:
+
+    fields = request_fields(request)
+    setting = fields["setting"]
+    prompt = prompt_library.render("characters", **fields)
+    
+    return await generate_with_repair(
+        prompt, request, on_partial, ["id", "name", "role", "description"], "character",
+        repair.expected_ids("character", request.character_count), fallback_characters(request),
+        context=f'Сеттинг: "{setting}".',
+    )
+
+async def generate_locations(request: QuestRequest, on_partial: Optional[PartialCallback] = None) -> List[Dict]:
+
+    fields = request_fields(request)
+    setting = fields["setting"]
+    prompt = prompt_library.render("locations", **fields)
+    
+    return await generate_with_repair(
+        prompt, request, on_partial, ["id", "name", "description"], "location",
+        repair.expected_ids("location", location_count(request)), fallback_locations(request),
+        context=f'Сеттинг: "{setting}".',
+    )
+
+async def generate_items(request: QuestRequest, on_partial: Optional[PartialCallback] = None) -> List[Dict]:
+
+    fields = request_fields(request)
+    setting = fields["setting"]
+    prompt = prompt_library.render("items", **fields)
+    
+    fallback = fallback_items()
+    return await generate_with_repair(
+        prompt, request, on_partial, ["id", "name", "description"], "item",
+        repair.expected_ids("item", len(fallback)), fallback,
+        context=f'Сеттинг: "{setting}". Поля is_key и effect тоже заполни.',
+        counts={"item": 5},
+    )
+
+def context_summaries(characters: List[Dict], locations: List[Dict], items: List[Dict]) -> Dict[str, str]:
+    """Персонажи, локации и предметы для промпта сцен: id и имя всех, а не первые три имени"""
+    budget = config.PROMPT_SUMMARY_TOKENS
+    return {
+        "characters": summarize(characters, ("role",), budget),
+        "locations": summarize(locations, (), budget),
+        "items": summarize(items, (), budget),
+    }
+
+async def generate_scenes(request: QuestRequest, characters: List[Dict], locations: List[Dict], items: List[Dict], on_partial: Optional[PartialCallback] = None) -> List[Dict]:
+
+    if request.scene_count > config.LARGE_QUEST_THRESHOLD:
+        return await generate_scenes_chunked(request, characters, locations, items, on_partial)
+    
+    prompt = prompt_library.render("scenes", **request_fields(request), **context_summaries(characters, locations, items))
+    
+    scene_ids = repair.expected_ids("scene", request.scene_count)
+    context = f"""Сцены квеста: {", ".join(scene_ids)}; next_scene_id в choices ведёт только на них.
+Локации: {", ".join(loc['id'] for loc in locations)}. Персонажи: {", ".join(char['id'] for char in characters)}.
+Формат сцены: id, title, description, location_id, characters, items, choices [{{text, next_scene_id, consequence}}], is_ending."""
+    
+    scenes = await generate_with_repair(
+        prompt, request, on_partial, ["id", "title", "description", "location_id", "choices"], "scene",
+        scene_ids, fallback_scenes(request, characters, locations), context=context,
+    )
+    return finalize_scenes(scenes)
+
+async def generate_scenes_chunked(request: QuestRequest, characters: List[Dict], locations: List[Dict], items: List[Dict], on_partial: Optional[PartialCallback] = None) -> List[Dict]:
+    """Большой квест: скелет графа кодом, тексты сцен окнами параллельно, сшивка и ремонт графа"""
+    location_ids = [loc['id'] for loc in locations]
+    skeleton = large_quest.build_skeleton(request.scene_count, location_ids, request.complexity or "medium", request.variation_seed or 0)
+    parts = large_quest.windows(skeleton, config.LARGE_QUEST_WINDOW)
+    
+    fields = {**request_fields(request), **context_summaries(characters, locations, items), "parts": len(parts)}
+    
+    async def generate_window(number: int, window: List[Dict]) -> List[Dict]:
+        prompt = prompt_library.render("scene_window", **fields, part=number, window=large_quest.describe_window(window))
+        
+        # Сцены, не полученные и после ремонта, станут заглушками при сшивке
+        context = f"Переходы сцен:\n{large_quest.describe_window(window)}\nФормат сцены: id, title, description, location_id, characters, items, choices [{{text, next_scene_id, consequence}}]."
+        result = await generate_with_repair(
+            prompt, request, None, ["id", "title", "description"], "scene",
+            [scene['id'] for scene in window], [], context=context,
+        )
+        if on_partial is not None:
+            on_partial({'window': number, 'windows': len(parts)})
+        return result
+    
+    # Окна независимы; одновременность ограничивает семафор клиента Ollama
+    results = await asyncio.gather(*(generate_window(i + 1, window) for i, window in enumerate(parts)))
+    generated = {
+        str(scene.get('id')): scene
+        for window_scenes in results for scene in window_scenes if isinstance(scene, dict)
+    }
     
-    scenes = safe_json_parse(ai_response, fallback_scenes)
+    scenes, placeholders = large_quest.stitch(skeleton, generated, location_ids)
+    if placeholders:
+        logger.warning("Large quest: %d of %d scenes fell back to placeholders", placeholders, len(scenes))
+        note_fallback(placeholders)
+    return finalize_scenes(scenes)
+
+def finalize_scenes(scenes: Any) -> List[Dict]:
+    """Валидирует сцены и исправляет ссылки между ними"""
     validated_scenes = validate_and_fix_data(scenes, ["id", "title", "description", "location_id", "choices"], "scene")
+    # Отброшенная сцена — тоже заглушка: ремонт графа обойдёт её молча
+    lost = (len(scenes) if isinstance(scenes, list) else 1) - len(validated_scenes)
+    if lost > 0:
+        note_fallback(lost)
     
     # Исправляем ссылки между сценами
     fixed_scenes = fix_scene_references(validated_scenes)
     
     return fixed_scenes
 
+def quest_json_schema(request: QuestRequest) -> Dict[str, Any]:
+    """JSON-схема QuestPayload с ограничением числа сцен и персонажей под запрос"""
+    schema = QuestPayload.model_json_schema()
+    properties = schema["properties"]
+    properties["scenes"]["minItems"] = properties["scenes"]["maxItems"] = request.scene_count
+    properties["characters"]["minItems"] = properties["characters"]["maxItems"] = request.character_count
+    return schema
+
+async def generate_quest_one_shot(request: QuestRequest) -> Dict[str, Any]:
+    """Генерирует весь квест одним вызовом, ответ модели ограничен JSON-схемой"""
+    fields = request_fields(request)
+    setting = fields["setting"]
+    prompt = prompt_library.render("one_shot", **fields)
+    counts = {
+        "description": 1, "character": request.character_count, "location": location_count(request), "item": 5,
+        **scene_counts(request.scene_count, request.complexity),
+    }
+    
+    ai_response = await generate_with_ai(prompt, options=generation_options(request, prompt, counts), response_format=quest_json_schema(request))
+    data = safe_json_parse(ai_response, {})
+    if not isinstance(data, dict):
+        note_fallback()
+        data = {}
+    
+    characters = validate_and_fix_data(data.get("characters", fallback_characters(request)), ["id", "name", "role", "description"], "character")
+    locations = validate_and_fix_data(data.get("locations", fallback_locations(request)), ["id", "name", "description"], "location")
+    items = validate_and_fix_data(data.get("items", fallback_items()), ["id", "name", "description"], "item")
+    scenes = finalize_scenes(data.get("scenes", fallback_scenes(request, characters, locations)))
+    description = data.get("description") or f"Увлекательное приключение в мире {setting}, где вас ждут неожиданные повороты сюжета и сложные выборы."
+    
+    return {
+        "description": str(description).strip(),
+        "characters": characters,
+        "locations": locations,
+        "items": items,
+        "scenes": scenes,
+    }
+
+# Поля, не влияющие на содержимое квеста
+CACHE_IGNORED_FIELDS = {"pacing", "stream_tokens"}
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split()).lower()
+    return value
+
+def stage_cache_key(request: QuestRequest, stage: str, inputs: Optional[Dict[str, Any]] = None) -> str:
+    """Ключ кэша этапа: нормализованные поля запроса, модель, этап и входные данные этапа"""
+    fields = {k: _normalize(v) for k, v in request.model_dump(exclude=CACHE_IGNORED_FIELDS).items()}
+    return make_key(OLLAMA_MODEL, stage, fields, inputs or {})
+
+def preset_key(request: QuestRequest, stage: str) -> Optional[str]:
+    """Ключ пула упреждающей генерации: только поля, которые подставляются в промпт этапа"""
+    if not preset_pool.enabled or stage not in pregen.STAGES:
+        return None
+    template = prompt_library.templates["one_shot" if stage == "quest" else stage]
+    fields = request_fields(request)
+    return make_key(OLLAMA_MODEL, "pregen", stage, {name: _normalize(fields[name]) for name in sorted(template.fields)})
+
+def stage_summary(stage: str, cache: str, started: float, result: Any) -> None:
+    """Итоговое событие этапа — одна строка вместо подробностей по объектам"""
+    log_context.event(logger, logging.INFO, "stage", stage=stage, cache=cache,
+                      seconds=round(time.perf_counter() - started, 3),
+                      items=len(result) if isinstance(result, list) else 1)
+
+def cached_stage(request: QuestRequest, stage: str, func: Callable[..., Any]) -> Callable[..., Any]:
+    """Оборачивает функцию этапа: при попадании результат отдаётся сразу из кэша"""
+    async def run(**inputs):
+        started = time.perf_counter()
+        key = stage_cache_key(request, stage, inputs)
+        cached = await generation_cache.get(key)
+        if cached is not None:
+            metrics.STAGE_CACHE.labels(stage, "hit").inc()
+            stage_summary(stage, "hit", started, cached)
+            return cached
+        pool_key = preset_key(request, stage)
+        if pool_key is not None:
+            preset_pool.note(pool_key, stage, request.model_dump(exclude=CACHE_IGNORED_FIELDS | {"variation_seed"}))
+            pooled = preset_pool.take(pool_key)
+            if pooled is not None:
+                # Готовый результат из пула достаётся одному запросу; под ключом запроса он
+                # кэшируется, чтобы продолжение и повтор квеста видели то же самое
+                metrics.STAGE_CACHE.labels(stage, "pregen").inc()
+                await generation_cache.set(key, pooled)
+                stage_summary(stage, "pregen", started, pooled)
+                return pooled
+        metrics.STAGE_CACHE.labels(stage, "miss").inc()
+        # Без счётчиков квеста заглушки этапа не заметить — заводим свои
+        usage = generation_stats.current_usage.get() or generation_stats.new_usage()
+        fallbacks = usage["fallbacks"]
+        with metrics.STAGE_DURATION.labels(stage).time():
+            result = await func(**inputs)
+        # Fallback-ответы без модели и результаты с заглушками не кэшируем. Счётчики квеста
+        # общие для параллельных этапов: чужая заглушка в это время тоже отменяет запись
+        if model_loaded and usage["fallbacks"] == fallbacks:
+            await generation_cache.set(key, result)
+        stage_summary(stage, "miss", started, result)
+        return result
+    return run
+
 @app.on_event("startup")
 async def startup_event():
 
-    global model_loaded
     logger.info("🚀 Запуск SCreate Quest Generator API v2.0")
     
-    model_loaded = await check_ollama_connection()
-    if model_loaded:
-        logger.info(f"✅ Ollama подключена: {OLLAMA_MODEL}")
-    else:
+    await ollama.start()
+    await batch_manager.start()
+    await pregenerator.start()
+    if not await check_ollama_connection():
+        # Сообщение о fallback-режиме при старте, даже если состояние не менялось
         logger.warning("⚠️ Ollama недоступна, используется fallback режим")
 
-@app.post("/api/generate-quest-stream")
-async def generate_quest_stream(request: QuestRequest):
+@app.on_event("shutdown")
+async def shutdown_event():
 
-    
-    async def stream_generator():
-        try:
+    await pregenerator.stop()
+    await batch_manager.stop()
+    batch_store.close()
+    await quest_runs.stop()
+    quest_store.close()
+    # Общие вызовы модели не отменяются вместе с квестами — до закрытия клиента Ollama
+    await inflight_prompts.cancel()
+    await ollama.close()
+    generation_cache.close()
+    shared_state.close()
 
-            yield f"data: {json.dumps({'type': 'status', 'content': 'Начинаем генерацию квеста...'}, ensure_ascii=False)}\n\n"
-            await asyncio.sleep(0.5)
+async def drain(timeout: float) -> None:
+    """
+    Плавная остановка воркера (serve.py, до закрытия соединений): новые квесты и пакеты
+    получают 503, задания пакетов отдаются другим воркерам, идущие квесты дорабатывают
+    до timeout, а их потоки заканчиваются событием reconnect
+    """
+    global draining
+    draining = True
+    logger.info(f"Draining worker {WORKER_ID}: {quest_runs.active} quest(s) running")
+    await pregenerator.stop()
+    await batch_manager.drain()
+    await quest_runs.drain(timeout)
 
-            title = f"Квест: {request.setting.title() if request.setting != 'custom' else request.custom_setting}"
-            yield f"data: {json.dumps({'type': 'title', 'content': title}, ensure_ascii=False)}\n\n"
-            await asyncio.sleep(0.5)
-            
-            # Генерируем описание квеста
-            yield f"data: {json.dumps({'type': 'status', 'content': 'Создаём описание сюжета...'}, ensure_ascii=False)}\n\n"
-            description = await generate_quest_description(request)
-            yield f"data: {json.dumps({'type': 'description', 'content': description}, ensure_ascii=False)}\n\n"
-            await asyncio.sleep(0.5)
-
-            yield f"data: {json.dumps({'type': 'status', 'content': 'Создаём персонажей...'}, ensure_ascii=False)}\n\n"
-            characters = await generate_characters(request)
-            yield f"data: {json.dumps({'type': 'characters', 'content': characters}, ensure_ascii=False)}\n\n"
-            await asyncio.sleep(1)
-
-            yield f"data: {json.dumps({'type': 'status', 'content': 'Создаём локации...'}, ensure_ascii=False)}\n\n"
-            locations = await generate_locations(request)
-            yield f"data: {json.dumps({'type': 'locations', 'content': locations}, ensure_ascii=False)}\n\n"
-            await asyncio.sleep(1)
-
-            yield f"data: {json.dumps({'type': 'status', 'content': 'Создаём предметы...'}, ensure_ascii=False)}\n\n"
-            items = await generate_items(request)
-            yield f"data: {json.dumps({'type': 'items', 'content': items}, ensure_ascii=False)}\n\n"
-            await asyncio.sleep(1)
-
-            yield f"data: {json.dumps({'type': 'status', 'content': 'Создаём сцены...'}, ensure_ascii=False)}\n\n"
-            scenes = await generate_scenes(request, characters, locations, items)
-            
-            for i, scene in enumerate(scenes):
-                yield f"data: {json.dumps({'type': 'scene', 'content': scene, 'scene_number': i + 1, 'total_scenes': len(scenes)}, ensure_ascii=False)}\n\n"
-                await asyncio.sleep(0.5)
+mode_stats = ModeStats()
+
+async def quest_events(request: QuestRequest, pacing: float = 0.0, prefill: Optional[Dict[str, Any]] = None):
+    """
+    Генерирует квест и отдаёт события потока (словари) по мере готовности этапов.
+    Этапы из prefill (восстановленные из хранилища) не генерируются заново.
+    """
+
+    async def pace():
+        if pacing > 0:
+            await asyncio.sleep(pacing)
+
+    mode = "one_shot" if request.generation_mode == "one_shot" else "staged"
+    usage = generation_stats.new_usage()
+    started = time.perf_counter()
+
+    events = StageEvents()
+
+    def partial(stage: str) -> Optional[PartialCallback]:
+        return events.sink(stage) if request.stream_tokens else None
+
+    prefill = dict(prefill or {})
+    quest_parts = ("description", "characters", "locations", "items", "scenes")
+    if all(part in prefill for part in quest_parts):
+        prefill["quest"] = {part: prefill[part] for part in quest_parts}
+
+    def stage_func(stage: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        if stage in prefill:
+            async def restored(**_):
+                return prefill[stage]
+            return restored
+        return cached_stage(request, stage, func)
+
+    stages = [
+        Stage("description", stage_func("description", lambda: generate_quest_description(request, partial("description")))),
+        Stage("characters", stage_func("characters", lambda: generate_characters(request, partial("characters")))),
+        Stage("locations", stage_func("locations", lambda: generate_locations(request, partial("locations")))),
+        Stage("items", stage_func("items", lambda: generate_items(request, partial("items")))),
+        Stage(
+            "scenes",
+            stage_func(
+                "scenes",
+                lambda characters, locations, items: generate_scenes(request, characters, locations, items, partial("scenes")),
+            ),
+            deps=("characters", "locations", "items"),
+        ),
+    ]
+    scene_deps = set(stages[-1].deps)
+
+    if mode == "one_shot":
+        stages = [Stage("quest", stage_func("quest", lambda: generate_quest_one_shot(request)))]
+
+    yield {'type': 'status', 'content': 'Начинаем генерацию квеста...'}
+    await pace()
+
+    title = f"Квест: {request.setting.title() if request.setting != 'custom' else request.custom_setting}"
+    yield {'type': 'title', 'content': title}
+    await pace()
+
+    yield {'type': 'status', 'content': 'Создаём описание сюжета, персонажей, локации и предметы...'}
+
+    finished = set()
+    stage_results = events.run(stages) if request.stream_tokens else run_stages(stages)
+    async for name, result in stage_results:
+        if name == PARTIAL:
+            yield {'type': 'partial', **result}
+            continue
+
+        finished.add(name)
+
+        if name == "quest":
+            # One-shot: весь квест пришёл одним результатом, раскладываем по обычным событиям
+            for part in ("description", "characters", "locations", "items"):
+                yield {'type': part, 'content': result[part]}
+                await pace()
+            name, result = "scenes", result["scenes"]
+
+        if name == "scenes":
+            yield {'type': 'scene_graph', 'content': graph_metrics(result)}
+            for i, scene in enumerate(result):
+                yield {'type': 'scene', 'content': scene, 'scene_number': i + 1, 'total_scenes': len(result)}
+                await pace()
+            continue
+
+        yield {'type': name, 'content': result}
+        await pace()
+
+        # Сцены запускаются планировщиком сразу после своих зависимостей
+        if name in scene_deps and scene_deps <= finished:
+            yield {'type': 'status', 'content': 'Создаём сцены...'}
+
+    elapsed = time.perf_counter() - started
+    mode_stats.record(mode, elapsed, usage)
+    metrics.QUEST_DURATION.labels(mode).observe(elapsed)
+    log_context.event(logger, logging.INFO, "quest", mode=mode, seconds=round(elapsed, 3), **usage)
+    yield {'type': 'complete', 'content': 'Квест успешно создан!', 'mode': mode, 'usage': usage}
+
+async def build_quest(request: QuestRequest) -> Dict[str, Any]:
+    """Генерирует квест целиком (без стриминга) и собирает его в один объект"""
+    quest = new_quest(request.model_dump())
+    async for event in quest_events(request):
+        apply_event(quest, event)
+    return quest
+
+async def produce_quest_events(request_data: Dict[str, Any], prefill: Dict[str, Any], pacing: float):
+    """События квеста после допуска; пока квест ждёт в очереди — события queue с позицией"""
+    request = QuestRequest(**request_data)
+    ticket = current_ticket.get()
+    if ticket is None:
+        # Пакетные квесты и продолжения после перезапуска ждут в общей очереди без отказа
+        ticket = admission_queue.enter("background", quest_cost(request), force=True)
+    try:
+        async for position in ticket.wait():
+            yield {'type': 'queue', 'position': position, 'content': f'Ожидание в очереди: {position}'}
+        async for event in quest_events(request, pacing, prefill):
+            yield event
+    finally:
+        ticket.release()
+
+quest_store = QuestStore(config.QUEST_DB_PATH)
+quest_runs = QuestRuns(
+    quest_store,
+    produce_quest_events,
+    subscriber_buffer=config.QUEST_SUBSCRIBER_BUFFER,
+    shared=shared_state,
+    worker_id=WORKER_ID,
+    lease_ttl=config.LEASE_TTL,
+    poll_interval=config.SHARED_POLL_INTERVAL,
+)
+
+def quest_key(request: QuestRequest) -> str:
+    """
+    Одинаковые по содержанию запросы разделяют одну генерацию. pacing в ключ не входит: паузы
+    между событиями делает сама генерация, и присоединившиеся клиенты получают pacing первого запроса
+    """
+    fields = {k: _normalize(v) for k, v in request.model_dump(exclude={"pacing"}).items()}
+    return make_key(OLLAMA_MODEL, "quest", fields)
+
+rate_limiter = RateLimiter(config.RATE_LIMIT_RATE, config.RATE_LIMIT_BURST)
+admission_queue = FairQueue(config.ADMISSION_MAX_ACTIVE, config.ADMISSION_MAX_WAITING)
+metrics.ADMISSION_ACTIVE.set_function(lambda: admission_queue.active)
+metrics.ADMISSION_WAITING.set_function(lambda: admission_queue.waiting)
+
+def client_id(http_request: Request, api_key: Optional[str]) -> str:
+    if api_key:
+        return f"key:{api_key}"
+    return f"ip:{http_request.client.host if http_request.client else 'unknown'}"
+
+def check_cost(request: QuestRequest) -> float:
+    cost = quest_cost(request)
+    if cost > config.ADMISSION_MAX_COST:
+        metrics.ADMISSION_REJECTED.labels("too_large").inc()
+        raise HTTPException(status_code=400, detail=f"Слишком большой квест: стоимость {cost:.0f}, максимум {config.ADMISSION_MAX_COST:.0f}")
+    return cost
+
+def admit(request: QuestRequest, client: str) -> Ticket:
+    """Лимит клиента и место в справедливой очереди; отказ — 429 с Retry-After"""
+    cost = check_cost(request)
+    try:
+        if admission_queue.full:
+            raise AdmissionRejected(f"в очереди уже {admission_queue.waiting} квестов", 5.0)
+        rate_limiter.check(client, cost)
+    except AdmissionRejected as e:
+        metrics.ADMISSION_REJECTED.labels("queue_full" if admission_queue.full else "rate_limit").inc()
+        raise HTTPException(status_code=429, detail=f"Слишком много запросов: {e}", headers=retry_headers(e))
+    return admission_queue.enter(client, cost)
+
+def check_draining() -> None:
+    if draining:
+        raise HTTPException(status_code=503, detail="Сервер перезапускается, повторите запрос", headers={"Retry-After": "1"})
+
+async def start_quest(request: QuestRequest, pacing: float = 0.0, client: Optional[str] = None) -> str:
+    """Запускает квест или присоединяет к идущему такому же; новый квест проходит контроль допуска"""
+    check_draining()
+    key = quest_key(request)
+    ticket = admit(request, client) if client is not None and not quest_runs.in_flight(key) else None
+    token = current_ticket.set(ticket)
+    try:
+        quest_id, shared = await quest_runs.start(request.model_dump(), pacing, key=key)
+    except BaseException:
+        if ticket is not None:
+            ticket.release()
+        raise
+    finally:
+        current_ticket.reset(token)
+    if shared:
+        if ticket is not None:
+            ticket.release()
+        logger.info(f"Joined in-flight quest {quest_id}")
+        metrics.COALESCED.labels("quest").inc()
+    return quest_id
+
+def stream_pacing(request: Optional[QuestRequest] = None) -> float:
+    if request is not None and request.pacing is not None:
+        return request.pacing
+    return config.SSE_PACING_DELAY
+
+def stream_encoder(http_request: Request, fmt: Optional[str] = None) -> wire.StreamEncoder:
+    """Транспорт (SSE, NDJSON, MessagePack) и сжатие потока по параметру format и заголовкам запроса"""
+    try:
+        stream_format = wire.stream_format(http_request.headers.get("accept"), fmt)
+    except wire.UnsupportedFormat as e:
+        raise HTTPException(status_code=406, detail=f"Формат не поддерживается: {e}")
+    encoding = wire.choose_encoding(http_request.headers.get("accept-encoding"), config.WIRE_COMPRESSION)
+    return wire.StreamEncoder(stream_format, encoding)
+
+def encoded_response(http_request: Request, data: Any) -> Response:
+    """Ответ целиком: JSON через orjson или MessagePack, сжатый, если клиент принимает сжатие"""
+    body_format = wire.body_format(http_request.headers.get("accept"))
+    body = wire.encode_body(data, body_format)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    encoding = wire.choose_encoding(http_request.headers.get("accept-encoding"), config.WIRE_COMPRESSION)
+    if encoding and len(body) >= config.WIRE_MIN_COMPRESS_SIZE:
+        body = wire.compress_body(body, encoding)
+        headers["Content-Encoding"] = encoding
+    media_type = wire.MEDIA_TYPES[wire.MSGPACK] if body_format == wire.MSGPACK else wire.JSON_MEDIA_TYPE
+    return Response(content=body, media_type=media_type, headers=headers)
+
+def quest_stream_response(quest_id: str, encoder: wire.StreamEncoder, after: int = 0) -> StreamingResponse:
+    """Поток событий квеста; id события — "<quest_id>:<seq>" для переподключения по Last-Event-ID"""
+
+    async def stream_generator():
+        metrics.ACTIVE_STREAMS.inc()
+        try:
+            async for seq, event in quest_runs.follow(quest_id, after):
+                yield encoder.encode(event, format_event_id(quest_id, seq) if seq is not None else None)
+            tail = encoder.finish()
+            if tail:
+                yield tail
+        finally:
+            metrics.ACTIVE_STREAMS.dec()
 
-            yield f"data: {json.dumps({'type': 'complete', 'content': 'Квест успешно создан!'}, ensure_ascii=False)}\n\n"
-            
-        except Exception as e:
-            logger.error(f"Ошибка при генерации квеста: {e}")
-            yield f"data: {json.dumps({'type': 'error', 'content': f'Ошибка: {str(e)}'}, ensure_ascii=False)}\n\n"
-    
     return StreamingResponse(
         stream_generator(),
-        media_type="text/event-stream",
+        media_type=encoder.media_type,
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "*"
+            "Access-Control-Allow-Headers": "*",
+            "Access-Control-Expose-Headers": "X-Quest-Id",
+            "X-Quest-Id": quest_id,
+            **encoder.headers(),
         }
     )
 
-@app.get("/api/health")
-async def health_check():
+@app.post("/api/generate-quest-stream")
+async def generate_quest_stream(request: QuestRequest, http_request: Request, fmt: Optional[str] = Query(None, alias="format"), last_event_id: Optional[str] = Header(None), x_api_key: Optional[str] = Header(None)):
+    """
+    Генерирует квест в фоне и отдаёт его события. С заголовком Last-Event-ID поток
+    продолжается с места обрыва: готовые этапы читаются из хранилища, а не генерируются заново.
+    Клиент (X-API-Key или IP) ограничен token bucket-ом; сверх лимита — 429.
+    Транспорт — SSE, NDJSON или MessagePack (format или Accept), сжатие — по Accept-Encoding.
+    """
+    encoder = stream_encoder(http_request, fmt)
+    resume = parse_event_id(last_event_id)
+    if resume is not None and await quest_runs.resume(resume[0], stream_pacing(request)):
+        return quest_stream_response(resume[0], encoder, resume[1])
+    
+    quest_id = await start_quest(request, stream_pacing(request), client_id(http_request, x_api_key))
+    return quest_stream_response(quest_id, encoder)
+
+@app.get("/api/quests")
+async def list_quests(http_request: Request, setting: Optional[str] = None, quest_style: Optional[str] = None, q: Optional[str] = None, before: Optional[float] = None, limit: int = Query(20, ge=1, le=100)):
+    """Сохранённые квесты от новых к старым; следующая страница — before=<created_at последнего>"""
+    quests = await quest_runs.db(quest_store.search, setting, quest_style, q, before, limit)
+    return encoded_response(http_request, {"quests": quests, "next_before": quests[-1]["created_at"] if len(quests) == limit else None})
+
+@app.get("/api/quests/{quest_id}")
+async def get_quest(quest_id: str, http_request: Request):
+    """Квест целиком; JSON или MessagePack (Accept), сжатый по Accept-Encoding"""
+    record = await quest_runs.db(quest_store.get, quest_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Квест не найден")
+    return encoded_response(http_request, record)
 
+@app.get("/api/quests/{quest_id}/events")
+async def stream_quest_events(quest_id: str, http_request: Request, after: int = 0, fmt: Optional[str] = Query(None, alias="format"), last_event_id: Optional[str] = Header(None)):
+    """Поток событий сохранённого квеста (SSE совместим с EventSource и его переподключением)"""
+    encoder = stream_encoder(http_request, fmt)
+    resume = parse_event_id(last_event_id)
+    if resume is not None and resume[0] == quest_id:
+        after = resume[1]
+    if not await quest_runs.resume(quest_id, stream_pacing()):
+        raise HTTPException(status_code=404, detail="Квест не найден")
+    return quest_stream_response(quest_id, encoder, after)
+
+async def regenerate_node(request: QuestRequest, quest: Dict[str, Any], kind: str, position: int, instructions: Optional[str]) -> Optional[Dict]:
+    """
+    Новая версия одного узла квеста одним вызовом модели (плюс ремонт при ошибках формата).
+    Промпт — узел, его соседи по графу и сущности, на которые они ссылаются, а не весь квест.
+    None, если модель так и не вернула узел
+    """
+    fields = request_fields(request)
+    old = quest[node_regen.KINDS[kind]][position]
+    common = {"setting": fields["setting"], "quest_style": fields["quest_style"], "instructions": instructions}
+    if kind == "scene":
+        local = node_regen.scene_prompt_fields(quest, position, config.PROMPT_SUMMARY_TOKENS)
+        prompt = prompt_library.render("regen_scene", **common, **local)
+        counts = {"scene": 1, "choice": max(1, len(old.get("choices") or []))}
+        context = f'Сеттинг: "{fields["setting"]}". Переходы сцены: {local["exits"]}.'
+    else:
+        prompt = prompt_library.render("regen_entity", **common, **node_regen.entity_prompt_fields(quest, kind, position))
+        counts = {kind: 1}
+        context = f'Сеттинг: "{fields["setting"]}".'
+    
+    items = await generate_with_repair(
+        prompt, request, None, node_regen.REQUIRED_FIELDS[kind], kind,
+        [str(old["id"])], [old], context=context, counts=counts,
+    )
+    # Заглушкой служит сам старый узел: если вернулся он, модель не справилась
+    fresh = [item for item in items if item is not old]
+    if not fresh:
+        return None
+    # Модель могла вернуть лишние объекты — берём тот, что с нужным id
+    return next((item for item in fresh if str(item.get("id")) == str(old["id"])), fresh[0])
+
+@app.post("/api/quests/{quest_id}/regenerate")
+async def regenerate_quest_node(quest_id: str, body: RegenerateRequest, http_request: Request, x_api_key: Optional[str] = Header(None)):
+    """
+    Перегенерирует один узел готового квеста — сцену, персонажа, локацию или предмет —
+    без повторного прогона этапов. id узла сохраняется, граф сцен проверяется только
+    вокруг изменённой сцены. Параллельная правка того же квеста — 409, повторите запрос
+    """
+    if body.kind not in node_regen.KINDS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный вид узла: {body.kind}; ожидается {', '.join(node_regen.KINDS)}")
+    check_draining()
+    record = await quest_runs.db(quest_store.get, quest_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Квест не найден")
+    if record["status"] != COMPLETED or not record.get("quest"):
+        raise HTTPException(status_code=409, detail="Квест ещё не готов")
+    quest = record["quest"]
+    position = node_regen.find_node(quest, body.kind, body.id)
+    if position is None:
+        raise HTTPException(status_code=404, detail=f"В квесте нет узла {body.kind} '{body.id}'")
+    if not model_loaded:
+        raise HTTPException(status_code=503, detail="Модель недоступна, повторите позже", headers={"Retry-After": "30"})
+    try:
+        rate_limiter.check(client_id(http_request, x_api_key), 2.0 if body.kind == "scene" else 1.0)
+    except AdmissionRejected as e:
+        metrics.ADMISSION_REJECTED.labels("rate_limit").inc()
+        raise HTTPException(status_code=429, detail=f"Слишком много запросов: {e}", headers=retry_headers(e))
+    
+    log_context.begin(quest_id=quest_id)
+    usage = generation_stats.new_usage()
+    started = time.perf_counter()
+    request = QuestRequest(**record["request"])
+    fresh = await regenerate_node(request, quest, body.kind, position, body.instructions)
+    if fresh is None:
+        metrics.NODE_REGENERATIONS.labels(body.kind, "fallback").inc()
+        raise HTTPException(status_code=502, detail="Модель не вернула новую версию узла, повторите запрос")
+    
+    graph: Dict[str, Any] = {}
+    section = node_regen.KINDS[body.kind]
+    if body.kind == "scene":
+        graph = node_regen.merge_scene(quest, position, fresh)
+        events = [{'type': 'scene_updated', 'content': quest["scenes"][position]}]
+        # Рёбра только добавляются, поэтому корректность графа не меняется; метрики — пересчитать
+        if graph["added_exits"]:
+            quest["scene_graph"] = graph_metrics(quest["scenes"])
+            events.append({'type': 'scene_graph', 'content': quest["scene_graph"]})
+    else:
+        node_regen.merge_entity(quest, body.kind, position, fresh)
+        # Событие этапа целиком: повтор журнала заменяет список сущностей новым
+        events = [{'type': section, 'content': quest[section]}]
+    updated_at = await quest_runs.amend(quest_id, quest, record["updated_at"], events)
+    if updated_at is None:
+        metrics.NODE_REGENERATIONS.labels(body.kind, "conflict").inc()
+        raise HTTPException(status_code=409, detail="Квест изменён параллельно, повторите запрос")
+    
+    metrics.NODE_REGENERATIONS.labels(body.kind, "ok").inc()
+    log_context.event(logger, logging.INFO, "node_regenerated", kind=body.kind, node=body.id,
+                      seconds=round(time.perf_counter() - started, 3), **graph)
     return {
-        "status": "healthy",
+        "quest_id": quest_id,
+        "kind": body.kind,
+        "node": quest[section][position],
+        "graph": graph,
+        "scene_graph": quest.get("scene_graph"),
+        "updated_at": updated_at,
+        "usage": usage,
+    }
+
+@app.post("/api/import/legacy")
+async def import_legacy_quests(files: List[UploadFile] = File(...)):
+    """
+    Импорт квестов старого формата (scene_id / text / next_scene): файлы читаются потоково,
+    сцены конвертируются в схему бэкенда, граф ремонтируется, квесты пишутся пачками.
+    Повторный импорт того же квеста не создаёт дубликат. Для архивов — CLI legacy_import.py
+    """
+    loop = asyncio.get_running_loop()
+
+    def insert(batch: List[Tuple[str, Dict[str, Any], Dict[str, Any]]]) -> int:
+        # Разбор идёт в потоке, запись — через общий замок хранилища в цикле событий
+        return asyncio.run_coroutine_threadsafe(quest_runs.db(quest_store.import_quests, batch), loop).result()
+
+    sources = ((upload.filename or "upload.json", io.TextIOWrapper(upload.file, encoding="utf-8")) for upload in files)
+    report = await asyncio.to_thread(import_quests, sources, insert, config.IMPORT_BATCH_SIZE)
+    metrics.LEGACY_IMPORTED.labels("imported").inc(report.imported)
+    metrics.LEGACY_IMPORTED.labels("duplicate").inc(report.duplicates)
+    metrics.LEGACY_IMPORTED.labels("failed").inc(report.failed)
+    logger.info(f"Legacy import: {report.imported} imported, {report.duplicates} duplicates, {report.failed} failed")
+    return report.as_dict()
+
+async def run_batch_item(request_data: Dict[str, Any]) -> Dict[str, Any]:
+    return await quest_runs.run(request_data, key=quest_key(QuestRequest(**request_data)))
+
+batch_store = BatchStore(config.BATCH_DB_PATH)
+batch_manager = BatchManager(
+    batch_store,
+    run_batch_item,
+    workers=config.BATCH_WORKERS,
+    max_pending=config.BATCH_MAX_PENDING,
+    shared=shared_state,
+    worker_id=WORKER_ID,
+    lease_ttl=config.LEASE_TTL,
+    poll_interval=config.SHARED_POLL_INTERVAL,
+)
+
+metrics.QUEUE_DEPTH.set_function(lambda: batch_manager.pending)
+
+STAGE_GENERATORS: Dict[str, Callable[[QuestRequest], Any]] = {
+    "description": generate_quest_description,
+    "characters": generate_characters,
+    "locations": generate_locations,
+    "items": generate_items,
+    "quest": generate_quest_one_shot,
+}
+
+async def pregenerate_stage(stage: str, request_data: Dict[str, Any]) -> Optional[Any]:
+    """Результат этапа для пула: свой seed на каждый вызов, чтобы запросы получали разные варианты"""
+    if not model_loaded:
+        return None
+    usage = generation_stats.new_usage()
+    result = await STAGE_GENERATORS[stage](QuestRequest(**{**request_data, "variation_seed": random.getrandbits(31)}))
+    # Заглушки и ответы без модели в пул не попадают
+    if usage["fallbacks"] or not usage["model_calls"]:
+        metrics.PREGEN_RESULTS.labels("rejected").inc()
+        return None
+    metrics.PREGEN_RESULTS.labels("ready").inc()
+    return result
+
+def live_traffic() -> bool:
+    """Есть живые квесты или пакеты — упреждающая генерация уступает им Ollama"""
+    return admission_queue.active > 0 or admission_queue.waiting > 0 or batch_manager.pending > 0
+
+pregenerator = pregen.Pregenerator(preset_pool, pregenerate_stage, live_traffic, interval=config.PREGEN_INTERVAL)
+metrics.PREGEN_READY.set_function(lambda: len(preset_pool))
+
+@app.post("/api/batch")
+async def create_batch(batch: BatchRequest):
+    """Ставит пакет квестов в очередь и возвращает id задания"""
+    if not batch.requests:
+        raise HTTPException(status_code=400, detail="Пустой пакет")
+    check_draining()
+    for request in batch.requests:
+        check_cost(request)
+    try:
+        job_id = await batch_manager.submit([r.model_dump() for r in batch.requests], batch.priority or 0)
+    except BatchQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"Очередь переполнена: {e}", headers={"Retry-After": "60"})
+    return {"job_id": job_id, "total": len(batch.requests), "queue_depth": batch_manager.pending}
+
+@app.get("/api/batch/{job_id}")
+async def get_batch(job_id: str, http_request: Request, include_results: bool = False):
+
+    job = await batch_manager.status(job_id, with_results=include_results)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return encoded_response(http_request, job)
+
+@app.get("/api/batch/{job_id}/stream")
+async def stream_batch(job_id: str, http_request: Request, fmt: Optional[str] = Query(None, alias="format")):
+    """Поток готовых квестов задания"""
+    encoder = stream_encoder(http_request, fmt)
+    if await batch_manager.status(job_id) is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+
+    async def stream_generator():
+        async for item in batch_manager.watch(job_id):
+            yield encoder.encode({'type': 'batch_item', **item})
+        if batch_manager.closing:
+            yield encoder.encode(RECONNECT_EVENT)
+        else:
+            yield encoder.encode({'type': 'complete', 'content': 'Пакет обработан'})
+        tail = encoder.finish()
+        if tail:
+            yield tail
+
+    return StreamingResponse(stream_generator(), media_type=encoder.media_type, headers={"Cache-Control": "no-cache", **encoder.headers()})
+
+@app.get("/api/health")
+async def health_check():
+    """Состояние воркера; пока он останавливается — 503, чтобы балансировщик вывел его из ротации"""
+    health = {
+        "status": "draining" if draining else "healthy",
         "version": "2.0.0",
         "message": "SCreate Quest Generator API v2.0 работает",
         "model_loaded": model_loaded,
-        "ai_mode": f"Ollama ({OLLAMA_MODEL})" if model_loaded else "Fallback"
+        "ai_mode": f"Ollama ({OLLAMA_MODEL})" if model_loaded else "Fallback",
+        "model_state": ollama.model_state,
+        "cache": generation_cache.stats(),
+        "generation_modes": mode_stats.summary(),
+        "backends": ollama.status(),
+        "admission": admission_queue.stats(),
+        "pregen": pregenerator.stats() if preset_pool.enabled else None,
+        "worker": {"id": WORKER_ID, "shared_state": "sqlite" if shared_state.distributed else "memory", "quests": quest_runs.active},
     }
+    if draining:
+        return JSONResponse(health, status_code=503)
+    return health
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Метрики в формате Prometheus"""
+    for backend in ollama.status():
+        metrics.BACKEND_UP.labels(backend["url"]).set(1 if backend["healthy"] and not backend["circuit_open"] else 0)
+        metrics.BACKEND_OUTSTANDING.labels(backend["url"]).set(backend["outstanding"])
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
 @app.get("/")
 async def root():
@@ -0,0 +1,108 @@
+"""
+Метрики Prometheus: задержки этапов и запросов к Ollama, токены, fallback-и, нагрузка
+"""
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Ответ модели идёт от долей секунды (кэш Ollama) до пары минут (большие сцены)
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_DURATION = Histogram(
+    "quest_stage_duration_seconds",
+    "Время этапа генерации квеста (без попаданий в кэш)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_CACHE = Counter(
+    "quest_stage_cache_total",
+    "Обращения к кэшу этапов",
+    ["stage", "result"],
+)
+QUEST_DURATION = Histogram(
+    "quest_generation_duration_seconds",
+    "Полное время генерации квеста",
+    ["mode"],
+    buckets=LATENCY_BUCKETS,
+)
+
+OLLAMA_REQUEST_DURATION = Histogram(
+    "ollama_request_duration_seconds",
+    "Время запроса к Ollama со стороны бэкенда",
+    ["mode"],
+    buckets=LATENCY_BUCKETS,
+)
+OLLAMA_ERRORS = Counter("ollama_errors_total", "Неуспешные запросы к Ollama")
+OLLAMA_TOKENS = Counter(
+    "ollama_tokens_total",
+    "Токены по данным Ollama (prompt_eval_count / eval_count)",
+    ["kind"],
+)
+OLLAMA_EVAL_RATE = Histogram(
+    "ollama_eval_tokens_per_second",
+    "Скорость генерации токенов по eval_count / eval_duration",
+    buckets=(1, 2.5, 5, 10, 20, 40, 80, 160),
+)
+
+PARSE_FALLBACKS = Counter(
+    "quest_parse_fallbacks_total",
+    "Ответы модели, заменённые заглушками из-за ошибки разбора JSON",
+)
+REPAIR_ATTEMPTS = Counter(
+    "quest_repair_attempts_total",
+    "Корректирующие запросы к модели за недостающими объектами",
+    ["data_type"],
+)
+REPAIRED_ITEMS = Counter(
+    "quest_repaired_items_total",
+    "Объекты, полученные корректирующими запросами вместо заглушек",
+    ["data_type"],
+)
+COALESCED = Counter(
+    "quest_coalesced_total",
+    "Запросы, присоединившиеся к уже идущей одинаковой генерации",
+    ["level"],
+)
+ADMISSION_REJECTED = Counter(
+    "quest_admission_rejected_total",
+    "Отказы контроля допуска: rate_limit, queue_full, too_large",
+    ["reason"],
+)
+LEGACY_IMPORTED = Counter(
+    "quest_legacy_imported_total",
+    "Квесты старого формата при импорте: imported, duplicate, failed",
+    ["result"],
+)
+NODE_REGENERATIONS = Counter(
+    "quest_node_regenerations_total",
+    "Перегенерация одного узла квеста по видам узлов: ok, fallback, conflict",
+    ["kind", "result"],
+)
+PREGEN_RESULTS = Counter(
+    "quest_pregen_results_total",
+    "Упреждающая генерация пресетов: ready — в пул, rejected — заглушки вместо ответа модели",
+    ["result"],
+)
+ADMISSION_ACTIVE = Gauge("quest_admission_active", "Квесты, допущенные к генерации")
+ADMISSION_WAITING = Gauge("quest_admission_waiting", "Квесты в очереди допуска")
+ACTIVE_STREAMS = Gauge("quest_active_streams", "Открытые SSE-потоки генерации")
+QUEUE_DEPTH = Gauge("quest_batch_queue_depth", "Квесты в очереди пакетной генерации")
+BACKEND_UP = Gauge("ollama_backend_up", "Сервер Ollama здоров и цепь замкнута", ["url"])
+BACKEND_OUTSTANDING = Gauge("ollama_backend_outstanding", "Активные запросы к серверу Ollama", ["url"])
+PREGEN_READY = Gauge("quest_pregen_ready", "Готовые результаты этапов в пулах упреждающей генерации")
+MODEL_LOADED = Gauge("ollama_model_loaded", "Модель Ollama доступна (1) или fallback-режим (0)")
+
+
+def observe_ollama_response(data: dict) -> None:
+    """Токены и скорость генерации из финального ответа Ollama"""
+    prompt_tokens = data.get("prompt_eval_count") or 0
+    eval_tokens = data.get("eval_count") or 0
+    OLLAMA_TOKENS.labels("prompt").inc(prompt_tokens)
+    OLLAMA_TOKENS.labels("eval").inc(eval_tokens)
+    eval_duration = data.get("eval_duration") or 0  # наносекунды
+    if eval_tokens and eval_duration:
+        OLLAMA_EVAL_RATE.observe(eval_tokens / (eval_duration / 1e9))
+
+
+def render() -> tuple:
+    """Тело и content-type для эндпоинта /metrics"""
+    return generate_latest(), CONTENT_TYPE_LATEST
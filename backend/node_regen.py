@@ -0,0 +1,181 @@
+"""
+Перегенерация одного узла готового квеста: сцены, персонажа, локации или предмета.
+Контекст промпта — только соседи сцены по графу и сущности, на которые она ссылается
+(для сущности — сцены, где она встречается). Новый узел встраивается в квест с проверкой
+только его собственных ссылок: граф остаётся корректным без полного ремонта.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from prompt_templates import summarize
+from scene_graph import CONTINUE_TEXT
+
+# Вид узла -> раздел квеста
+KINDS = {"scene": "scenes", "character": "characters", "location": "locations", "item": "items"}
+
+REQUIRED_FIELDS = {
+    "scene": ["id", "title", "description", "location_id", "choices"],
+    "character": ["id", "name", "role", "description"],
+    "location": ["id", "name", "description"],
+    "item": ["id", "name", "description"],
+}
+
+# Сколько символов описания соседней сцены попадает в промпт
+NEIGHBOR_DESCRIPTION_CHARS = 240
+# Сколько сцен, где встречается сущность, показываем модели
+MAX_ENTITY_SCENES = 6
+
+
+def find_node(quest: Dict[str, Any], kind: str, node_id: str) -> Optional[int]:
+    for i, node in enumerate(quest.get(KINDS[kind]) or []):
+        if isinstance(node, dict) and str(node.get("id")) == node_id:
+            return i
+    return None
+
+
+def _clip(text: Any, limit: int) -> str:
+    text = " ".join(str(text or "").split())
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + "…"
+
+
+def _describe_scenes(scenes: List[Dict[str, Any]]) -> str:
+    return "\n".join(
+        f"- {scene['id']}: {scene.get('title') or ''} — {_clip(scene.get('description'), NEIGHBOR_DESCRIPTION_CHARS)}"
+        for scene in scenes
+    ) or "- нет"
+
+
+def _targets(scene: Dict[str, Any]) -> List[str]:
+    return [str(c.get("next_scene_id")) for c in scene.get("choices") or [] if isinstance(c, dict)]
+
+
+def neighbors(scenes: List[Dict[str, Any]], position: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """(сцены, ведущие в эту, сцены, в которые ведёт она) — один проход по рёбрам"""
+    scene_id = scenes[position]["id"]
+    by_id = {scene["id"]: scene for scene in scenes}
+    successors = [by_id[t] for t in dict.fromkeys(_targets(scenes[position])) if t in by_id and t != scene_id]
+    predecessors = [scene for scene in scenes if scene["id"] != scene_id and scene_id in _targets(scene)]
+    return predecessors, successors
+
+
+def _referenced(entities: List[Dict[str, Any]], ids: set) -> List[Dict[str, Any]]:
+    return [entity for entity in entities if isinstance(entity, dict) and entity.get("id") in ids]
+
+
+def scene_prompt_fields(quest: Dict[str, Any], position: int, summary_tokens: int) -> Dict[str, str]:
+    """Подстановки regen_scene: сама сцена, её соседи и сущности, на которые ссылаются они все"""
+    scenes = quest["scenes"]
+    scene = scenes[position]
+    predecessors, successors = neighbors(scenes, position)
+    local = [scene, *predecessors, *successors]
+    character_ids = {c for s in local for c in s.get("characters") or []}
+    item_ids = {i for s in local for i in s.get("items") or []}
+    return {
+        "scene": json.dumps(scene, ensure_ascii=False),
+        "predecessors": _describe_scenes(predecessors),
+        "successors": _describe_scenes(successors),
+        "exits": ", ".join(s["id"] for s in successors) or "нет — это концовка",
+        "characters": summarize(_referenced(quest.get("characters") or [], character_ids), ("role",), summary_tokens) or "- нет",
+        # Локацию можно сменить на любую из квеста: id и имена всех, описания не нужны
+        "locations": summarize(quest.get("locations") or [], (), summary_tokens) or "- нет",
+        "items": summarize(_referenced(quest.get("items") or [], item_ids), (), summary_tokens) or "- нет",
+    }
+
+
+def scenes_with(quest: Dict[str, Any], kind: str, node_id: str) -> List[Dict[str, Any]]:
+    """Сцены, в которых встречается персонаж, локация или предмет"""
+    if kind == "location":
+        return [s for s in quest.get("scenes") or [] if s.get("location_id") == node_id]
+    field = KINDS[kind]
+    return [s for s in quest.get("scenes") or [] if node_id in (s.get(field) or [])]
+
+
+def entity_prompt_fields(quest: Dict[str, Any], kind: str, position: int) -> Dict[str, str]:
+    """Подстановки regen_entity: сущность и сцены, где она встречается"""
+    entity = quest[KINDS[kind]][position]
+    related = scenes_with(quest, kind, str(entity["id"]))
+    shown = related[:MAX_ENTITY_SCENES]
+    scenes = _describe_scenes(shown)
+    if len(related) > len(shown):
+        scenes += f"\n- ... и ещё {len(related) - len(shown)}"
+    return {
+        "kind": {"character": "персонажа", "location": "локацию", "item": "предмет"}[kind],
+        "entity": json.dumps(entity, ensure_ascii=False),
+        "scenes": scenes,
+    }
+
+
+def _known_refs(value: Any, known: set, old: Any) -> List[str]:
+    if not isinstance(value, list):
+        return list(old or [])
+    return list(dict.fromkeys(str(ref) for ref in value if str(ref) in known))
+
+
+def merge_scene(quest: Dict[str, Any], position: int, fresh: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Встраивает новую версию сцены на место старой и проверяет только её ссылки, O(степень сцены):
+    - id сцены и её роль в графе (концовка или нет) сохраняются;
+    - выборы на несуществующие сцены и на саму себя отбрасываются;
+    - пропавшие выходы старой сцены возвращаются с прежними выборами, поэтому всё, что было
+      достижимо через неё, достижимо и теперь, а из новых целей концовка достижима и так;
+    - неизвестные location_id, персонажи и предметы заменяются прежними или отбрасываются.
+    Возвращает счётчики изменений графа.
+    """
+    scenes = quest["scenes"]
+    old = scenes[position]
+    scene_ids = {scene["id"] for scene in scenes}
+    scene_id = old["id"]
+    changes = {"dropped_choices": 0, "restored_exits": 0, "added_exits": 0}
+
+    choices: List[Dict[str, Any]] = []
+    if not old.get("is_ending"):
+        for choice in fresh.get("choices") or []:
+            target = str(choice.get("next_scene_id")) if isinstance(choice, dict) else None
+            if target not in scene_ids or target == scene_id:
+                changes["dropped_choices"] += 1
+                continue
+            choices.append({**choice, "next_scene_id": target})
+        have = {choice["next_scene_id"] for choice in choices}
+        old_targets = set(_targets(old))
+        changes["added_exits"] = len(have - old_targets)
+        for choice in old.get("choices") or []:
+            target = choice.get("next_scene_id")
+            if target not in have:
+                choices.append(dict(choice))
+                have.add(target)
+                changes["restored_exits"] += 1
+    elif fresh.get("choices"):
+        changes["dropped_choices"] = len(fresh["choices"])
+
+    # id выборов уникальны в пределах сцены
+    used: set = set()
+    for k, choice in enumerate(choices, 1):
+        choice_id = str(choice.get("id") or "")
+        if not choice_id or choice_id in used:
+            choice_id = f"choice_{scene_id}_{k}"
+        choice["id"] = choice_id
+        used.add(choice_id)
+        choice.setdefault("text", CONTINUE_TEXT)
+
+    location_ids = {loc["id"] for loc in quest.get("locations") or []}
+    location_id = fresh.get("location_id")
+    scenes[position] = {
+        **fresh,
+        "id": scene_id,
+        "title": str(fresh.get("title") or old.get("title") or ""),
+        "description": str(fresh.get("description") or old.get("description") or ""),
+        "location_id": location_id if location_id in location_ids else old.get("location_id"),
+        "characters": _known_refs(fresh.get("characters"), {c["id"] for c in quest.get("characters") or []}, old.get("characters")),
+        "items": _known_refs(fresh.get("items"), {i["id"] for i in quest.get("items") or []}, old.get("items")),
+        "choices": choices,
+        "is_ending": bool(old.get("is_ending")),
+    }
+    return changes
+
+
+def merge_entity(quest: Dict[str, Any], kind: str, position: int, fresh: Dict[str, Any]) -> None:
+    """Заменяет сущность новой версией; id прежний — ссылки сцен на неё не меняются"""
+    entities = quest[KINDS[kind]]
+    old = entities[position]
+    entities[position] = {**old, **{k: v for k, v in fresh.items() if v not in (None, "")}, "id": old["id"]}
@@ -0,0 +1,189 @@
+"""
+Асинхронный клиент Ollama с общим пулом keep-alive соединений
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class OllamaError(Exception):
+    """Ошибка обращения к Ollama (сеть, таймаут или неуспешный статус)"""
+
+
+def _json(response: httpx.Response) -> Dict[str, Any]:
+    """Тело успешного ответа; не JSON-объект — тоже ошибка Ollama (её учитывает пул)"""
+    try:
+        data = response.json()
+    except ValueError as e:
+        raise OllamaError(f"invalid JSON response: {e}") from e
+    if not isinstance(data, dict):
+        raise OllamaError(f"unexpected response: {type(data).__name__}")
+    return data
+
+
+class OllamaClient:
+    """
+    Один httpx.AsyncClient на процесс: соединения переиспользуются между запросами,
+    а семафор ограничивает число одновременных генераций на сервере Ollama.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        *,
+        max_concurrency: int = 4,
+        max_connections: int = 16,
+        connect_timeout: float = 5.0,
+        default_timeout: float = 120.0,
+        keep_alive: Optional[str] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.default_timeout = default_timeout
+        self.keep_alive = keep_alive
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=httpx.Timeout(self.default_timeout, connect=self.connect_timeout),
+            )
+        return self._client
+
+    def _timeout(self, timeout: Optional[float]) -> httpx.Timeout:
+        return httpx.Timeout(
+            timeout if timeout is not None else self.default_timeout,
+            connect=self.connect_timeout,
+        )
+
+    async def start(self) -> None:
+        self._get_client()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def generate(
+        self,
+        prompt: str,
+        *,
+        timeout: Optional[float] = None,
+        options: Optional[Dict[str, Any]] = None,
+        **extra: Any,
+    ) -> Dict[str, Any]:
+        """Выполняет /api/generate без стриминга и возвращает JSON ответа Ollama"""
+        payload: Dict[str, Any] = {"model": self.model, "prompt": prompt, "stream": False}
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        if options:
+            payload["options"] = options
+        payload.update(extra)
+
+        async with self._semaphore:
+            try:
+                response = await self._get_client().post(
+                    "/api/generate", json=payload, timeout=self._timeout(timeout)
+                )
+            except httpx.HTTPError as e:
+                raise OllamaError(f"{type(e).__name__}: {e}") from e
+
+        if response.status_code != 200:
+            raise OllamaError(f"status {response.status_code}")
+        return _json(response)
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        *,
+        timeout: Optional[float] = None,
+        options: Optional[Dict[str, Any]] = None,
+        **extra: Any,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Выполняет /api/generate со стримингом и отдаёт NDJSON-чанки Ollama по мере
+        поступления. Последний чанк (done=true) содержит статистику генерации.
+        """
+        payload: Dict[str, Any] = {"model": self.model, "prompt": prompt, "stream": True}
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        if options:
+            payload["options"] = options
+        payload.update(extra)
+
+        async with self._semaphore:
+            try:
+                async with self._get_client().stream(
+                    "POST", "/api/generate", json=payload, timeout=self._timeout(timeout)
+                ) as response:
+                    if response.status_code != 200:
+                        raise OllamaError(f"status {response.status_code}")
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        try:
+                            data = json.loads(line)
+                        except json.JSONDecodeError:
+                            # Неполная строка — пропускаем, как и в app.py
+                            continue
+                        yield data
+                        if data.get("done", False):
+                            break
+            except httpx.HTTPError as e:
+                raise OllamaError(f"{type(e).__name__}: {e}") from e
+
+    async def list_models(self, timeout: Optional[float] = None) -> List[str]:
+        """Дешёвая проверка сервера: /api/tags без загрузки модели"""
+        try:
+            response = await self._get_client().get("/api/tags", timeout=self._timeout(timeout))
+        except httpx.HTTPError as e:
+            raise OllamaError(f"{type(e).__name__}: {e}") from e
+        if response.status_code != 200:
+            raise OllamaError(f"status {response.status_code}")
+        return [model.get("name", "") for model in _json(response).get("models", [])]
+
+    async def loaded_models(self, timeout: Optional[float] = None) -> List[str]:
+        """Модели, загруженные в память прямо сейчас (/api/ps)"""
+        try:
+            response = await self._get_client().get("/api/ps", timeout=self._timeout(timeout))
+        except httpx.HTTPError as e:
+            raise OllamaError(f"{type(e).__name__}: {e}") from e
+        if response.status_code != 200:
+            raise OllamaError(f"status {response.status_code}")
+        return [model.get("name", "") for model in _json(response).get("models", [])]
+
+    async def preload(self, timeout: Optional[float] = None, options: Optional[Dict[str, Any]] = None) -> float:
+        """
+        Загружает модель в память запросом без prompt и возвращает время загрузки в секундах
+        (load_duration от Ollama). Семафор генераций не занимает.
+        """
+        payload: Dict[str, Any] = {"model": self.model}
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        if options:
+            payload["options"] = options
+        try:
+            response = await self._get_client().post(
+                "/api/generate", json=payload, timeout=self._timeout(timeout)
+            )
+        except httpx.HTTPError as e:
+            raise OllamaError(f"{type(e).__name__}: {e}") from e
+        if response.status_code != 200:
+            raise OllamaError(f"status {response.status_code}")
+        return (_json(response).get("load_duration") or 0) / 1e9
@@ -0,0 +1,295 @@
+"""
+Пул серверов Ollama: маршрутизация по наименьшему числу активных запросов,
+фоновые проверки здоровья, размыкатель цепи, переключение на другой сервер
+и прогрев модели
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from ollama_client import OllamaClient, OllamaError
+
+logger = logging.getLogger(__name__)
+
+# Общее состояние воркеров: результат последней проверки и аренда права проверять
+HEALTH_KEY = "ollama:health"
+HEALTH_LEASE = "ollama:health-probe"
+
+
+class Backend:
+    """Один сервер Ollama и его состояние в пуле"""
+
+    def __init__(self, client: OllamaClient):
+        self.client = client
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.open_until = 0.0
+        self.warm = False       # модель загружена в память (по /api/ps или после прогрева)
+        self.warming = False
+        self.load_time: Optional[float] = None
+
+    @property
+    def url(self) -> str:
+        return self.client.base_url
+
+    def available(self, now: float) -> bool:
+        # После таймаута разомкнутая цепь пропускает запросы снова (half-open):
+        # первая же ошибка при failures >= порога размыкает её обратно
+        return self.healthy and now >= self.open_until
+
+    def status(self, now: float) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit_open": now < self.open_until,
+            "outstanding": self.outstanding,
+            "failures": self.failures,
+            "model_state": "warming" if self.warming else ("warm" if self.warm else "cold"),
+            "load_time": self.load_time,
+        }
+
+
+class OllamaPool:
+    """
+    Интерфейс совпадает с OllamaClient (generate, generate_stream, start, close),
+    поэтому один сервер и пул серверов взаимозаменяемы.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        model: str,
+        *,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        health_interval: float = 15.0,
+        probe_timeout: float = 5.0,
+        preload_timeout: Optional[float] = None,
+        preload_options: Optional[Dict[str, Any]] = None,
+        on_availability: Optional[Callable[[bool], None]] = None,
+        shared: Any = None,
+        worker_id: str = "",
+        **client_kwargs: Any,
+    ):
+        if not urls:
+            raise ValueError("OllamaPool needs at least one URL")
+        self.model = model
+        self.backends = [Backend(OllamaClient(url, model, **client_kwargs)) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.health_interval = health_interval
+        self.probe_timeout = probe_timeout
+        self.preload_timeout = preload_timeout
+        self.preload_options = preload_options
+        self.on_availability = on_availability
+        # shared_state.SharedState: серверы проверяет один воркер, остальные берут его результат
+        self.shared = shared
+        self.worker_id = worker_id
+        self._health_task: Optional["asyncio.Task[None]"] = None
+        self._warmup_tasks: List["asyncio.Task[None]"] = []
+        self._next = 0
+
+    @property
+    def available(self) -> bool:
+        now = time.monotonic()
+        return any(backend.available(now) for backend in self.backends)
+
+    @property
+    def model_state(self) -> str:
+        """warm — модель в памяти хотя бы одного сервера, warming — идёт загрузка, иначе cold"""
+        if any(backend.warm for backend in self.backends):
+            return "warm"
+        return "warming" if any(backend.warming for backend in self.backends) else "cold"
+
+    def status(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [backend.status(now) for backend in self.backends]
+
+    def _pick(self, exclude: List[Backend]) -> Optional[Backend]:
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b not in exclude and b.available(now)]
+        if not candidates:
+            return None
+        # При равной загрузке — по кругу, чтобы не нагружать всегда первый сервер
+        self._next = (self._next + 1) % len(self.backends)
+        start = self._next
+        return min(
+            candidates,
+            key=lambda b: (b.outstanding, (self.backends.index(b) - start) % len(self.backends)),
+        )
+
+    def _record_success(self, backend: Backend) -> None:
+        backend.failures = 0
+        backend.open_until = 0.0
+
+    def _record_failure(self, backend: Backend, error: Exception) -> None:
+        backend.failures += 1
+        logger.warning(f"Ollama backend {backend.url} failed ({backend.failures}): {error}")
+        now = time.monotonic()
+        # Запросы, начатые до размыкания, не продлевают его
+        if backend.failures >= self.failure_threshold and now >= backend.open_until:
+            backend.open_until = now + self.reset_timeout
+            logger.warning(f"Circuit opened for {backend.url} for {self.reset_timeout:.0f}s")
+
+    async def generate(self, prompt: str, **kwargs: Any) -> Dict[str, Any]:
+        tried: List[Backend] = []
+        last_error: Optional[OllamaError] = None
+        while True:
+            backend = self._pick(tried)
+            if backend is None:
+                raise last_error or OllamaError("no available Ollama backends")
+            tried.append(backend)
+            backend.outstanding += 1
+            try:
+                data = await backend.client.generate(prompt, **kwargs)
+            except OllamaError as e:
+                self._record_failure(backend, e)
+                last_error = e
+                continue
+            finally:
+                backend.outstanding -= 1
+            self._record_success(backend)
+            return data
+
+    async def generate_stream(self, prompt: str, **kwargs: Any) -> AsyncIterator[Dict[str, Any]]:
+        """Переключение на другой сервер возможно, только пока клиенту ничего не отдано"""
+        tried: List[Backend] = []
+        last_error: Optional[OllamaError] = None
+        while True:
+            backend = self._pick(tried)
+            if backend is None:
+                raise last_error or OllamaError("no available Ollama backends")
+            tried.append(backend)
+            backend.outstanding += 1
+            started = False
+            try:
+                async for chunk in backend.client.generate_stream(prompt, **kwargs):
+                    started = True
+                    yield chunk
+            except OllamaError as e:
+                self._record_failure(backend, e)
+                if started:
+                    raise
+                last_error = e
+                continue
+            finally:
+                backend.outstanding -= 1
+            self._record_success(backend)
+            return
+
+    def _has_model(self, names: List[str]) -> bool:
+        return any(name == self.model or name.split(":")[0] == self.model for name in names)
+
+    async def probe(self, warm_up: bool = True) -> bool:
+        """
+        Дешёвая проверка всех серверов: /api/tags (сервер жив, модель скачана) и /api/ps
+        (модель в памяти). Остывшие серверы прогреваются в фоне, если warm_up.
+        """
+
+        async def probe_one(backend: Backend) -> None:
+            try:
+                healthy = self._has_model(await backend.client.list_models(timeout=self.probe_timeout))
+                if not healthy:
+                    logger.warning(f"Model {self.model} not found on {backend.url}")
+                else:
+                    backend.warm = self._has_model(await backend.client.loaded_models(timeout=self.probe_timeout))
+            except OllamaError as e:
+                logger.warning(f"Health probe failed for {backend.url}: {e}")
+                healthy = False
+            if healthy != backend.healthy:
+                logger.info(f"Ollama backend {backend.url} is now {'up' if healthy else 'down'}")
+            backend.healthy = healthy
+
+        await asyncio.gather(*(probe_one(backend) for backend in self.backends))
+        available = self.available
+        if self.on_availability is not None:
+            self.on_availability(available)
+        if warm_up:
+            self.warm_up()
+        return available
+
+    async def refresh(self) -> bool:
+        """
+        Проверка здоровья с общим состоянием: серверы опрашивает и прогревает один процесс
+        (владелец аренды), остальные применяют опубликованный им результат — воркеры
+        не опрашивают Ollama каждый сам и не запускают прогрев модели одновременно
+        """
+        if self.shared is None:
+            return await self.probe()
+        ttl = 2 * self.health_interval + self.probe_timeout
+        if await self.shared.acquire(HEALTH_LEASE, self.worker_id, ttl):
+            available = await self.probe()
+            snapshot = {backend.url: {"healthy": backend.healthy, "warm": backend.warm} for backend in self.backends}
+            await self.shared.put(HEALTH_KEY, snapshot, ttl)
+            return available
+        snapshot = await self.shared.get(HEALTH_KEY)
+        deadline = time.monotonic() + self.probe_timeout
+        while snapshot is None and time.monotonic() < deadline:
+            # Воркеры стартуют одновременно: владелец аренды как раз проверяет серверы
+            await asyncio.sleep(0.2)
+            snapshot = await self.shared.get(HEALTH_KEY)
+        if snapshot is None:
+            # Владелец так и не опубликовал результат: проверяем сами, но без прогрева
+            return await self.probe(warm_up=False)
+        for backend in self.backends:
+            state = snapshot.get(backend.url)
+            if state is not None:
+                if state["healthy"] != backend.healthy:
+                    logger.info(f"Ollama backend {backend.url} is now {'up' if state['healthy'] else 'down'} (shared)")
+                backend.healthy = state["healthy"]
+                backend.warm = state["warm"]
+        available = self.available
+        if self.on_availability is not None:
+            self.on_availability(available)
+        return available
+
+    async def _warm_one(self, backend: Backend) -> None:
+        backend.warming = True
+        started = time.monotonic()
+        try:
+            load_time = await backend.client.preload(timeout=self.preload_timeout, options=self.preload_options)
+            backend.load_time = round(load_time or time.monotonic() - started, 3)
+            backend.warm = True
+            logger.info(f"Model {self.model} warm on {backend.url} (load {backend.load_time:.1f}s)")
+        except OllamaError as e:
+            logger.warning(f"Model preload failed on {backend.url}: {e}")
+        finally:
+            backend.warming = False
+
+    def warm_up(self) -> None:
+        """Запускает в фоне загрузку модели на здоровых, но холодных серверах; не блокирует"""
+        self._warmup_tasks = [task for task in self._warmup_tasks if not task.done()]
+        for backend in self.backends:
+            if backend.healthy and not backend.warm and not backend.warming:
+                # Флаг ставим сразу, чтобы следующая проверка не запустила второй прогрев
+                backend.warming = True
+                self._warmup_tasks.append(asyncio.create_task(self._warm_one(backend)))
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Health probe loop error: {e}")
+
+    async def start(self) -> None:
+        for backend in self.backends:
+            await backend.client.start()
+        if self.health_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        for task in self._warmup_tasks:
+            task.cancel()
+        await asyncio.gather(*self._warmup_tasks, return_exceptions=True)
+        self._warmup_tasks = []
+        for backend in self.backends:
+            await backend.client.close()
@@ -0,0 +1,115 @@
+"""
+Планировщик этапов генерации квеста: независимые этапы выполняются параллельно,
+зависимый этап стартует, как только готовы все его входные данные
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+
+@dataclass
+class Stage:
+    """
+    Этап генерации. func вызывается с результатами зависимостей в виде
+    именованных аргументов: Stage("scenes", f, deps=("characters",)) -> f(characters=...)
+    """
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    deps: Tuple[str, ...] = field(default_factory=tuple)
+
+
+def _check_graph(stages: List[Stage]) -> None:
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate stage names: {names}")
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in names]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {missing}")
+
+
+async def run_stages(stages: List[Stage]) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Запускает этапы по готовности зависимостей и отдаёт пары (имя, результат)
+    в порядке завершения. Ошибка этапа пробрасывается, остальные задачи отменяются.
+    """
+    _check_graph(stages)
+
+    pending: Dict[str, Stage] = {stage.name: stage for stage in stages}
+    results: Dict[str, Any] = {}
+    running: Dict["asyncio.Task[Any]", str] = {}
+
+    def launch_ready() -> None:
+        for name, stage in list(pending.items()):
+            if all(dep in results for dep in stage.deps):
+                del pending[name]
+                kwargs = {dep: results[dep] for dep in stage.deps}
+                running[asyncio.create_task(stage.func(**kwargs))] = name
+
+    try:
+        launch_ready()
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+            finished = []
+            for task in done:
+                name = running.pop(task)
+                results[name] = task.result()
+                finished.append(name)
+
+            # Зависимые этапы запускаем до отдачи результатов,
+            # чтобы медленный потребитель не задерживал генерацию
+            launch_ready()
+
+            for name in finished:
+                yield name, results[name]
+
+        if pending:
+            raise ValueError(f"Unresolvable stage dependencies: {sorted(pending)}")
+    finally:
+        for task in running:
+            task.cancel()
+
+
+PARTIAL = "partial"
+
+
+class StageEvents:
+    """
+    Промежуточные события этапов (токены, готовые элементы) вперемешку с результатами.
+    Этапы пишут в sink(имя), run() отдаёт (PARTIAL, данные) и (имя этапа, результат).
+    """
+
+    def __init__(self) -> None:
+        self._queue: "asyncio.Queue[Tuple[str, Any]]" = asyncio.Queue()
+
+    def sink(self, stage: str) -> Callable[[Dict[str, Any]], None]:
+        def put(data: Dict[str, Any]) -> None:
+            self._queue.put_nowait((PARTIAL, {"stage": stage, **data}))
+        return put
+
+    async def run(self, stages: List[Stage]) -> AsyncIterator[Tuple[str, Any]]:
+        done = object()
+        error: List[BaseException] = []
+
+        async def produce() -> None:
+            try:
+                async for name, result in run_stages(stages):
+                    self._queue.put_nowait((name, result))
+            except Exception as e:
+                error.append(e)
+            finally:
+                self._queue.put_nowait((done, None))
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                kind, value = await self._queue.get()
+                if kind is done:
+                    break
+                yield kind, value
+            if error:
+                raise error[0]
+        finally:
+            producer.cancel()
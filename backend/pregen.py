@@ -0,0 +1,236 @@
+"""
+Упреждающая генерация популярных пресетов: пока Ollama простаивает, в пулы заранее
+складываются результаты этапов (описание, персонажи, локации, предметы, one-shot квест)
+для тех входных данных, которые чаще всего встречаются в запросах. Запрос с таким пресетом
+забирает готовый результат вместо холодного вызова модели; живой трафик всегда важнее —
+фоновая генерация отменяется, как только он появляется.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+import log_context
+
+logger = logging.getLogger(__name__)
+
+# Этапы, результат которых зависит только от входных полей запроса (сцены зависят
+# от персонажей, локаций и предметов конкретного квеста и в пулы не попадают)
+STAGES = ("description", "characters", "locations", "items", "quest")
+
+# Вызов модели идёт от упреждающей генерации: он не объединяется с живыми вызовами
+# (иначе его нельзя было бы отменить) и не должен подменяться заглушкой
+speculative: ContextVar[bool] = ContextVar("speculative", default=False)
+
+
+@dataclass
+class _Preset:
+    stage: str
+    request_data: Dict[str, Any]  # последний запрос с этим пресетом — образец для генерации
+    demand: float = 0.0
+    seen: float = 0.0
+    ready: Deque[Tuple[float, Any]] = field(default_factory=deque)  # (время готовности, результат)
+
+
+class PresetPool:
+    """
+    Пулы готовых результатов по ключам пресетов и спрос на них. Спрос — число промахов кэша
+    с экспоненциальным затуханием (half_life секунд). Ёмкость capacity делится между
+    пресетами пропорционально спросу, но не больше per_preset на пресет; пресеты со спросом
+    ниже min_demand (разовые запросы) не заполняются. Вытеснение: сначала результаты старше
+    ttl, затем излишки пресетов с наименьшим спросом. Синхронный, вызывается из цикла событий
+    """
+
+    def __init__(self, capacity: int, per_preset: int = 3, min_demand: float = 2.0,
+                 half_life: float = 1800.0, ttl: float = 6 * 3600.0, max_tracked: int = 256):
+        self.capacity = capacity
+        self.per_preset = per_preset
+        self.min_demand = min_demand
+        self.half_life = half_life
+        self.ttl = ttl
+        self.max_tracked = max_tracked
+        self._presets: Dict[str, _Preset] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def __len__(self) -> int:
+        return sum(len(preset.ready) for preset in self._presets.values())
+
+    def _demand(self, preset: _Preset, now: float) -> float:
+        return preset.demand * 0.5 ** ((now - preset.seen) / self.half_life)
+
+    def note(self, key: str, stage: str, request_data: Dict[str, Any], now: Optional[float] = None) -> None:
+        """Учитывает спрос: запрос с этим пресетом не нашёл результата в кэше этапов"""
+        now = time.time() if now is None else now
+        preset = self._presets.get(key)
+        if preset is None:
+            preset = self._presets[key] = _Preset(stage, request_data)
+            if len(self._presets) > self.max_tracked:
+                self._forget_coldest(now)
+        preset.demand = self._demand(preset, now) + 1.0
+        preset.seen = now
+        preset.request_data = request_data
+
+    def _forget_coldest(self, now: float) -> None:
+        coldest = min(self._presets, key=lambda key: self._demand(self._presets[key], now))
+        self.evicted += len(self._presets.pop(coldest).ready)
+
+    def take(self, key: str, now: Optional[float] = None) -> Optional[Any]:
+        """Самый старый неистёкший результат пресета; каждый результат отдаётся одному запросу"""
+        now = time.time() if now is None else now
+        preset = self._presets.get(key)
+        while preset is not None and preset.ready:
+            made, result = preset.ready.popleft()
+            if now - made <= self.ttl:
+                self.hits += 1
+                return result
+            self.evicted += 1
+        self.misses += 1
+        return None
+
+    def put(self, key: str, result: Any, now: Optional[float] = None) -> None:
+        preset = self._presets.get(key)
+        if preset is not None:
+            preset.ready.append((time.time() if now is None else now, result))
+
+    def targets(self, now: float) -> Dict[str, int]:
+        """Сколько результатов держать по каждому пресету при текущем спросе"""
+        demand = {key: self._demand(preset, now) for key, preset in self._presets.items()}
+        demand = {key: value for key, value in demand.items() if value >= self.min_demand}
+        total = sum(demand.values())
+        return {
+            key: min(self.per_preset, max(1, math.floor(self.capacity * value / total)))
+            for key, value in demand.items()
+        }
+
+    def evict(self, now: Optional[float] = None) -> int:
+        """Вытесняет истёкшие результаты и излишки над целями, пока пулы не влезут в ёмкость"""
+        now = time.time() if now is None else now
+        before = self.evicted
+        for preset in self._presets.values():
+            while preset.ready and now - preset.ready[0][0] > self.ttl:
+                preset.ready.popleft()
+                self.evicted += 1
+        targets = self.targets(now)
+        excess = len(self) - self.capacity
+        for key in sorted(self._presets, key=lambda key: self._demand(self._presets[key], now)):
+            preset = self._presets[key]
+            while excess > 0 and len(preset.ready) > targets.get(key, 0):
+                preset.ready.popleft()
+                self.evicted += 1
+                excess -= 1
+        # Пресеты, спрос на которые затух, забываются вместе со своими результатами
+        for key in [key for key, preset in self._presets.items() if self._demand(preset, now) < 0.05]:
+            self.evicted += len(self._presets.pop(key).ready)
+        return self.evicted - before
+
+    def next_job(self, now: Optional[float] = None) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        """(ключ, этап, образец запроса) пресета с наибольшей нехваткой или None, если пулы полны"""
+        now = time.time() if now is None else now
+        self.evict(now)
+        if len(self) >= self.capacity:
+            return None
+        best: Optional[Tuple[int, float, str]] = None
+        for key, target in self.targets(now).items():
+            preset = self._presets[key]
+            deficit = target - len(preset.ready)
+            if deficit > 0 and (best is None or (deficit, self._demand(preset, now)) > best[:2]):
+                best = (deficit, self._demand(preset, now), key)
+        if best is None:
+            return None
+        preset = self._presets[best[2]]
+        return best[2], preset.stage, preset.request_data
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "capacity": self.capacity,
+            "ready": len(self),
+            "presets": len(self.targets(now)),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+        }
+
+
+# Генерация результата этапа по образцу запроса; None — результат не годится для пула
+Generator = Callable[[str, Dict[str, Any]], Awaitable[Optional[Any]]]
+
+
+class Pregenerator:
+    """
+    Фоновый планировщик: раз в interval секунд, если busy() ложно, берёт у пула пресет
+    с наибольшей нехваткой и генерирует для него результат. Пока идёт вызов модели,
+    busy() проверяется каждые check_interval секунд; живой трафик отменяет вызов сразу
+    """
+
+    def __init__(self, pool: PresetPool, generate: Generator, busy: Callable[[], bool],
+                 interval: float = 1.0, check_interval: float = 0.05):
+        self.pool = pool
+        self.generate = generate
+        self.busy = busy
+        self.interval = interval
+        self.check_interval = check_interval
+        self.generated = 0
+        self.yielded = 0
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def start(self) -> None:
+        if self.pool.enabled and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.busy():
+                continue
+            job = self.pool.next_job()
+            if job is None:
+                continue
+            try:
+                await self._run(*job)
+            except Exception as e:
+                logger.warning("Pre-generation failed: %s", e)
+
+    async def _run(self, key: str, stage: str, request_data: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        token = speculative.set(True)
+        try:
+            task = asyncio.create_task(self.generate(stage, request_data))
+        finally:
+            speculative.reset(token)
+        while not task.done():
+            await asyncio.wait({task}, timeout=self.check_interval)
+            if not task.done() and self.busy():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                self.yielded += 1
+                log_context.event(logger, logging.INFO, "pregen_yielded", stage=stage,
+                                  seconds=round(time.perf_counter() - started, 3))
+                return
+        result = task.result()
+        if result is None:
+            return
+        self.pool.put(key, result)
+        self.generated += 1
+        log_context.event(logger, logging.INFO, "pregen", stage=stage, ready=len(self.pool),
+                          seconds=round(time.perf_counter() - started, 3))
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.pool.stats(), "generated": self.generated, "yielded": self.yielded}
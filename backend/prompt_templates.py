@@ -0,0 +1,154 @@
+"""
+Шаблоны промптов и бюджет токенов.
+
+Тексты промптов лежат в prompts/*.txt (подстановки `$name` из string.Template, фигурные скобки
+JSON-примеров не нужно экранировать) и компилируются один раз при импорте. Строка шаблона,
+все подстановки которой пусты, выбрасывается — так необязательные поля (цель, темы) не
+оставляют в промпте пустых «Темы: ».
+
+Бюджет: длина промпта в токенах оценивается по тексту, длина ответа — по числу объектов этапа,
+и из них выводятся num_predict и num_ctx для Ollama.
+"""
+
+import logging
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from string import Template
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Токенов ответа на один объект с запасом на описания (по ответам gemma3:4b на русском)
+OUTPUT_TOKENS = {
+    "description": 200,
+    "character": 110,
+    "location": 70,
+    "item": 80,
+    "scene": 220,
+    "choice": 45,
+}
+# Пояснения, markdown-ограждение и скобки массива вокруг объектов
+OUTPUT_OVERHEAD = 48
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов без токенизатора: латиница — ~4 символа на токен,
+    кириллица и прочее — ~2 (UTF-8 байты делятся на 4). Оценка скорее завышена —
+    для бюджета это безопаснее
+    """
+    return math.ceil(len(text.encode("utf-8")) / 4) if text else 0
+
+
+@dataclass
+class PromptTemplate:
+    name: str
+    lines: List[Tuple[Template, Tuple[str, ...]]]  # строка и её подстановки
+    fields: frozenset
+
+    @classmethod
+    def compile(cls, name: str, text: str) -> "PromptTemplate":
+        lines = []
+        fields = set()
+        for line in text.rstrip("\n").split("\n"):
+            template = Template(line)
+            names = tuple(
+                match.group("named") or match.group("braced")
+                for match in template.pattern.finditer(line)
+                if match.group("named") or match.group("braced")
+            )
+            fields.update(names)
+            lines.append((template, names))
+        return cls(name, lines, frozenset(fields))
+
+    def render(self, **values: Any) -> str:
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"prompt '{self.name}' needs {', '.join(sorted(missing))}")
+        rendered = []
+        for template, names in self.lines:
+            if names and all(values[name] in (None, "") for name in names):
+                continue
+            rendered.append(template.substitute({name: "" if values[name] is None else values[name] for name in names}))
+        return "\n".join(rendered)
+
+
+class PromptLibrary:
+    """Все шаблоны каталога, скомпилированные заранее; render(name, **values)"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.templates: Dict[str, PromptTemplate] = {}
+        for path in sorted(self.directory.glob("*.txt")):
+            self.templates[path.stem] = PromptTemplate.compile(path.stem, path.read_text(encoding="utf-8"))
+        if not self.templates:
+            raise FileNotFoundError(f"no prompt templates in {self.directory}")
+
+    def render(self, name: str, **values: Any) -> str:
+        return self.templates[name].render(**values)
+
+
+def summarize(objects: Iterable[Dict[str, Any]], extra: Tuple[str, ...] = (), max_tokens: int = 400) -> str:
+    """
+    Сжатая сводка объектов для контекста промпта: «id: имя (роль)» по строке на объект.
+    Все id остаются (на них ссылаются сцены); если сводка не влезает в max_tokens,
+    сначала убираются дополнительные поля, потом имена обрезаются по словам
+    """
+    objects = [obj for obj in objects if isinstance(obj, dict) and obj.get("id")]
+
+    def line(obj: Dict[str, Any], with_extra: bool, words: Optional[int]) -> str:
+        name = str(obj.get("name") or obj.get("title") or "")
+        if words is not None:
+            name = " ".join(name.split()[:words])
+        details = [str(obj[key]) for key in extra if with_extra and obj.get(key) not in (None, "", False)]
+        suffix = f" ({', '.join(details)})" if details else ""
+        return f"- {obj['id']}: {name}{suffix}" if name else f"- {obj['id']}"
+
+    for with_extra, words in ((True, None), (False, None), (False, 3), (False, 1), (False, 0)):
+        text = "\n".join(line(obj, with_extra, words) for obj in objects)
+        if estimate_tokens(text) <= max_tokens:
+            return text
+    return text
+
+
+@dataclass
+class TokenBudget:
+    """
+    Параметры Ollama под конкретный вызов: num_predict — ожидаемая длина ответа с запасом,
+    num_ctx — промпт плюс ответ, округлённые вверх до степени двойки (не меньше min_ctx
+    и не больше context_limit). Округление важно: Ollama перезагружает модель при смене
+    num_ctx, а ступеней всего несколько
+    """
+
+    context_limit: int = 32768
+    min_ctx: int = 4096
+    reserve: float = 1.3
+
+    def num_predict(self, counts: Dict[str, int]) -> int:
+        expected = sum(OUTPUT_TOKENS[kind] * count for kind, count in counts.items())
+        return int(expected * self.reserve) + OUTPUT_OVERHEAD
+
+    def options(self, prompt: str, counts: Dict[str, int]) -> Dict[str, int]:
+        prompt_tokens = estimate_tokens(prompt)
+        num_predict = self.num_predict(counts)
+        needed = prompt_tokens + num_predict
+        num_ctx = max(self.min_ctx, 1 << max(0, needed - 1).bit_length())
+        if num_ctx > self.context_limit:
+            num_ctx = self.context_limit
+            available = num_ctx - prompt_tokens
+            logger.warning(
+                f"Prompt budget exceeds context: {prompt_tokens} prompt + {num_predict} output tokens "
+                f"> {num_ctx}; output capped to {max(available, 0)}"
+            )
+            num_predict = max(available, OUTPUT_OVERHEAD)
+        return {"num_predict": num_predict, "num_ctx": num_ctx}
+
+
+def choices_per_scene(complexity: Optional[str]) -> float:
+    """Среднее число выборов в сцене по сложности квеста"""
+    return {"simple": 1.5, "complex": 3.0}.get(complexity or "medium", 2.0)
+
+
+def scene_counts(scene_count: int, complexity: Optional[str]) -> Dict[str, int]:
+    return {"scene": scene_count, "choice": math.ceil(scene_count * choices_per_scene(complexity))}
@@ -0,0 +1,631 @@
+"""
+Хранилище квестов: каждый квест и события его генерации пишутся в SQLite по мере
+появления, поэтому оборванный SSE-поток можно продолжить по Last-Event-ID,
+а готовый квест — получить по id
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+import log_context
+
+logger = logging.getLogger(__name__)
+
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# События, из которых собирается квест
+STAGE_EVENTS = ("description", "characters", "locations", "items")
+# Не сохраняются: токены модели и позиция в очереди допуска
+EPHEMERAL_EVENTS = ("partial", "queue")
+
+# При продолжении квеста с неполным этапом сцен сцены генерируются заново: событие
+# отменяет уже записанные, повтор журнала и клиент по Last-Event-ID начинают сцены сначала
+SCENES_RESET_EVENT = {"type": "scenes_reset", "content": "Сцены генерируются заново"}
+
+# Последнее событие потока останавливаемого воркера: клиент переподключается с Last-Event-ID
+# к другому воркеру, и тот продолжает квест с журнала
+RECONNECT_EVENT = {"type": "reconnect", "content": "Сервер перезапускается, переподключитесь — генерация продолжится"}
+
+QUEST_FIELDS = ("id", "setting", "quest_style", "title", "description", "status", "created_at", "updated_at")
+
+
+def new_quest(request_data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "title": "",
+        "description": "",
+        "setting": request_data.get("setting"),
+        "quest_style": request_data.get("quest_style"),
+        "starting_point": request_data.get("starting_point"),
+        "characters": [],
+        "locations": [],
+        "items": [],
+        "scenes": [],
+    }
+
+
+def apply_event(quest: Dict[str, Any], event: Dict[str, Any]) -> None:
+    """Переносит событие потока в собираемый квест"""
+    kind = event.get("type")
+    if kind in ("title", "scene_graph") + STAGE_EVENTS:
+        quest[kind] = event["content"]
+    elif kind == "scene":
+        quest["scenes"].append(event["content"])
+    elif kind == "scenes_reset":
+        quest["scenes"] = []
+    elif kind == "scene_updated":
+        # Перегенерированная сцена готового квеста заменяет прежнюю с тем же id
+        scene = event["content"]
+        quest["scenes"] = [scene if s.get("id") == scene.get("id") else s for s in quest["scenes"]]
+
+
+def stage_results(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Результаты уже завершённых этапов по сохранённым событиям. Сцены — только если дошли все"""
+    results: Dict[str, Any] = {}
+    scenes: List[Dict[str, Any]] = []
+    total = None
+    for event in events:
+        kind = event.get("type")
+        if kind in STAGE_EVENTS:
+            results[kind] = event["content"]
+        elif kind == "scene":
+            scenes.append(event["content"])
+            total = event.get("total_scenes")
+        elif kind == "scenes_reset":
+            scenes, total = [], None
+    if total is not None and len(scenes) == total:
+        results["scenes"] = scenes
+    return results
+
+
+def partial_scenes(events: List[Dict[str, Any]]) -> bool:
+    """В журнале есть сцены, но не все: при продолжении этап сцен начнётся заново"""
+    started = False
+    for event in events:
+        if event.get("type") == "scene":
+            started = True
+        elif event.get("type") == "scenes_reset":
+            started = False
+    return started and "scenes" not in stage_results(events)
+
+
+def format_event_id(quest_id: str, seq: int) -> str:
+    return f"{quest_id}:{seq}"
+
+
+def parse_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Last-Event-ID вида "<quest_id>:<seq>"; None, если заголовка нет или он не наш"""
+    if not value:
+        return None
+    quest_id, _, seq = value.strip().rpartition(":")
+    if not quest_id or not seq.isdigit():
+        return None
+    return quest_id, int(seq)
+
+
+class QuestStore:
+    """SQLite-хранилище квестов и их событий. Вызовы синхронные, QuestRuns выносит их в поток"""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # События пишутся часто и мелко: в WAL-режиме NORMAL не теряет целостность
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS quests (
+                id TEXT PRIMARY KEY,
+                setting TEXT,
+                quest_style TEXT,
+                title TEXT NOT NULL DEFAULT '',
+                description TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL,
+                request TEXT NOT NULL,
+                quest TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS quests_created ON quests (created_at);
+            CREATE INDEX IF NOT EXISTS quests_setting ON quests (setting, created_at);
+            CREATE INDEX IF NOT EXISTS quests_style ON quests (quest_style, created_at);
+            CREATE TABLE IF NOT EXISTS quest_events (
+                quest_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                event TEXT NOT NULL,
+                PRIMARY KEY (quest_id, seq)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def create(self, quest_id: str, request_data: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO quests (id, setting, quest_style, status, request, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (quest_id, request_data.get("setting"), request_data.get("quest_style"), RUNNING,
+                 json.dumps(request_data, ensure_ascii=False), now, now),
+            )
+
+    def append_event(self, quest_id: str, seq: int, event: Dict[str, Any]) -> None:
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO quest_events (quest_id, seq, event) VALUES (?, ?, ?)",
+                (quest_id, seq, json.dumps(event, ensure_ascii=False)),
+            )
+
+    def finish(self, quest_id: str, status: str, quest: Dict[str, Any]) -> None:
+        with self._conn:
+            self._conn.execute(
+                "UPDATE quests SET status = ?, title = ?, description = ?, quest = ?, updated_at = ? WHERE id = ?",
+                (status, quest.get("title") or "", quest.get("description") or "",
+                 json.dumps(quest, ensure_ascii=False), time.time(), quest_id),
+            )
+
+    def update_quest(self, quest_id: str, quest: Dict[str, Any], expected_updated_at: float,
+                     events: List[Dict[str, Any]]) -> Optional[Tuple[float, List[Tuple[int, Dict[str, Any]]]]]:
+        """
+        Сохраняет отредактированный готовый квест, если его не изменили с expected_updated_at
+        (оптимистичная блокировка между воркерами), и в той же транзакции дописывает в журнал
+        события правки — повтор журнала даёт тот же квест. (новый updated_at, [(seq, событие)])
+        или None при конфликте
+        """
+        now = max(time.time(), expected_updated_at + 1e-6)
+        with self._conn:
+            cursor = self._conn.execute(
+                "UPDATE quests SET title = ?, description = ?, quest = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND updated_at = ?",
+                (quest.get("title") or "", quest.get("description") or "", json.dumps(quest, ensure_ascii=False),
+                 now, quest_id, COMPLETED, expected_updated_at),
+            )
+            if not cursor.rowcount:
+                return None
+            last = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM quest_events WHERE quest_id = ?", (quest_id,)
+            ).fetchone()[0]
+            recorded = [(last + i, event) for i, event in enumerate(events, 1)]
+            self._conn.executemany(
+                "INSERT INTO quest_events (quest_id, seq, event) VALUES (?, ?, ?)",
+                [(quest_id, seq, json.dumps(event, ensure_ascii=False)) for seq, event in recorded],
+            )
+        return now, recorded
+
+    def import_quests(self, records: List[Tuple[str, Dict[str, Any], Dict[str, Any]]]) -> int:
+        """
+        Готовые квесты (id, request_data, quest) одной транзакцией; уже существующие id
+        пропускаются. Возвращает число добавленных
+        """
+        now = time.time()
+        before = self._conn.total_changes
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO quests (id, setting, quest_style, title, description, status, request, quest, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (quest_id, request_data.get("setting"), request_data.get("quest_style"),
+                     quest.get("title") or "", quest.get("description") or "", COMPLETED,
+                     json.dumps(request_data, ensure_ascii=False), json.dumps(quest, ensure_ascii=False), now + i * 1e-6, now)
+                    # Разные created_at сохраняют порядок и не ломают постраничный вывод по before
+                    for i, (quest_id, request_data, quest) in enumerate(records)
+                ],
+            )
+        return self._conn.total_changes - before
+
+    def get(self, quest_id: str, with_quest: bool = True) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            f"SELECT {', '.join(QUEST_FIELDS)}, request, quest FROM quests WHERE id = ?", (quest_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(QUEST_FIELDS, row))
+        record["request"] = json.loads(row[-2])
+        if with_quest and row[-1] is not None:
+            record["quest"] = json.loads(row[-1])
+        return record
+
+    def events(self, quest_id: str, after: int = 0) -> List[Tuple[int, Dict[str, Any]]]:
+        rows = self._conn.execute(
+            "SELECT seq, event FROM quest_events WHERE quest_id = ? AND seq > ? ORDER BY seq", (quest_id, after)
+        ).fetchall()
+        return [(seq, json.loads(event)) for seq, event in rows]
+
+    def search(self, setting: Optional[str] = None, quest_style: Optional[str] = None,
+               text: Optional[str] = None, before: Optional[float] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Квесты от новых к старым. before — created_at последнего квеста предыдущей страницы"""
+        conditions, params = [], []
+        if setting:
+            conditions.append("setting = ?")
+            params.append(setting)
+        if quest_style:
+            conditions.append("quest_style = ?")
+            params.append(quest_style)
+        if before is not None:
+            conditions.append("created_at < ?")
+            params.append(before)
+        if text:
+            conditions.append("(title LIKE ? OR description LIKE ?)")
+            params.extend([f"%{text}%"] * 2)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._conn.execute(
+            f"SELECT {', '.join(QUEST_FIELDS)} FROM quests {where} ORDER BY created_at DESC LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        return [dict(zip(QUEST_FIELDS, row)) for row in rows]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+# Производитель событий квеста: (request_data, результаты готовых этапов, pacing) -> события
+Producer = Callable[[Dict[str, Any], Dict[str, Any], float], AsyncIterator[Dict[str, Any]]]
+
+
+@dataclass
+class _Subscriber:
+    queue: "asyncio.Queue[Optional[Tuple[Optional[int], Dict[str, Any]]]]"
+    lagged: bool = False  # буфер переполнялся, пропущенное читается из журнала
+
+
+@dataclass
+class _Run:
+    next_seq: int
+    key: Optional[str] = None
+    stored: Set[str] = field(default_factory=set)
+    subscribers: List[_Subscriber] = field(default_factory=list)
+    task: Optional["asyncio.Task[Optional[Dict[str, Any]]]"] = None
+    finished: bool = False
+    queued: Optional[Dict[str, Any]] = None  # последнее событие queue, пока квест не допущен
+
+
+def _event_key(event: Dict[str, Any]) -> str:
+    return json.dumps(event, ensure_ascii=False, sort_keys=True)
+
+
+class QuestRuns:
+    """
+    Генерации квестов в фоне. События сохраняются в QuestStore и раздаются подписчикам,
+    поэтому генерация не обрывается вместе с SSE-соединением: клиент переподключается
+    и догоняет. Квест, оборванный перезапуском сервера, продолжается с готовых этапов.
+    Одинаковые одновременные запросы (по ключу) подписываются на одну генерацию.
+
+    С общим состоянием (shared_state) за каждым идущим квестом — аренда воркера-владельца.
+    Другие воркеры не запускают квест второй раз, а читают его журнал; если владелец
+    умер или остановился, квест продолжает тот, кто первым заберёт аренду.
+    """
+
+    def __init__(self, store: QuestStore, producer: Producer, *, subscriber_buffer: int = 256,
+                 shared: Any = None, worker_id: str = "", lease_ttl: float = 30.0, poll_interval: float = 0.5):
+        self.store = store
+        self.producer = producer
+        self.subscriber_buffer = subscriber_buffer
+        self.shared = shared
+        self.worker_id = worker_id
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self._runs: Dict[str, _Run] = {}
+        self._inflight: Dict[str, str] = {}
+        self._lock = asyncio.Lock()
+        self._heartbeat: Optional["asyncio.Task[None]"] = None
+        self._closing = False
+
+    @property
+    def active(self) -> int:
+        return len(self._runs)
+
+    async def db(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Вызов QuestStore в потоке; общий замок с записью событий"""
+        async with self._lock:
+            return await asyncio.to_thread(func, *args)
+
+    async def start(self, request_data: Dict[str, Any], pacing: float = 0.0,
+                    key: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        Запускает генерацию и возвращает (quest_id, shared). Если генерация с тем же key
+        уже идёт, новая не запускается: shared=True и id уже идущего квеста.
+        """
+        if key is not None and key in self._inflight:
+            return self._inflight[key], True
+        if key is not None and self._distributed:
+            other = await self.shared.get(f"inflight:{key}")
+            if other is not None:
+                return other, True
+            # Пока спрашивали общее состояние, такой же квест мог запустить этот же процесс
+            if key in self._inflight:
+                return self._inflight[key], True
+        quest_id = uuid.uuid4().hex
+        # Регистрируем до первого await: параллельный такой же запрос найдёт этот квест
+        # и сможет подписаться на него, пока запись создаётся
+        run = _Run(next_seq=1, key=key)
+        self._runs[quest_id] = run
+        if key is not None:
+            self._inflight[key] = quest_id
+        try:
+            await self._claim(quest_id, run)
+            await self.db(self.store.create, quest_id, request_data)
+        except BaseException:
+            self._forget(quest_id, run)
+            run.finished = True
+            self._publish(run, None)
+            raise
+        self._launch(quest_id, run, request_data, [], pacing)
+        return quest_id, False
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    @property
+    def _distributed(self) -> bool:
+        return self.shared is not None and self.shared.distributed
+
+    async def _claim(self, quest_id: str, run: Optional[_Run] = None) -> bool:
+        """Берёт или продлевает аренду квеста; False — квест генерирует другой живой воркер"""
+        if self.shared is None:
+            return True
+        if not await self.shared.acquire(f"quest:{quest_id}", self.worker_id, self.lease_ttl):
+            return False
+        if run is not None and run.key is not None:
+            await self.shared.acquire(f"inflight:{run.key}", self.worker_id, self.lease_ttl, quest_id)
+        return True
+
+    async def _release(self, quest_id: str, run: _Run) -> None:
+        if self.shared is None:
+            return
+        try:
+            await self.shared.release(f"quest:{quest_id}", self.worker_id)
+            if run.key is not None:
+                await self.shared.release(f"inflight:{run.key}", self.worker_id)
+        except Exception as e:
+            # Не отпущенная аренда истечёт сама через lease_ttl
+            logger.warning(f"Failed to release lease for quest {quest_id}: {e}")
+
+    async def _running(self, quest_id: str) -> bool:
+        record = await self.db(self.store.get, quest_id, False)
+        return record is not None and record["status"] == RUNNING
+
+    async def _owned_elsewhere(self, quest_id: str) -> bool:
+        if not self._distributed:
+            return False
+        return await self.shared.owner(f"quest:{quest_id}") not in (None, self.worker_id)
+
+    async def _renew_leases(self) -> None:
+        """Продлевает аренды своих квестов; потерянная аренда — квест уже продолжает другой воркер"""
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            for quest_id, run in list(self._runs.items()):
+                try:
+                    if not await self._claim(quest_id, run) and run.task is not None:
+                        logger.warning(f"Lost lease for quest {quest_id}, stopping local generation")
+                        run.task.cancel()
+                except Exception as e:
+                    logger.error(f"Lease renewal failed for quest {quest_id}: {e}")
+
+    async def run(self, request_data: Dict[str, Any], key: Optional[str] = None) -> Dict[str, Any]:
+        """Генерирует и сохраняет квест (или дожидается такого же идущего), возвращает его целиком"""
+        quest_id, _ = await self.start(request_data, key=key)
+        async for _ in self.follow(quest_id):
+            pass
+        record = await self.db(self.store.get, quest_id)
+        if record is None or record["status"] != COMPLETED:
+            raise RuntimeError(f"quest {quest_id} {record['status'] if record else 'lost'}")
+        return {**record["quest"], "id": quest_id}
+
+    async def amend(self, quest_id: str, quest: Dict[str, Any], expected_updated_at: float,
+                    events: List[Dict[str, Any]]) -> Optional[float]:
+        """
+        Правка готового квеста: квест и события правки пишутся одной транзакцией, события
+        раздаются подписчикам, если поток квеста ещё открыт. Новый updated_at или None при конфликте
+        """
+        result = await self.db(self.store.update_quest, quest_id, quest, expected_updated_at, events)
+        if result is None:
+            return None
+        updated_at, recorded = result
+        run = self._runs.get(quest_id)
+        if run is not None and recorded:
+            run.next_seq = max(run.next_seq, recorded[-1][0] + 1)
+            for item in recorded:
+                self._publish(run, item)
+        return updated_at
+
+    async def resume(self, quest_id: str, pacing: float = 0.0) -> bool:
+        """
+        Готовит квест к переподключению: если генерация прервалась вместе с сервером,
+        перезапускает её с сохранёнными результатами этапов. False — квеста нет.
+        """
+        if quest_id in self._runs:
+            return True
+        record = await self.db(self.store.get, quest_id, False)
+        if record is None:
+            return False
+        if record["status"] == RUNNING:
+            if self._closing or not await self._claim(quest_id):
+                # Квест генерирует другой воркер: follow() читает его журнал
+                return True
+            stored = await self.db(self.store.events, quest_id, 0)
+            if quest_id in self._runs:
+                # Пока читали журнал, квест уже продолжил параллельный запрос
+                return True
+            logger.info(f"Resuming quest {quest_id} from {len(stored)} stored events")
+            events = [event for _, event in stored]
+            scenes_done = "scenes" in stage_results(events)
+            run = _Run(
+                next_seq=(stored[-1][0] if stored else 0) + 1,
+                # Сцены неполного этапа отменяются: новые пишутся, даже если совпадают со старыми
+                stored={_event_key(event) for event in events if scenes_done or event.get("type") != "scene"},
+            )
+            self._runs[quest_id] = run
+            self._launch(quest_id, run, record["request"], events, pacing)
+        return True
+
+    def _launch(self, quest_id: str, run: _Run, request_data: Dict[str, Any],
+                stored: List[Dict[str, Any]], pacing: float) -> None:
+        run.task = asyncio.create_task(self._produce(quest_id, run, request_data, stored, pacing))
+        if self.shared is not None and self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._renew_leases())
+
+    def _forget(self, quest_id: str, run: _Run) -> None:
+        if self._runs.get(quest_id) is run:
+            del self._runs[quest_id]
+        if run.key is not None and self._inflight.get(run.key) == quest_id:
+            del self._inflight[run.key]
+
+    def _publish(self, run: _Run, item: Optional[Tuple[Optional[int], Dict[str, Any]]]) -> None:
+        for subscriber in run.subscribers:
+            if subscriber.lagged:
+                continue
+            try:
+                subscriber.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                # Медленный клиент не задерживает остальных: он догонит по журналу,
+                # потеряв только partial-события
+                subscriber.lagged = True
+
+    async def _record(self, quest_id: str, run: _Run, event: Dict[str, Any]) -> None:
+        seq = run.next_seq
+        run.next_seq += 1
+        # Сначала журнал, потом подписчики: follow() сверяет одно с другим по seq
+        await self.db(self.store.append_event, quest_id, seq, event)
+        self._publish(run, (seq, event))
+
+    async def _produce(self, quest_id: str, run: _Run, request_data: Dict[str, Any],
+                       stored: List[Dict[str, Any]], pacing: float) -> Optional[Dict[str, Any]]:
+        # Все записи генерации, в том числе из этапов и пула, помечаются id квеста
+        log_context.begin(quest_id=quest_id)
+        quest = new_quest(request_data)
+        for event in stored:
+            apply_event(quest, event)
+        try:
+            if partial_scenes(stored):
+                apply_event(quest, SCENES_RESET_EVENT)
+                await self._record(quest_id, run, SCENES_RESET_EVENT)
+            async for event in self.producer(request_data, stage_results(stored), pacing):
+                if event.get("type") in EPHEMERAL_EVENTS:
+                    run.queued = event if event.get("type") == "queue" else None
+                    self._publish(run, (None, event))
+                    continue
+                run.queued = None
+                # При продолжении готовые этапы выдаются повторно — они уже в журнале
+                if _event_key(event) in run.stored:
+                    continue
+                apply_event(quest, event)
+                await self._record(quest_id, run, event)
+            await self.db(self.store.finish, quest_id, COMPLETED, quest)
+            return quest
+        except asyncio.CancelledError:
+            # Остановка сервера: квест остаётся RUNNING и продолжится при переподключении
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при генерации квеста {quest_id}: {e}")
+            await self._record(quest_id, run, {"type": "error", "content": f"Ошибка: {str(e)}"})
+            await self.db(self.store.finish, quest_id, FAILED, quest)
+            return None
+        finally:
+            run.finished = True
+            self._publish(run, None)
+            self._forget(quest_id, run)
+            await self._release(quest_id, run)
+
+    async def follow(self, quest_id: str, after: int = 0) -> AsyncIterator[Tuple[Optional[int], Dict[str, Any]]]:
+        """События квеста после seq `after`: сначала из журнала, затем новые до конца генерации"""
+        subscriber = _Subscriber(asyncio.Queue(maxsize=self.subscriber_buffer))
+        run = self._runs.get(quest_id)
+        if run is not None:
+            run.subscribers.append(subscriber)
+        last = after
+        try:
+            for seq, event in await self.db(self.store.events, quest_id, after):
+                last = seq
+                yield seq, event
+            if run is None:
+                # Квест идёт у другого воркера или брошен им — читаем журнал, при надобности продолжаем
+                if self._distributed and await self._running(quest_id):
+                    async for item in self._follow_remote(quest_id, last):
+                        yield item
+                return
+            # Подписавшийся во время ожидания сразу узнаёт свою позицию в очереди
+            if run.queued is not None and subscriber.queue.empty():
+                yield None, run.queued
+            while True:
+                if subscriber.lagged and subscriber.queue.empty():
+                    # Всё записанное до снятия флага есть в журнале, новое снова пойдёт в очередь
+                    finished = run.finished
+                    subscriber.lagged = False
+                    for seq, event in await self.db(self.store.events, quest_id, last):
+                        last = seq
+                        yield seq, event
+                    if finished:
+                        return
+                    continue
+                item = await subscriber.queue.get()
+                if item is None:
+                    return
+                seq, event = item
+                # Событие могло попасть и в журнал, и в очередь
+                if seq is not None:
+                    if seq <= last:
+                        continue
+                    last = seq
+                yield seq, event
+        finally:
+            if run is not None and subscriber in run.subscribers:
+                run.subscribers.remove(subscriber)
+
+    async def _follow_remote(self, quest_id: str, after: int) -> AsyncIterator[Tuple[Optional[int], Dict[str, Any]]]:
+        """
+        Квест другого воркера: новые события читаются из журнала раз в poll_interval.
+        Если владелец пропал, квест продолжается здесь же. Без partial и queue — их нет в журнале
+        """
+        last = after
+        while True:
+            for seq, event in await self.db(self.store.events, quest_id, last):
+                last = seq
+                yield seq, event
+            if quest_id in self._runs:
+                async for item in self.follow(quest_id, last):
+                    yield item
+                return
+            record = await self.db(self.store.get, quest_id, False)
+            if record is None or record["status"] != RUNNING:
+                # События, записанные между чтением журнала и сменой статуса
+                for seq, event in await self.db(self.store.events, quest_id, last):
+                    yield seq, event
+                return
+            if self._closing:
+                yield None, RECONNECT_EVENT
+                return
+            if not await self._owned_elsewhere(quest_id):
+                logger.info(f"Quest {quest_id} lost its owner, taking over")
+                await self.resume(quest_id)
+                continue
+            await asyncio.sleep(self.poll_interval)
+
+    async def drain(self, timeout: float) -> None:
+        """
+        Остановка воркера: новые квесты не продолжаются, идущим даётся timeout секунд.
+        Оставшиеся прерываются (квест остаётся RUNNING, аренда отпускается), подписчики
+        получают RECONNECT_EVENT и продолжают у другого воркера по Last-Event-ID
+        """
+        self._closing = True
+        tasks = [run.task for run in self._runs.values() if run.task is not None]
+        if tasks:
+            logger.info(f"Draining {len(tasks)} running quest(s), up to {timeout:.0f}s")
+            await asyncio.wait(tasks, timeout=timeout)
+        for run in list(self._runs.values()):
+            self._publish(run, (None, RECONNECT_EVENT))
+        await self.stop()
+
+    async def stop(self) -> None:
+        tasks = [run.task for run in self._runs.values() if run.task is not None]
+        if self._heartbeat is not None:
+            tasks.append(self._heartbeat)
+            self._heartbeat = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,81 @@
+"""
+Точечный ремонт ответа модели: валидные объекты сохраняются, недостающие
+перезапрашиваются коротким корректирующим промптом вместо замены всего этапа заглушками
+"""
+
+from typing import Any, Dict, List, Tuple
+
+# Ошибок в корректирующем промпте не больше этого — промпт должен оставаться коротким
+MAX_PROMPT_ERRORS = 8
+
+
+def expected_ids(prefix: str, count: int) -> List[str]:
+    return [f"{prefix}_{i + 1}" for i in range(count)]
+
+
+def missing_ids(items: List[Dict], expected: List[str]) -> List[str]:
+    """
+    id, которых не хватает до ожидаемого числа объектов. Объекты с «чужими» id
+    тоже засчитываются: важно количество, а не совпадение нумерации.
+    """
+    have = {str(item.get("id")) for item in items}
+    shortage = len(expected) - len(items)
+    if shortage <= 0:
+        return []
+    return [item_id for item_id in expected if item_id not in have][:shortage]
+
+
+def merge(items: List[Dict], fresh: List[Dict], missing: List[str]) -> int:
+    """
+    Добавляет в items исправленные объекты на места недостающих id (список missing
+    уменьшается на месте). Объект с неожиданным id получает первый свободный id.
+    Возвращает число добавленных объектов.
+    """
+    added = 0
+    for item in fresh:
+        if not missing:
+            break
+        item_id = str(item.get("id"))
+        if item_id in missing:
+            missing.remove(item_id)
+        else:
+            item["id"] = item_id = missing.pop(0)
+        items.append(item)
+        added += 1
+    return added
+
+
+def restore_order(items: List[Dict], expected: List[str]) -> List[Dict]:
+    """Возвращает объекты в порядке ожидаемых id, если модель не придумала своих"""
+    position = {item_id: k for k, item_id in enumerate(expected)}
+    if not all(str(item.get("id")) in position for item in items):
+        return items
+    return sorted(items, key=lambda item: position[str(item.get("id"))])
+
+
+def repair_prompt(data_type: str, missing: List[str], errors: List[str],
+                  required_fields: List[str], context: str = "") -> str:
+    """Короткий корректирующий промпт: только ошибки и то, что нужно досоздать"""
+    shown = errors[:MAX_PROMPT_ERRORS]
+    if len(errors) > len(shown):
+        shown.append(f"... и ещё {len(errors) - len(shown)}")
+    problems = "\n".join(f"- {error}" for error in shown) or "- не хватает объектов"
+    return f"""В предыдущем ответе ({data_type}) были ошибки:
+{problems}
+
+Создай заново ТОЛЬКО объекты с id: {", ".join(missing)}.
+Обязательные непустые поля: {", ".join(required_fields)}.
+{context}
+Верни ТОЛЬКО JSON массив, никакого дополнительного текста!"""
+
+
+def backoff_delay(attempt: int, base: float) -> float:
+    """Экспоненциальная пауза перед попыткой attempt (с 1): base, 2*base, 4*base, ..."""
+    return base * (2 ** (attempt - 1))
+
+
+def fill_from_fallback(items: List[Dict], missing: List[str], fallback: List[Dict[str, Any]]) -> Tuple[List[Dict], int]:
+    """Оставшиеся пробелы закрываются заглушками с теми же id. Возвращает (items, число заглушек)"""
+    by_id = {str(item["id"]): item for item in fallback}
+    filled = [by_id[item_id] for item_id in missing if item_id in by_id]
+    return items + filled, len(filled)
@@ -0,0 +1,238 @@
+"""
+Граф сцен квеста: ремонт ссылок, достижимость, концовки и метрики за O(V+E)
+"""
+
+import bisect
+import logging
+from collections import deque
+from typing import Any, Dict, List, Tuple
+
+import log_context
+
+logger = logging.getLogger(__name__)
+
+CONTINUE_TEXT = "Продолжить путь"
+
+
+def _adjacency(scenes: List[Dict], index: Dict[str, int]) -> List[List[int]]:
+    return [
+        [index[choice["next_scene_id"]] for choice in scene["choices"]]
+        for scene in scenes
+    ]
+
+
+def _bfs(adj: List[List[int]], sources: List[int]) -> List[int]:
+    """Расстояния от источников (-1 — недостижимо)"""
+    dist = [-1] * len(adj)
+    queue = deque()
+    for source in sources:
+        if dist[source] == -1:
+            dist[source] = 0
+            queue.append(source)
+    while queue:
+        node = queue.popleft()
+        for nxt in adj[node]:
+            if dist[nxt] == -1:
+                dist[nxt] = dist[node] + 1
+                queue.append(nxt)
+    return dist
+
+
+def strongly_connected_components(adj: List[List[int]]) -> List[List[int]]:
+    """Итеративный алгоритм Тарьяна. Компоненты идут в обратном топологическом порядке (стоки первыми)"""
+    n = len(adj)
+    order = [-1] * n
+    low = [0] * n
+    on_stack = [False] * n
+    stack: List[int] = []
+    components: List[List[int]] = []
+    counter = 0
+
+    for root in range(n):
+        if order[root] != -1:
+            continue
+        work = [(root, 0)]
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        while work:
+            node, edge = work[-1]
+            if edge < len(adj[node]):
+                work[-1] = (node, edge + 1)
+                nxt = adj[node][edge]
+                if order[nxt] == -1:
+                    order[nxt] = low[nxt] = counter
+                    counter += 1
+                    stack.append(nxt)
+                    on_stack[nxt] = True
+                    work.append((nxt, 0))
+                elif on_stack[nxt]:
+                    low[node] = min(low[node], order[nxt])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == order[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+    return components
+
+
+def _add_link(scene: Dict, target_id: str) -> None:
+    choices = scene["choices"]
+    choices.append({
+        "id": f"choice_{scene['id']}_{len(choices) + 1}",
+        "text": CONTINUE_TEXT,
+        "next_scene_id": target_id,
+        "consequence": None,
+    })
+    scene["is_ending"] = False
+
+
+def graph_metrics(scenes: List[Dict]) -> Dict[str, Any]:
+    """Глубина, ветвление, число концовок и циклов для уже корректного графа"""
+    if not scenes:
+        return {"scenes": 0, "choices": 0, "endings": 0, "depth": 0,
+                "avg_branching": 0.0, "max_branching": 0, "cycles": 0, "unreachable": 0}
+
+    index = {scene["id"]: i for i, scene in enumerate(scenes)}
+    adj = [
+        [index[c["next_scene_id"]] for c in scene.get("choices") or [] if c.get("next_scene_id") in index]
+        for scene in scenes
+    ]
+    dist = _bfs(adj, [0])
+    branching = [len(edges) for edges in adj if edges]
+    cycles = sum(
+        1 for component in strongly_connected_components(adj)
+        if len(component) > 1 or component[0] in adj[component[0]]
+    )
+    return {
+        "scenes": len(scenes),
+        "choices": sum(len(edges) for edges in adj),
+        "endings": sum(1 for scene in scenes if scene.get("is_ending")),
+        "depth": max(dist),
+        "avg_branching": round(sum(branching) / len(branching), 2) if branching else 0.0,
+        "max_branching": max(branching, default=0),
+        "cycles": cycles,
+        "unreachable": sum(1 for d in dist if d == -1),
+    }
+
+
+def repair_scene_graph(scenes: List[Dict]) -> Tuple[List[Dict], Dict[str, Any]]:
+    """
+    Исправляет граф сцен на месте и возвращает (scenes, метрики).
+    После ремонта: все ссылки ведут на существующие сцены, каждая сцена достижима
+    из первой, из каждой сцены достижима концовка, у концовок нет выборов.
+    """
+    if not scenes:
+        return scenes, graph_metrics(scenes)
+
+    fixed_refs = added_links = new_endings = 0
+
+    # Уникальные строковые id
+    index: Dict[str, int] = {}
+    for i, scene in enumerate(scenes):
+        scene_id = str(scene["id"])
+        if scene_id in index:
+            scene_id = f"{scene_id}_{i + 1}"
+        scene["id"] = scene_id
+        index[scene_id] = i
+
+    # Ссылки: битая ссылка ведёт на следующую по порядку сцену, у последней — выбор удаляется
+    for i, scene in enumerate(scenes):
+        choices = []
+        for choice in scene.get("choices") or []:
+            if not isinstance(choice, dict):
+                continue
+            target = choice.get("next_scene_id")
+            target = str(target) if target is not None else None
+            # Петля на себя тоже считается битой, если есть куда вести дальше
+            if target not in index or (target == scene["id"] and i + 1 < len(scenes)):
+                fixed_refs += 1
+                if i + 1 >= len(scenes):
+                    continue
+                target = scenes[i + 1]["id"]
+            choice["next_scene_id"] = target
+            choices.append(choice)
+        scene["choices"] = choices
+        if not choices:
+            if not scene.get("is_ending"):
+                new_endings += 1
+            scene["is_ending"] = True
+        else:
+            # Выборы важнее флага модели: сцена с выборами — не концовка
+            scene["is_ending"] = False
+
+    # Достижимость из первой сцены: недостижимую сцену подвешиваем
+    # к последней достижимой не-концовке перед ней
+    adj = _adjacency(scenes, index)
+    reachable = [d != -1 for d in _bfs(adj, [0])]
+    anchor = 0
+    for i, scene in enumerate(scenes):
+        if not reachable[i]:
+            _add_link(scenes[anchor], scene["id"])
+            adj[anchor].append(i)
+            added_links += 1
+            # Дозакрашиваем то, что стало достижимо через новую сцену
+            queue = deque([i])
+            reachable[i] = True
+            while queue:
+                node = queue.popleft()
+                for nxt in adj[node]:
+                    if not reachable[nxt]:
+                        reachable[nxt] = True
+                        queue.append(nxt)
+        if not scene.get("is_ending"):
+            anchor = i
+
+    # Хотя бы одна концовка: лист BFS-дерева можно сделать концовкой, не теряя достижимость
+    if not any(scene.get("is_ending") for scene in scenes):
+        dist = _bfs(adj, [0])
+        leaf = max(range(len(scenes)), key=lambda k: (dist[k], k))
+        scenes[leaf]["choices"] = []
+        scenes[leaf]["is_ending"] = True
+        adj[leaf] = []
+        new_endings += 1
+
+    # Из каждой сцены должна достигаться концовка. Обходим компоненты сильной
+    # связности от стоков: одна ссылка из «запертой» компоненты спасает и всех её предков
+    reverse: List[List[int]] = [[] for _ in scenes]
+    for node, edges in enumerate(adj):
+        for nxt in edges:
+            reverse[nxt].append(node)
+    endings = [i for i, scene in enumerate(scenes) if scene.get("is_ending")]
+    can_finish = [d != -1 for d in _bfs(reverse, endings)]
+
+    for component in strongly_connected_components(adj):
+        node = component[0]
+        if can_finish[node]:
+            continue
+        pos = bisect.bisect_right(endings, node)
+        target = endings[pos] if pos < len(endings) else endings[0]
+        _add_link(scenes[node], scenes[target]["id"])
+        adj[node].append(target)
+        reverse[target].append(node)
+        added_links += 1
+        queue = deque([node])
+        can_finish[node] = True
+        while queue:
+            current = queue.popleft()
+            for prev in reverse[current]:
+                if not can_finish[prev]:
+                    can_finish[prev] = True
+                    queue.append(prev)
+
+    metrics = graph_metrics(scenes)
+    metrics.update(fixed_references=fixed_refs, added_links=added_links, new_endings=new_endings)
+    if fixed_refs or added_links or new_endings:
+        log_context.event(logger, logging.INFO, "scene_graph_repaired", scenes=len(scenes),
+                          fixed_refs=fixed_refs, added_links=added_links, new_endings=new_endings)
+    return scenes, metrics
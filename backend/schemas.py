@@ -0,0 +1,234 @@
+"""
+Схемы объектов квеста и их пакетная проверка. Список объектов этапа проверяется одним
+вызовом TypeAdapter (pydantic-core): типы приводятся (числа в id -> строки, "true" -> True),
+ошибки собираются по каждому объекту. Адаптеры построены на TypedDict-зеркалах моделей —
+те же поля и ограничения, но результат сразу словари, без создания и выгрузки моделей
+"""
+
+from collections import defaultdict
+from typing import Annotated, Any, Dict, List, Optional, Tuple, Type, get_args, get_origin
+
+from pydantic import BaseModel, ConfigDict, StringConstraints, TypeAdapter, ValidationError
+from typing_extensions import NotRequired, TypedDict
+
+# Обязательные текстовые поля не могут быть пустыми — как и в проверке по списку полей
+Text = Annotated[str, StringConstraints(min_length=1)]
+
+
+class QuestObject(BaseModel):
+    # Модель нередко пишет id числом: 3 -> "3", дальше граф сцен сам починит ссылку
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+
+class Character(QuestObject):
+    id: Text
+    name: Text
+    role: Text
+    description: Text
+    motivation: Optional[str] = None
+    is_ally: Optional[bool] = None
+    is_enemy: Optional[bool] = None
+
+
+class Location(QuestObject):
+    id: Text
+    name: Text
+    description: Text
+
+
+class Item(QuestObject):
+    id: Text
+    name: Text
+    description: Text
+    is_key: Optional[bool] = None
+    effect: Optional[str] = None
+
+
+class Choice(QuestObject):
+    id: Optional[str] = None  # нет — выдаётся по сцене и номеру выбора (number_choices)
+    text: str
+    next_scene_id: str
+    consequence: Optional[str] = None
+
+
+class Scene(QuestObject):
+    id: Text
+    title: Text
+    description: Text
+    location_id: Text
+    characters: Optional[List[str]] = None
+    items: Optional[List[str]] = None
+    choices: List[Choice]
+    is_ending: Optional[bool] = None
+
+
+class QuestPayload(BaseModel):
+    """Квест целиком — схема для one-shot генерации через параметр format Ollama"""
+    description: str
+    characters: List[Character]
+    locations: List[Location]
+    items: List[Item]
+    scenes: List[Scene]
+
+
+def _dict_type(annotation: Any) -> Any:
+    # Вложенные модели (выборы сцены) тоже проверяются как словари
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return as_typed_dict(annotation)
+    args = get_args(annotation)
+    if args and get_origin(annotation) in (list, List):
+        return List[_dict_type(args[0])]
+    return annotation
+
+
+def as_typed_dict(model: Type[BaseModel], **overrides: Any) -> Any:
+    """
+    TypedDict с полями, ограничениями и настройками модели; необязательные поля — NotRequired.
+    overrides — другие типы для отдельных полей
+    """
+    fields = {}
+    for name, info in model.model_fields.items():
+        annotation = overrides[name] if name in overrides else _dict_type(info.annotation)
+        if info.metadata:
+            annotation = Annotated[(annotation, *info.metadata)]
+        fields[name] = annotation if info.is_required() else NotRequired[annotation]
+    typed = TypedDict(f"{model.__name__}Dict", fields)
+    typed.__pydantic_config__ = model.model_config
+    return typed
+
+
+MODELS: Dict[str, Type[QuestObject]] = {"character": Character, "location": Location, "item": Item, "scene": Scene}
+# Выборы и ссылки на персонажей и предметы проверяются отдельно: битый выбор или ссылка
+# стоит только себя, а не всей сцены (как и раньше, когда выбор отбрасывал ремонт графа).
+# Поэтому в схеме сцены — просто массивы
+SCENE_LISTS = {"choices": List[Any], "characters": Optional[List[Any]], "items": Optional[List[Any]]}
+ADAPTERS = {
+    data_type: TypeAdapter(List[as_typed_dict(model, **(SCENE_LISTS if model is Scene else {}))])
+    for data_type, model in MODELS.items()
+}
+CHOICES = TypeAdapter(List[as_typed_dict(Choice)])
+REQUIRED = {
+    data_type: frozenset(name for name, info in model.model_fields.items() if info.is_required())
+    for data_type, model in MODELS.items()
+}
+
+
+def adapter_for(data_type: str, required_fields: List[str]) -> Optional[TypeAdapter]:
+    """
+    Адаптер этапа, если обязательные поля схемы совпадают с запрошенными. Сцены окна
+    большого квеста (только тексты, связи — из скелета) схеме не соответствуют и
+    проверяются по списку полей
+    """
+    if REQUIRED.get(data_type) != frozenset(required_fields):
+        return None
+    return ADAPTERS[data_type]
+
+
+def number_choices(scenes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Выборам без id выдаётся id по сцене и номеру выбора"""
+    for scene in scenes:
+        for k, choice in enumerate(scene["choices"], 1):
+            if not choice.get("id"):
+                choice["id"] = f"choice_{scene['id']}_{k}"
+    return scenes
+
+
+def _validate(adapter: TypeAdapter, data: List[Any]) -> Tuple[List[Dict[str, Any]], Dict[int, List[Dict[str, Any]]]]:
+    """
+    (валидные объекты, ошибки pydantic по индексам невалидных). Обычный случай — один
+    вызов на весь список; если что-то не прошло, оставшиеся объекты проверяются ещё раз
+    одним вызовом — объекты независимы, поэтому он уже без ошибок
+    """
+    failures: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    try:
+        valid = adapter.validate_python(data)
+    except ValidationError as e:
+        for error in e.errors(include_url=False, include_input=False):
+            failures[error["loc"][0]].append(error)
+        valid = adapter.validate_python([item for i, item in enumerate(data) if i not in failures])
+    return valid, dict(failures)
+
+
+def drop_invalid_choices(scenes: List[Dict[str, Any]]) -> int:
+    """
+    Отбрасывает невалидные выборы (не объект, нет text или next_scene_id), сцены остаются.
+    Выборы всех сцен проверяются одним вызовом. Возвращает число отброшенных
+    """
+    flat = [choice for scene in scenes for choice in scene["choices"]]
+    valid, failures = _validate(CHOICES, flat)
+    checked = iter(valid)
+    index = 0
+    for scene in scenes:
+        kept = []
+        for _ in scene["choices"]:
+            if index not in failures:
+                kept.append(next(checked))
+            index += 1
+        scene["choices"] = kept
+    return len(failures)
+
+
+def reference(value: Any) -> Optional[str]:
+    """id в ссылке сцены: строка, число приводится к строке (как id объектов); иное — None"""
+    if isinstance(value, str):
+        return value or None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+
+def drop_invalid_references(scenes: List[Dict[str, Any]]) -> int:
+    """Отбрасывает ссылки на персонажей и предметы, которые не являются id. Возвращает их число"""
+    dropped = 0
+    for scene in scenes:
+        for name in ("characters", "items"):
+            refs = scene.get(name)
+            if refs is None:
+                continue
+            kept = [ref for ref in map(reference, refs) if ref is not None]
+            dropped += len(refs) - len(kept)
+            scene[name] = kept
+    return dropped
+
+
+def validate_batch(data_type: str, adapter: TypeAdapter, data: List[Any]) -> Tuple[List[Dict[str, Any]], Dict[int, List[Dict[str, Any]]], Dict[str, int]]:
+    """
+    (валидные объекты, ошибки pydantic по индексам невалидных, число отброшенных выборов и
+    ссылок). У сцен невалидные выборы и ссылки отбрасываются по одному, выборам без id выдаётся id
+    """
+    valid, failures = _validate(adapter, data)
+    dropped: Dict[str, int] = {}
+    if data_type == "scene":
+        dropped = {"choices": drop_invalid_choices(valid), "references": drop_invalid_references(valid)}
+        number_choices(valid)
+    return valid, failures, {kind: count for kind, count in dropped.items() if count}
+
+
+def _path(loc: Tuple[Any, ...]) -> str:
+    return ".".join(str(part) for part in loc)
+
+
+def describe(index: int, item: Any, errors: List[Dict[str, Any]]) -> Tuple[str, str]:
+    """
+    (причина для лога, описание для корректирующего промпта) по ошибкам одного объекта.
+    Причины совпадают с проверкой по списку полей: missing(поле), empty(поле), not_list(поле), not_object
+    """
+    if not isinstance(item, dict):
+        return "not_object", f"элемент {index + 1} не является объектом"
+    label = item.get("id", f"элемента {index + 1}")
+    reasons, problems = [], []
+    for error in errors:
+        path, kind = _path(error["loc"][1:]), error["type"]
+        if kind == "missing":
+            reasons.append(f"missing({path})")
+            problems.append(f"нет поля '{path}'")
+        elif kind == "string_too_short":
+            reasons.append(f"empty({path})")
+            problems.append(f"пустое поле '{path}'")
+        elif kind == "list_type":
+            reasons.append(f"not_list({path})")
+            problems.append(f"поле '{path}' должно быть массивом")
+        else:
+            reasons.append(f"{kind}({path})")
+            problems.append(f"поле '{path}': {error['msg']}")
+    return reasons[0], f"у {label} " + ", ".join(problems)
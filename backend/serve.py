@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Продакшн-запуск SCreate: несколько процессов uvicorn на одном порту с общим состоянием
+и плавной остановкой.
+
+    python serve.py --workers 4 --port 8000
+
+Воркеры делят слушающий сокет. Здоровье Ollama, аренды квестов и пакетов хранятся
+в SHARED_STATE_URL (при --workers > 1 по умолчанию sqlite:///shared_state.db), кэш этапов —
+в CACHE_DB_PATH (по умолчанию stage_cache.db). Упавший воркер перезапускается.
+По SIGTERM/SIGINT воркер перестаёт принимать соединения, даёт идущим квестам DRAIN_TIMEOUT
+секунд, а оставшиеся SSE-потоки закрывает событием reconnect — клиент продолжает у другого
+воркера по Last-Event-ID. Для разработки — run.py с автоперезагрузкой.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from typing import Any, List, Optional
+
+import uvicorn
+
+import config
+import log_context
+
+logger = logging.getLogger("serve")
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn.Server, который перед закрытием соединений дожидается квестов приложения"""
+
+    async def shutdown(self, sockets: Optional[List[socket.socket]] = None) -> None:
+        # Сначала перестаём принимать соединения — новые запросы уходят другим воркерам
+        for server in self.servers:
+            server.close()
+        for sock in sockets or []:
+            sock.close()
+        if not self.force_exit:
+            from main import drain
+
+            await drain(config.DRAIN_TIMEOUT)
+        await super().shutdown(sockets)
+
+
+def run_worker(server_config: uvicorn.Config, sockets: List[socket.socket]) -> None:
+    DrainingServer(server_config).run(sockets=sockets)
+
+
+def supervise(server_config: uvicorn.Config, workers: int) -> None:
+    """Запускает воркеры на общем сокете, перезапускает упавшие, по сигналу останавливает все"""
+    sock = server_config.bind_socket()
+    context = multiprocessing.get_context("spawn")
+    stop = threading.Event()
+
+    def spawn() -> Any:
+        process = context.Process(target=run_worker, args=(server_config, [sock]))
+        process.start()
+        logger.info(f"Started worker [{process.pid}]")
+        return process
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    processes = [spawn() for _ in range(workers)]
+    while not stop.wait(0.5):
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                logger.warning(f"Worker [{process.pid}] exited with code {process.exitcode}, restarting")
+                processes[i] = spawn()
+
+    # SIGTERM: каждый воркер проходит плавную остановку, поэтому ждём их без таймаута
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join()
+    sock.close()
+    logger.info("All workers stopped")
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--log-level", default=config.LOG_LEVEL.lower())
+    args = parser.parse_args()
+
+    log_context.configure(config.LOG_LEVEL, config.LOG_FORMAT)
+    if args.workers > 1:
+        # Воркеры — отдельные процессы (spawn) и читают настройки из окружения сами
+        if config.SHARED_STATE_URL == "memory":
+            os.environ["SHARED_STATE_URL"] = "sqlite:///shared_state.db"
+        os.environ.setdefault("CACHE_DB_PATH", "stage_cache.db")
+        for name, path in (("QUEST_DB_PATH", config.QUEST_DB_PATH), ("BATCH_DB_PATH", config.BATCH_DB_PATH)):
+            if path == ":memory:":
+                logger.warning(f"{name}=:memory: is private to each worker; quests will not be shared")
+
+    server_config = uvicorn.Config(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        log_level=args.log_level,
+        # Потоки уже закрыты drain(); остаток — на обычные запросы
+        timeout_graceful_shutdown=5,
+    )
+    if args.workers > 1:
+        supervise(server_config, args.workers)
+    else:
+        DrainingServer(server_config).run()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,158 @@
+"""
+Общее состояние процессов сервера: значения с TTL и аренды (lease). Аренда — кто сейчас
+отвечает за квест, пакет или проверку Ollama: владелец продлевает её, а если процесс
+умер, аренда истекает и её забирает другой. MemoryState — один процесс (по умолчанию),
+SQLiteState — несколько воркеров с общим файлом базы.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple, Union
+
+# Владелец аренд этого процесса. Случайный суффикс — чтобы процесс с тем же pid после
+# перезапуска не считал чужие истёкшие аренды своими
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class MemoryState:
+    """Состояние в памяти процесса: аренды всегда у него самого, чужих владельцев нет"""
+
+    distributed = False
+
+    def __init__(self) -> None:
+        # key -> (value, owner, expires)
+        self._data: Dict[str, Tuple[Any, Optional[str], float]] = {}
+
+    def _live(self, key: str) -> Optional[Tuple[Any, Optional[str], float]]:
+        entry = self._data.get(key)
+        if entry is not None and entry[2] <= time.time():
+            del self._data[key]
+            return None
+        return entry
+
+    async def get(self, key: str) -> Any:
+        entry = self._live(key)
+        return entry[0] if entry is not None else None
+
+    async def put(self, key: str, value: Any, ttl: float) -> None:
+        self._data[key] = (value, None, time.time() + ttl)
+
+    async def acquire(self, key: str, owner: str, ttl: float, value: Any = None) -> bool:
+        entry = self._live(key)
+        if entry is not None and entry[1] != owner:
+            return False
+        if value is None and entry is not None:
+            value = entry[0]
+        self._data[key] = (value, owner, time.time() + ttl)
+        return True
+
+    async def release(self, key: str, owner: str) -> None:
+        entry = self._data.get(key)
+        if entry is not None and entry[1] == owner:
+            del self._data[key]
+
+    async def owner(self, key: str) -> Optional[str]:
+        entry = self._live(key)
+        return entry[1] if entry is not None else None
+
+    def close(self) -> None:
+        self._data.clear()
+
+
+class SQLiteState:
+    """
+    Состояние в SQLite-файле, общем для процессов. Захват аренды — в транзакции
+    BEGIN IMMEDIATE, поэтому два процесса не получат одну аренду одновременно.
+    Вызовы синхронные, асинхронные обёртки выносят их в поток.
+    """
+
+    distributed = True
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_state ("
+            "key TEXT PRIMARY KEY, value TEXT, owner TEXT, expires REAL NOT NULL)"
+        )
+        self._lock = asyncio.Lock()
+
+    def _get(self, key: str) -> Tuple[Any, Optional[str]]:
+        row = self._conn.execute(
+            "SELECT value, owner FROM shared_state WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None, None
+        return (json.loads(row[0]) if row[0] is not None else None), row[1]
+
+    def _put(self, key: str, value: Any, ttl: float) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, owner, expires) VALUES (?, ?, NULL, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time() + ttl),
+        )
+
+    def _acquire(self, key: str, owner: str, ttl: float, value: Any) -> bool:
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT value, owner FROM shared_state WHERE key = ? AND expires > ?", (key, now)
+            ).fetchone()
+            if row is not None and row[1] != owner:
+                self._conn.execute("ROLLBACK")
+                return False
+            stored = json.dumps(value, ensure_ascii=False) if value is not None else (row[0] if row else None)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, owner, expires) VALUES (?, ?, ?, ?)",
+                (key, stored, owner, now + ttl),
+            )
+            self._conn.execute("COMMIT")
+            return True
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _release(self, key: str, owner: str) -> None:
+        self._conn.execute("DELETE FROM shared_state WHERE key = ? AND owner = ?", (key, owner))
+
+    async def _call(self, func: Any, *args: Any) -> Any:
+        async with self._lock:
+            return await asyncio.to_thread(func, *args)
+
+    async def get(self, key: str) -> Any:
+        value, _ = await self._call(self._get, key)
+        return value
+
+    async def put(self, key: str, value: Any, ttl: float) -> None:
+        await self._call(self._put, key, value, ttl)
+
+    async def acquire(self, key: str, owner: str, ttl: float, value: Any = None) -> bool:
+        return await self._call(self._acquire, key, owner, ttl, value)
+
+    async def release(self, key: str, owner: str) -> None:
+        await self._call(self._release, key, owner)
+
+    async def owner(self, key: str) -> Optional[str]:
+        _, owner = await self._call(self._get, key)
+        return owner
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+SharedState = Union[MemoryState, SQLiteState]
+
+
+def open_state(url: str) -> SharedState:
+    """memory (по умолчанию) или sqlite:///путь/к/файлу.db"""
+    if not url or url == "memory":
+        return MemoryState()
+    if url.startswith("sqlite:///"):
+        return SQLiteState(url[len("sqlite:///"):])
+    raise ValueError(f"unsupported SHARED_STATE_URL '{url}': expected 'memory' or 'sqlite:///path'")
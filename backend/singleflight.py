@@ -0,0 +1,43 @@
+"""
+Single-flight: одновременные одинаковые вызовы разделяют одно выполнение
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """
+    Первый вызов с ключом запускает func в отдельной задаче, остальные ждут её же.
+    Отмена одного из ожидающих не отменяет общую задачу — её результат нужен остальным.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, "asyncio.Task[Any]"] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def _done(self, key: str, task: "asyncio.Task[Any]") -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Ошибку забирают ожидающие; если их не осталось, не шумим в лог asyncio
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Возвращает (результат, shared): shared=True, если вызов присоединился к чужому"""
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.create_task(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        return await asyncio.shield(task), shared
+
+    async def cancel(self) -> None:
+        """Отменяет все идущие вызовы — при остановке, когда их результат уже никому не нужен"""
+        tasks = list(self._calls.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)